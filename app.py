@@ -1,35 +1,63 @@
-from app.tracing import tracer
+from app.tracing import start_span
 from app.settings import Settings
 import argparse
 
-from app.commands.index_command import index_command
-from app.commands.query_command import query_command
-from app.commands.chat_command import chat_command
+# Command modules are imported when dispatched, so each command only loads the libraries it needs
 
 def main() -> None:
     settings, unknown_args = Settings.from_env_and_args()
     print(f"Using settings: {settings}")
 
+    if settings.clear_embedding_cache:
+        from app.embeddings import clear_embedding_cache
+        clear_embedding_cache(settings)
+
     parser = argparse.ArgumentParser(description="PromptMind CLI")
     subparsers = parser.add_subparsers(dest="command", required=False)
 
     # Index command
     parser_index = subparsers.add_parser("index", help="Create a vector store index from directories or URLs")
-    parser_index.add_argument("sources", nargs="+", help="Directories or URLs to index")
+    parser_index.add_argument("sources", nargs="*", help="Directories or URLs to index")
+    parser_index.add_argument("--incremental", action="store_true", help="Only re-embed new or changed sources of the existing index")
+    parser_index.add_argument("--shard", help="Build (or with --incremental update) only this shard of the vector store")
+    parser_index.add_argument("--num-shards", type=int,
+                              help="Split the sources across this many shards by a hash of their path. Pass the full corpus, "
+                                   "or with --incremental only the sources to add or update")
+    parser_index.add_argument("--drop-shard", help="Remove this shard from the vector store")
 
     # Query command
     parser_query = subparsers.add_parser("query", help="Query the knowledge base")
-    parser_query.add_argument("prompt", help="Your question")
+    parser_query.add_argument("prompt", nargs="?", help="Your question")
+    parser_query.add_argument("--batch", help="Answer all questions of this JSONL file ({\"id\": ..., \"prompt\": ...} per line)")
+    parser_query.add_argument("--output", help="JSONL file the --batch answers are appended to, questions already in it are skipped")
+    parser_query.add_argument("--retrieval-only", action="store_true", help="Only list the relevant sources, don't generate an answer")
+    parser_query.add_argument("--no-stream", action="store_true", help="Print the answer when it is complete instead of token by token")
+    parser_query.add_argument("--local", action="store_true", help="Don't use a running server, load the index in this process")
+    parser_query.add_argument("--source", help="Only search sources starting with this path or URL, or matching this glob pattern")
+    parser_query.add_argument("--type", help="Only search sources of these comma separated types (file extensions, or url)")
+    parser_query.add_argument("--since", help="Only search sources indexed on or after this date (YYYY-MM-DD or YYYY-MM-DDTHH:MM)")
+    parser_query.add_argument("--until", help="Only search sources indexed before the end of this date")
+
+    # Serve command
+    parser_serve = subparsers.add_parser("serve", help="Keep the index and models loaded and answer queries over HTTP")
+    parser_serve.add_argument("--host", default="127.0.0.1", help="Interface to listen on")
+    parser_serve.add_argument("--port", type=int, default=8765, help="Port to listen on")
 
     args, unknown_args = parser.parse_known_args(unknown_args)
 
     if args.command == "index":
+        from app.commands.index_command import index_command
         index_command(args, settings)
     elif args.command == "query":
+        from app.commands.query_command import query_command
         query_command(args, settings)
+    elif args.command == "serve":
+        from app.commands.serve_command import serve_command
+        serve_command(args, settings)
     else:
+        from app.commands.chat_command import chat_command
         chat_command(settings)
 
 if __name__ == "__main__":
-    with tracer.start_as_current_span("main()"):
+    with start_span("main()"):
         main()
\ No newline at end of file
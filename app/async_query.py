@@ -0,0 +1,100 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Callable, Dict, List, Optional, TypeVar
+import httpx
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.messages import HumanMessage
+from langchain_ollama import ChatOllama
+from app.embeddings import get_embedding
+from app.metrics import measure, record_usage
+from app.search_filter import SearchFilter
+from app.query import build_rag_prompt, lexical_searcher, load_vector_store, retrieve_documents
+from app.settings import Settings
+from app.sharded_store import SearchableStore
+
+# Async counterparts of the query functions, for embedding PromptMind in an asyncio service. Ollama requests share
+# one bounded connection pool per endpoint, and index searches run on one bounded thread pool instead of the loop.
+
+T = TypeVar("T")
+
+_pools: Dict[str, httpx.AsyncHTTPTransport] = {}
+_limits: Dict[str, asyncio.Semaphore] = {}
+_search_executor: Optional[ThreadPoolExecutor] = None
+
+def ollama_pool(base_url: str, concurrency: int = 8) -> httpx.AsyncHTTPTransport:
+    """
+    The connection pool to the Ollama at `base_url`, shared by all async models created for it. At most
+    `concurrency` requests are in flight, further ones wait for a free connection. Use it from one event loop.
+    """
+    if base_url not in _pools:
+        _pools[base_url] = httpx.AsyncHTTPTransport(
+            limits=httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+        )
+        _limits[base_url] = asyncio.Semaphore(concurrency)
+    return _pools[base_url]
+
+def ollama_limit(base_url: str) -> asyncio.Semaphore:
+    """Held while generating, so at most `concurrency` generations are in flight and the others wait their turn"""
+    ollama_pool(base_url)
+    return _limits[base_url]
+
+async def close_ollama_pools() -> None:
+    for pool in _pools.values():
+        await pool.aclose()
+    _pools.clear()
+    _limits.clear()
+
+def search_executor(workers: Optional[int] = None) -> ThreadPoolExecutor:
+    """The threads running index searches for all coroutines, created on first use with `workers` threads"""
+    global _search_executor
+    if _search_executor is None:
+        _search_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="search")
+    return _search_executor
+
+async def run_search(function: Callable[..., T], *args, **kwargs) -> T:
+    return await asyncio.get_running_loop().run_in_executor(search_executor(), partial(function, *args, **kwargs))
+
+def get_async_embedding(settings: Settings) -> Embeddings:
+    pool = ollama_pool(settings.ollama_url, settings.ollama_concurrency)
+    return get_embedding(settings, async_client_kwargs={"transport": pool})
+
+def get_async_llm(settings: Settings) -> ChatOllama:
+    pool = ollama_pool(settings.ollama_url, settings.ollama_concurrency)
+    return ChatOllama(model=settings.llm_model, base_url=settings.ollama_url, temperature=0,
+                      async_client_kwargs={"transport": pool})
+
+async def aload_vector_store(
+    embedding: Embeddings,
+    path: str = "vector_store/",
+    nprobe: Optional[int] = None,
+    ef_search: Optional[int] = None,
+    mmap: bool = False,
+    search_workers: Optional[int] = None,
+) -> SearchableStore:
+    """`load_vector_store` on the search threads, which are started here with `search_workers` threads"""
+    search_executor(search_workers)
+    return await run_search(load_vector_store, embedding, path, nprobe, ef_search, mmap)
+
+async def aretrieve_documents(
+    db: SearchableStore,
+    query: str,
+    top_k: int = 10,
+    min_relevance: float = 0.5,
+    mode: str = "vector",
+    search_filter: Optional[SearchFilter] = None,
+) -> List[Document]:
+    """`retrieve_documents` with the query embedded over the async pool and the index searched on the search threads"""
+    query_embedding = None
+    if mode != "lexical" or lexical_searcher(db) is None:
+        query_embedding = await db.embeddings.aembed_query(query)
+    return await run_search(retrieve_documents, db, query, top_k, min_relevance, query_embedding, mode, search_filter)
+
+async def agenerate_rag_response(llm: ChatOllama, docs: List[Document], query: str, token_budget: Optional[int] = None) -> str:
+    prompt = await run_search(build_rag_prompt, docs, query, token_budget)
+    async with ollama_limit(llm.base_url):
+        with measure("generate"):
+            response = await llm.ainvoke([HumanMessage(content=prompt)])
+    record_usage("generate", response)
+    return response.content
@@ -0,0 +1,193 @@
+import os
+import json
+import time
+import asyncio
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple
+from langchain_core.documents import Document
+from langchain_ollama import ChatOllama
+from app.async_query import aload_vector_store, agenerate_rag_response, close_ollama_pools, get_async_embedding, get_async_llm, run_search
+from app.embeddings import aembed_queries
+from app.query import retrieve_documents, search_embeddings
+from app.search_filter import SearchFilter
+from app.settings import Settings
+from app.sharded_store import SearchableStore
+
+# Questions embedded and searched together. The answers of one window are generated while the next is retrieved.
+BATCH_WINDOW = 256
+TOP_K = 10
+MIN_RELEVANCE = 0.5
+
+def read_questions(path: str) -> List[Dict[str, Any]]:
+    """The questions of a JSONL file: objects with a "prompt" and an optional "id" (default: the line number)"""
+    questions = []
+    with open(path, "r", encoding="utf-8") as f:
+        for number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if isinstance(record, str):
+                record = {"prompt": record}
+            questions.append({"id": str(record.get("id", number)), "prompt": record["prompt"]})
+    return questions
+
+def answered_ids(path: str, retrieval_only: bool = False) -> Set[str]:
+    """
+    Ids already answered in an earlier run, which are skipped when resuming. Failed questions are tried again,
+    so their records are removed from the file first, as is the cut off last line of an interrupted run. Unless
+    `retrieval_only`, so are the records of an earlier --retrieval-only run, which have no answer.
+    """
+    if not os.path.isfile(path):
+        return set()
+    done = set()
+    kept = []
+    with open(path, "r", encoding="utf-8") as f:
+        lines = f.readlines()
+    for line in lines:
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        if "error" not in record and (retrieval_only or "answer" in record):
+            done.add(str(record["id"]))
+            kept.append(line if line.endswith("\n") else line + "\n")
+    if len(kept) < len(lines):
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            f.writelines(kept)
+        os.replace(path + ".tmp", path)
+    return done
+
+def default_output_path(path: str) -> str:
+    root, _ = os.path.splitext(path)
+    return f"{root}.answers.jsonl"
+
+class BatchQuery:
+    """Answers a list of questions with one index load, batched embedding and search, and concurrent generation"""
+
+    def __init__(
+        self,
+        db: SearchableStore,
+        llm: Optional[ChatOllama],
+        settings: Settings,
+        output: Any,
+        search_filter: Optional[SearchFilter] = None,
+    ):
+        self.db = db
+        self.llm = llm
+        self.settings = settings
+        self.output = output
+        self.search_filter = search_filter
+        self.answered = 0
+        self.failed = 0
+        self.stage_ms = {"embed": 0.0, "search": 0.0, "generate": 0.0}
+        self.started = time.perf_counter()
+
+    def write(self, record: Dict[str, Any]) -> None:
+        self.output.write(json.dumps(record) + "\n")
+        self.output.flush()
+
+    async def retrieve(self, questions: List[Dict[str, Any]]) -> Tuple[List[Tuple[List[Document], List[Optional[float]]]], Dict[str, float]]:
+        """The chunks and relevance scores of each question, and each question's share of the embedding and search time"""
+        prompts = [question["prompt"] for question in questions]
+        mode = self.settings.retrieval_mode
+        embeddings: List[Optional[List[float]]] = [None] * len(prompts)
+        started = time.perf_counter()
+        if mode != "lexical":
+            size = self.settings.embed_batch_size
+            batches = await asyncio.gather(*(aembed_queries(self.db.embeddings, prompts[i:i + size])
+                                             for i in range(0, len(prompts), size)))
+            embeddings = [vector for batch in batches for vector in batch]
+        embedded = time.perf_counter()
+        if mode == "vector":
+            results = await run_search(search_embeddings, self.db, embeddings, TOP_K, MIN_RELEVANCE, self.search_filter)
+            retrieved = [([doc for doc, _ in result], [round(score, 4) for _, score in result]) for result in results]
+        else:
+            # Keyword search has no batched form, but it is cheap and needs no model call
+            retrieved = []
+            for prompt, embedding in zip(prompts, embeddings):
+                docs = await run_search(retrieve_documents, self.db, prompt, TOP_K, MIN_RELEVANCE, embedding, mode,
+                                        self.search_filter)
+                retrieved.append((docs, [None] * len(docs)))
+        embed_ms, search_ms = (embedded - started) * 1000, (time.perf_counter() - embedded) * 1000
+        self.stage_ms["embed"] += embed_ms
+        self.stage_ms["search"] += search_ms
+        return retrieved, {"embed_ms": round(embed_ms / len(prompts), 2), "search_ms": round(search_ms / len(prompts), 2)}
+
+    async def answer(self, question: Dict[str, Any], docs: List[Document], scores: List[Optional[float]], timings: Dict[str, float]) -> None:
+        record = {
+            **question,
+            "sources": [doc.metadata.get("source", "unknown") for doc in docs],
+            "scores": scores,
+        }
+        if self.llm is not None:
+            started = time.perf_counter()
+            try:
+                record["answer"] = await agenerate_rag_response(self.llm, docs, question["prompt"],
+                                                                self.settings.context_token_budget)
+            except Exception as e:
+                record["error"] = f"{type(e).__name__}: {e}"
+            timings["generate_ms"] = round((time.perf_counter() - started) * 1000, 2)
+            self.stage_ms["generate"] += timings["generate_ms"]
+        record["timings"] = timings
+        self.write(record)
+        if "error" in record:
+            self.failed += 1
+            print(f"Question {question['id']} failed: {record['error']}")
+        else:
+            self.answered += 1
+
+    async def run(self, questions: List[Dict[str, Any]]) -> None:
+        pending: Deque[asyncio.Future] = deque()
+        try:
+            for start in range(0, len(questions), BATCH_WINDOW):
+                window = questions[start:start + BATCH_WINDOW]
+                retrieved, shared = await self.retrieve(window)
+                pending.append(asyncio.gather(*(self.answer(question, docs, scores, dict(shared))
+                                                for question, (docs, scores) in zip(window, retrieved))))
+                # At most two windows in flight: one generating, the next one queued behind it
+                while len(pending) > 1:
+                    await pending[0]
+                    pending.popleft()
+                    self.print_progress(len(questions))
+            while pending:
+                await pending[0]
+                pending.popleft()
+        finally:
+            # When interrupted, unfinished answers are dropped and generated again on resume
+            for future in pending:
+                future.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+        self.print_progress(len(questions))
+
+    def print_progress(self, total: int) -> None:
+        seconds = time.perf_counter() - self.started
+        done = self.answered + self.failed
+        print(f"{done}/{total} questions done ({self.failed} failed) in {seconds:.1f}s, {done / max(seconds, 1e-9):.1f} questions/s")
+
+    def stats(self) -> str:
+        return ", ".join(f"{stage} {ms / 1000:.1f}s" for stage, ms in self.stage_ms.items()) + " (generation summed over concurrent requests)"
+
+async def run_batch_query(
+    questions_path: str,
+    output_path: str,
+    settings: Settings,
+    retrieval_only: bool = False,
+    search_filter: Optional[SearchFilter] = None,
+) -> None:
+    questions = read_questions(questions_path)
+    done = answered_ids(output_path, retrieval_only)
+    remaining = [question for question in questions if question["id"] not in done]
+    print(f"{len(questions)} questions in {questions_path}, {len(questions) - len(remaining)} already answered in {output_path}")
+    if not remaining:
+        return
+
+    db = await aload_vector_store(get_async_embedding(settings), nprobe=settings.ivf_nprobe, ef_search=settings.hnsw_ef_search,
+                                  mmap=settings.mmap_index, search_workers=settings.search_workers)
+    llm = None if retrieval_only else get_async_llm(settings)
+    try:
+        with open(output_path, "a", encoding="utf-8") as output:
+            batch = BatchQuery(db, llm, settings, output, search_filter)
+            await batch.run(remaining)
+            print(f"Wrote {batch.answered} answers to {output_path}: {batch.stats()}")
+    finally:
+        await close_ollama_pools()
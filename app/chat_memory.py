@@ -0,0 +1,90 @@
+import json
+from typing import Any, Callable, List
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AnyMessage, HumanMessage, RemoveMessage, SystemMessage, ToolMessage
+from app.context import count_tokens, truncate_tokens
+from app.metrics import measure, record_usage
+
+# Older turns are summarized down to this fraction of the history budget, so it isn't needed again every turn
+COMPACT_TO = 0.5
+SUMMARY_PROMPT = (
+    "Summarize the conversation below for your own later reference in at most {words} words. "
+    "Keep the facts, names, numbers and sources the user may refer back to, and the questions still open. "
+    "Write only the summary."
+)
+
+def message_text(message: AnyMessage) -> str:
+    return message.content if isinstance(message.content, str) else json.dumps(message.content)
+
+def message_tokens(message: AnyMessage) -> int:
+    calls = getattr(message, "tool_calls", None)
+    return count_tokens(message_text(message)) + (count_tokens(json.dumps(calls)) if calls else 0)
+
+def trim_tool_output(message: AnyMessage, max_tokens: int) -> AnyMessage:
+    """A tool result cut to `max_tokens`, other messages unchanged"""
+    if not isinstance(message, ToolMessage) or not isinstance(message.content, str):
+        return message
+    text = truncate_tokens(message.content, max_tokens)
+    return message if text == message.content else message.model_copy(update={"content": text + " [...]"})
+
+def turn_starts(messages: List[AnyMessage]) -> List[int]:
+    return [i for i, message in enumerate(messages) if isinstance(message, HumanMessage)]
+
+def prompt_messages(messages: List[AnyMessage], tool_output_tokens: int) -> List[AnyMessage]:
+    """The history sent to the model: tool results of earlier turns are trimmed, those of the current turn kept whole"""
+    starts = turn_starts(messages)
+    current = starts[-1] if starts else 0
+    return [trim_tool_output(message, tool_output_tokens) if i < current else message
+            for i, message in enumerate(messages) if not isinstance(message, SystemMessage)]
+
+def system_prompt(prompt: str, summary: str) -> SystemMessage:
+    return SystemMessage(content=f"{prompt}\n\nSummary of the earlier conversation:\n{summary}" if summary else prompt)
+
+def history_split(messages: List[AnyMessage], history_tokens: int, tool_output_tokens: int) -> int:
+    """
+    Index of the first message to keep. 0 while the history fits in `history_tokens`, otherwise the start of the
+    latest whole turns that fit in a fraction of it. The current turn is always kept, and a turn is never split,
+    so tool calls stay together with their results.
+    """
+    starts = turn_starts(messages)
+    costs = [message_tokens(message) for message in prompt_messages(messages, tool_output_tokens)]
+    if not starts or sum(costs) <= history_tokens:
+        return 0
+    keep = starts[-1]
+    for start in reversed(starts[:-1]):
+        if sum(costs[start:]) > history_tokens * COMPACT_TO:
+            break
+        keep = start
+    return keep
+
+def summarize(llm: BaseChatModel, summary: str, messages: List[AnyMessage], max_tokens: int, tool_output_tokens: int) -> str:
+    lines = [f"Earlier summary: {summary}"] if summary else []
+    for message in messages:
+        if isinstance(message, HumanMessage):
+            lines.append(f"User: {message_text(message)}")
+        elif isinstance(message, ToolMessage):
+            lines.append(f"Tool {message.name} returned: {message_text(trim_tool_output(message, tool_output_tokens))}")
+        elif isinstance(message, AIMessage) and message.content:
+            lines.append(f"Assistant: {message_text(message)}")
+    with measure("chat.summarize", len(messages)):
+        response = llm.invoke([
+            SystemMessage(content=SUMMARY_PROMPT.format(words=max(20, int(max_tokens * 0.7)))),
+            HumanMessage(content="\n".join(lines)),
+        ])
+    record_usage("chat.summarize", response)
+    return truncate_tokens(message_text(response).strip(), max_tokens)
+
+def make_compact_history(llm: BaseChatModel, history_tokens: int, tool_output_tokens: int) -> Callable[[Any], dict]:
+    """
+    Graph node run before every turn. When the history exceeds `history_tokens`, the oldest turns are folded
+    into the running summary and removed from the state, so the prompt and the checkpointed state stay bounded.
+    """
+    def compact_history(state: Any) -> dict:
+        messages = state["messages"]
+        keep = history_split(messages, history_tokens, tool_output_tokens)
+        if keep == 0:
+            return {}
+        summary = summarize(llm, state.get("summary", ""), messages[:keep], max(50, history_tokens // 4), tool_output_tokens)
+        print(f"(Summarized {keep} earlier messages, {len(messages) - keep} kept)")
+        return {"summary": summary, "messages": [RemoveMessage(id=message.id) for message in messages[:keep]]}
+    return compact_history
@@ -0,0 +1,166 @@
+import os
+import copy
+import json
+import time
+import sqlite3
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from app.context import TOKEN_ENCODING
+from app.manifest import text_hash
+from app.metrics import measure, record_cache
+
+# (start offset, length) of each chunk within the document text
+Boundaries = List[Tuple[int, int]]
+
+@lru_cache(maxsize=8)
+def get_text_splitter(chunk_size: int, overlap: int) -> RecursiveCharacterTextSplitter:
+    """One splitter (and tokenizer) per process and setting, instead of a new one per call"""
+    return RecursiveCharacterTextSplitter.from_tiktoken_encoder(
+        encoding_name=TOKEN_ENCODING, chunk_size=chunk_size, chunk_overlap=overlap
+    )
+
+def split_text(text: str, chunk_size: int, overlap: int) -> Tuple[List[str], Boundaries]:
+    """The chunks of `text`, and where each one starts (-1 if the splitter changed its text)"""
+    chunks = get_text_splitter(chunk_size, overlap).split_text(text)
+    boundaries = []
+    start = 0
+    for chunk in chunks:
+        index = text.find(chunk, start)
+        boundaries.append((index, len(chunk)))
+        if index >= 0:
+            start = index + 1
+    return chunks, boundaries
+
+def split_boundaries(text: str, chunk_size: int, overlap: int) -> Optional[Boundaries]:
+    """Runs in the worker processes, returning only the offsets so the texts aren't sent back"""
+    _, boundaries = split_text(text, chunk_size, overlap)
+    return None if any(start < 0 for start, _ in boundaries) else boundaries
+
+def make_chunks(doc: Document, texts: List[str], boundaries: Boundaries) -> List[Document]:
+    chunks = []
+    for text, (start, _) in zip(texts, boundaries):
+        metadata = copy.deepcopy(doc.metadata)
+        # Lets the context packing merge overlapping chunks of a query's results again
+        if start >= 0:
+            metadata["start_index"] = start
+        chunks.append(Document(page_content=text, metadata=metadata))
+    return chunks
+
+class ChunkCache:
+    """Chunk boundaries in SQLite, keyed by (content hash, chunk size, overlap)"""
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            " content_hash TEXT NOT NULL, chunk_size INTEGER NOT NULL, overlap INTEGER NOT NULL,"
+            " boundaries TEXT NOT NULL, last_access REAL NOT NULL,"
+            " PRIMARY KEY (content_hash, chunk_size, overlap))"
+        )
+        self._conn.commit()
+
+    def get_many(self, keys: List[str], chunk_size: int, overlap: int) -> Dict[str, Boundaries]:
+        found: Dict[str, Boundaries] = {}
+        unique_keys = list(dict.fromkeys(keys))
+        with self._lock:
+            for start in range(0, len(unique_keys), 500):
+                batch = unique_keys[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT content_hash, boundaries FROM chunks WHERE chunk_size = ? AND overlap = ?"
+                    f" AND content_hash IN ({','.join('?' * len(batch))})",
+                    [chunk_size, overlap, *batch],
+                ).fetchall()
+                for content_hash, boundaries in rows:
+                    found[content_hash] = [tuple(pair) for pair in json.loads(boundaries)]
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE chunks SET last_access = ? WHERE content_hash = ? AND chunk_size = ? AND overlap = ?",
+                    [(now, content_hash, chunk_size, overlap) for content_hash in found],
+                )
+                self._conn.commit()
+        return found
+
+    def put_many(self, boundaries: Dict[str, Boundaries], chunk_size: int, overlap: int) -> None:
+        now = time.time()
+        rows = [(content_hash, chunk_size, overlap, json.dumps(value), now) for content_hash, value in boundaries.items()]
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO chunks VALUES (?, ?, ?, ?, ?)", rows)
+            self._conn.commit()
+
+class Chunker:
+    """
+    Splits documents like `chunk_documents`, with the same output, but reuses the splitter, splits across
+    `workers` processes and remembers the chunk boundaries of every text in `cache`, so unchanged texts
+    are never split again with the same settings. Safe to call from several threads.
+    """
+
+    def __init__(self, chunk_size: int = 600, overlap: int = 100, workers: int = 1, cache: Optional[ChunkCache] = None):
+        self.chunk_size = chunk_size
+        self.overlap = overlap
+        self.cache = cache
+        self.executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, documents: List[Document]) -> List[Document]:
+        with measure("chunk") as result:
+            chunks = self.split(documents)
+            result["items"] = len(chunks)
+        return chunks
+
+    def split(self, documents: List[Document]) -> List[Document]:
+        keys = [text_hash(doc.page_content) for doc in documents]
+        cached = self.cache.get_many(keys, self.chunk_size, self.overlap) if self.cache else {}
+        missing = [i for i, key in enumerate(keys) if key not in cached]
+        with self._lock:
+            self.hits += len(documents) - len(missing)
+            self.misses += len(missing)
+        if self.cache:
+            record_cache("chunk", len(documents) - len(missing), len(missing))
+
+        boundaries: Dict[str, Boundaries] = dict(cached)
+        chunks: Dict[int, List[Document]] = {}
+        if self.executor and missing:
+            futures = [(i, self.executor.submit(split_boundaries, documents[i].page_content, self.chunk_size, self.overlap))
+                       for i in missing]
+            for i, future in futures:
+                result = future.result()
+                if result is not None:
+                    boundaries[keys[i]] = result
+        for i in missing:
+            if keys[i] not in boundaries:
+                # Split in this process, which also covers the rare texts the splitter alters
+                texts, found = split_text(documents[i].page_content, self.chunk_size, self.overlap)
+                chunks[i] = make_chunks(documents[i], texts, found)
+                if all(start >= 0 for start, _ in found):
+                    boundaries[keys[i]] = found
+        if self.cache and missing:
+            self.cache.put_many({keys[i]: boundaries[keys[i]] for i in missing if keys[i] in boundaries},
+                                self.chunk_size, self.overlap)
+
+        result: List[Document] = []
+        for i, doc in enumerate(documents):
+            if i not in chunks:
+                texts = [doc.page_content[start:start + length] for start, length in boundaries[keys[i]]]
+                chunks[i] = make_chunks(doc, texts, boundaries[keys[i]])
+            result.extend(chunks[i])
+        return result
+
+    def stats(self) -> str:
+        total = self.hits + self.misses
+        return f"Chunk cache: {self.hits} hits, {self.misses} misses ({self.hits / max(1, total):.1%} hit rate)"
+
+    def close(self) -> None:
+        if self.executor:
+            self.executor.shutdown()
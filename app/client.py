@@ -0,0 +1,63 @@
+import json
+import urllib.error
+import urllib.request
+from typing import Any, Callable, Dict, Optional
+
+def query_server(
+    server_url: str,
+    prompt: str,
+    retrieval_only: bool = False,
+    mode: Optional[str] = None,
+    search_filter: Optional[Dict[str, str]] = None,
+    timeout: float = 600,
+    context_budget: Optional[int] = None,
+    query_cache: bool = True,
+    llm_model: Optional[str] = None,
+    on_token: Optional[Callable[[str], None]] = None,
+) -> Optional[Dict[str, Any]]:
+    """
+    Sends the query to a running `serve` process. Returns None if no server is listening at `server_url`,
+    and raises RuntimeError if the server fails or doesn't answer within `timeout` seconds.
+    `search_filter` takes the "source", "type", "since" and "until" arguments of the `query` command.
+    With `on_token` the answer is streamed and each token is passed to it as soon as the server generates it.
+    """
+    body = {
+        "prompt": prompt,
+        "retrieval_only": retrieval_only,
+        "mode": mode,
+        "filter": search_filter,
+        "context_budget": context_budget,
+        "query_cache": query_cache,
+        "llm_model": llm_model,
+        "stream": on_token is not None,
+    }
+    request = urllib.request.Request(
+        server_url.rstrip("/") + "/query",
+        data=json.dumps(body).encode("utf-8"),
+        headers={"Content-Type": "application/json"},
+        method="POST",
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            if response.headers.get_content_type() != "application/x-ndjson":
+                return json.loads(response.read())
+            for line in response:
+                message = json.loads(line)
+                if "token" in message:
+                    on_token(message["token"])
+                elif "error" in message:
+                    raise RuntimeError(f"Server at {server_url} failed: {message['error']}")
+                else:
+                    return message
+            raise RuntimeError(f"Server at {server_url} closed the stream without a result")
+    except urllib.error.HTTPError as e:
+        body = e.read().decode("utf-8", "replace")
+        try:
+            message = json.loads(body)["error"]
+        except (ValueError, KeyError, TypeError):
+            message = body.strip() or e.reason
+        raise RuntimeError(f"Server at {server_url} failed ({e.code}): {message}") from e
+    except TimeoutError as e:
+        raise RuntimeError(f"Server at {server_url} did not answer within {timeout:g}s") from e
+    except (urllib.error.URLError, ConnectionError):
+        return None
@@ -1,28 +1,83 @@
 from app.settings import Settings
-from app.embeddings import get_embedding
-from app.query import load_vector_store
+from app.embeddings import embed_queries, get_embedding, print_embedding_stats
+from app.query import load_vector_store, search_embeddings, search_vectors
+from app.sharded_store import SearchableStore
 from langchain_ollama import ChatOllama
-from langchain_core.messages import HumanMessage, SystemMessage, AnyMessage, AIMessageChunk
+from langchain_core.messages import HumanMessage, AnyMessage, AIMessageChunk
 from langchain_core.tools import tool
 from langgraph.graph import StateGraph, END, START
 from langgraph.graph.state import CompiledStateGraph
 from langgraph.prebuilt import ToolNode
-from langgraph.checkpoint.memory import MemorySaver
+from langgraph.checkpoint.sqlite import SqliteSaver
 from langgraph.graph.message import add_messages
-from langchain_core.retrievers import BaseRetriever
-from typing import Annotated, TypedDict, Any, List
+from langchain_core.documents import Document
+from langchain_core.runnables import RunnableConfig
+from app.chat_memory import make_compact_history, prompt_messages, system_prompt
+from app.metrics import measure, record_usage
+from app.search_filter import SearchFilter
+from typing import Annotated, TypedDict, Any, Callable, Dict, List, Optional, Tuple
 import datetime
 import json
+import os
+import sqlite3
 
 # 1. Define the retrieval tool
-def make_semantic_search_tool(retriever: BaseRetriever):
+class BatchedSearch:
+    """
+    Searches the knowledge base for the semantic_search tool. `prefetch` searches the queries of all tool calls
+    of a turn together, with one embedding request and one index search per filter, and each call then reads its results.
+    """
+
+    def __init__(self, db: SearchableStore, k: int = 5, min_relevance: float = 0.3):
+        self.db = db
+        self.k = k
+        self.min_relevance = min_relevance
+        self.results: Dict[Tuple[str, Optional[SearchFilter]], List[Document]] = {}
+
+    def prefetch(self, requests: List[Tuple[str, Optional[SearchFilter]]]) -> None:
+        requests = list(dict.fromkeys(requests))
+        if len(requests) > 1:
+            print(f"Searching {len(requests)} queries in one batch")
+        self.results = {}
+        if not requests:
+            return
+        queries = list(dict.fromkeys(query for query, _ in requests))
+        embeddings = dict(zip(queries, embed_queries(self.db.embeddings, queries)))
+        for search_filter in dict.fromkeys(search_filter for _, search_filter in requests):
+            group = [query for query, query_filter in requests if query_filter == search_filter]
+            results = search_embeddings(self.db, [embeddings[query] for query in group], self.k, self.min_relevance, search_filter)
+            for query, scored in zip(group, results):
+                self.results[(query, search_filter)] = [doc for doc, _ in scored]
+
+    def __call__(self, query: str, search_filter: Optional[SearchFilter] = None) -> List[Document]:
+        docs = self.results.get((query, search_filter))
+        return docs if docs is not None else search_vectors(self.db, [query], self.k, self.min_relevance, search_filter)[0]
+
+def tool_filter(args: Dict[str, Any]) -> Optional[SearchFilter]:
+    """The search filter of a semantic_search call. Raises ValueError for bad dates."""
+    return SearchFilter.parse(args.get("source"), args.get("file_type"), args.get("since"), args.get("until"))
+
+def make_semantic_search_tool(search: Callable[[str, Optional[SearchFilter]], List[Document]]):
     @tool
-    def semantic_search(query: str) -> str:
+    def semantic_search(
+        query: str,
+        source: Optional[str] = None,
+        file_type: Optional[str] = None,
+        since: Optional[str] = None,
+        until: Optional[str] = None,
+    ) -> str:
         """
         Retrieve relevant documents from the knowledge base using semantic search.
         Returns the sources and relevant content.
+        Only give the optional filters when the user asks about particular documents:
+        source is a path or URL prefix (or a glob pattern like "docs/*.md"), file_type a comma separated list
+        of file extensions or "url", and since/until dates (YYYY-MM-DD) the documents were indexed in.
         """
-        docs = retriever.invoke(query)
+        try:
+            search_filter = tool_filter({"source": source, "file_type": file_type, "since": since, "until": until})
+        except ValueError as e:
+            return json.dumps({"error": str(e)})
+        docs = search(query, search_filter)
         result = {
             "sources": [doc.metadata.get("source", "unknown") for doc in docs],
             "context": [doc.page_content for doc in docs]
@@ -43,17 +98,39 @@ def get_llm_prompt() -> str:
 # 3. Define the agent state
 class AgentState(TypedDict):
     messages: Annotated[List[Any], add_messages]
+    summary: str
 
 # 4. Define the LLM and tool nodes
-def make_run_llm(settings: Settings, tools):
-    llm = ChatOllama(model=settings.llm_model, base_url=settings.ollama_url, temperature=0).bind_tools(tools)
+def make_run_llm(llm: ChatOllama, settings: Settings, tools):
+    llm = llm.bind_tools(tools)
 
     def run_llm(state: AgentState) -> dict:
-        messages = state['messages']
-        message = llm.invoke(messages)
+        # The system prompt isn't part of the state, so it always has the current time
+        messages = [system_prompt(get_llm_prompt(), state.get('summary', ''))]
+        messages += prompt_messages(state['messages'], settings.chat_tool_output_tokens)
+        with measure("chat.llm", len(messages)):
+            message = llm.invoke(messages)
+        record_usage("chat.llm", message)
         return {'messages': [message]}
     return run_llm
 
+def make_run_tools(tools, search: BatchedSearch):
+    tool_node = ToolNode(tools)
+
+    def run_tools(state: AgentState, config: RunnableConfig) -> Any:
+        calls = state['messages'][-1].tool_calls
+        requests = []
+        for call in calls:
+            if call['name'] == 'semantic_search' and isinstance(call['args'].get('query'), str):
+                try:
+                    requests.append((call['args']['query'], tool_filter(call['args'])))
+                except ValueError:
+                    pass  # The tool call itself reports the error
+        search.prefetch(requests)
+        with measure("chat.tools", len(calls)):
+            return tool_node.invoke(state, config)
+    return run_tools
+
 def tool_exists(state: AgentState) -> bool:
     result = state['messages'][-1]
     return hasattr(result, "tool_calls") and result.tool_calls and len(result.tool_calls) > 0
@@ -65,7 +142,9 @@ def stream_graph(graph: CompiledStateGraph, messages: List[AnyMessage], config):
 
     print("")
     for s in graph.stream(state, config=config, stream_mode="messages"):
-        chunk, _ = s
+        chunk, metadata = s
+        if metadata.get("langgraph_node") == "memory":
+            continue
 
         curr_chunk_type = chunk.type
         if curr_chunk_type == "AIMessageChunk" and isinstance(chunk, AIMessageChunk):
@@ -88,41 +167,47 @@ def chat_command(settings: Settings) -> None:
     print("Entering agentic chat mode (type 'exit' to quit)...")
 
     embedding = get_embedding(settings)
-    db = load_vector_store(embedding)
-    retriever = db.as_retriever(
-        search_type="similarity_score_threshold",  # or "similarity"
-        search_kwargs={"k": 5, "score_threshold": 0.3}
-    )
-    tools = [make_semantic_search_tool(retriever)]
-    run_llm = make_run_llm(settings, tools)
-
-    memory = MemorySaver()
+    db = load_vector_store(embedding, nprobe=settings.ivf_nprobe, ef_search=settings.hnsw_ef_search, mmap=settings.mmap_index)
+    search = BatchedSearch(db, k=5, min_relevance=0.3)
+    tools = [make_semantic_search_tool(search)]
+    llm = ChatOllama(model=settings.llm_model, base_url=settings.ollama_url, temperature=0)
+    run_llm = make_run_llm(llm, settings, tools)
+
+    # Conversations are checkpointed on disk, so a thread can be continued after a restart
+    directory = os.path.dirname(settings.chat_history_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    memory = SqliteSaver(sqlite3.connect(settings.chat_history_path, check_same_thread=False))
     graph_builder = StateGraph(AgentState)
+    graph_builder.add_node("memory", make_compact_history(llm, settings.chat_history_tokens, settings.chat_tool_output_tokens))
     graph_builder.add_node("llm", run_llm)
-    graph_builder.add_node("tools", ToolNode(tools))
+    graph_builder.add_node("tools", make_run_tools(tools, search))
     graph_builder.add_conditional_edges(
         "llm",
         tool_exists,
         {True: "tools", False: END}
     )
     graph_builder.add_edge("tools", "llm")
-    graph_builder.add_edge(START, "llm")
+    graph_builder.add_edge(START, "memory")
+    graph_builder.add_edge("memory", "llm")
 
     graph = graph_builder.compile(checkpointer=memory)
-    config = {"configurable": {"thread_id": "1"}}
-
-    # Initial system prompt
-    system_prompt = SystemMessage(content=get_llm_prompt())
-
-    # Chat loop
-    messages = [system_prompt]
+    config = {"configurable": {"thread_id": settings.chat_thread_id}}
+    history = graph.get_state(config).values.get("messages", [])
+    if history:
+        print(f"Continuing conversation '{settings.chat_thread_id}' ({len(history)} messages), use --thread-id to start another")
+    else:
+        print(f"Starting conversation '{settings.chat_thread_id}'")
+
+    # Chat loop: only the new message is sent, the checkpointer holds the (compacted) history
     try:
         while True:
             user_input = input("\nYou: ")
             if user_input.strip().lower() in ["exit", "quit", "q"]:
                 print("Exiting chat.")
                 break
-            messages.append(HumanMessage(content=user_input))
-            stream_graph(graph, messages, config)
+            stream_graph(graph, [HumanMessage(content=user_input)], config)
     except (KeyboardInterrupt, EOFError):
-        print("\nExiting chat.")
\ No newline at end of file
+        print("\nExiting chat.")
+    memory.conn.close()
+    print_embedding_stats(embedding)
\ No newline at end of file
@@ -1,33 +1,310 @@
-from app.embeddings import get_embedding
-from app.ingest import load_folder, load_file, load_url, chunk_documents, build_vector_store
+from app.embeddings import get_embedding, print_embedding_stats
+from app.ingest import list_files, is_supported_file, iter_load_files
+from app.chunking import Chunker, ChunkCache
+from app.dedup import ChunkDeduplicator, merge_duplicate_sources, remove_duplicate_sources, seed_deduplicator
+from app.ingest import delete_from_vector_store, save_vector_store
+from app.index_factory import IndexBuilder, IndexConfig
+from app.manifest import IndexManifest, SourceEntry, file_hash, text_hash
+from app.query import open_vector_store
+from app.url_fetcher import PageCache, UrlFetcher, parse_page
+from app.shards import (HASH_SHARD_PREFIX, ROOT_SHARD, drop_shard, hash_shard, has_root_index, list_shards,
+                        move_root_to_shard, remove_root_index, shard_path)
+from app.pipeline import run_ingest_pipeline
 from app.settings import Settings
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from typing import Dict, Iterator, List, Optional, Tuple
+from dataclasses import replace
 import os
+import time
 import argparse
 
-def index_command(args: argparse.Namespace, settings: Settings) -> None:
-    embedding = get_embedding(settings)
-    all_documents = []
-    for src in args.sources:
+VECTOR_STORE_PATH = "vector_store/"
+
+def previous_manifest(path: str, incremental: bool, manifest: IndexManifest, settings: Settings) -> Optional[IndexManifest]:
+    """Returns the manifest of the existing index at `path`, if its chunks can be reused for this run"""
+    if not incremental:
+        return None
+    previous = IndexManifest.load(path)
+    if previous is None or not os.path.isfile(os.path.join(path, "index.faiss")):
+        print("No existing index manifest found, building a new index.")
+        return None
+    if not previous.is_compatible(manifest):
+        print("Chunking or embedding settings changed since the last run, rebuilding the whole index.")
+        return None
+    if settings.index_type and settings.index_type != IndexConfig.load(path).index_type:
+        print(f"Index type changed to {settings.index_type}, rebuilding the whole index.")
+        return None
+    return previous
+
+def index_sources(
+    sources: List[str],
+    settings: Settings,
+    embedding: Embeddings,
+    vector_store_path: str = VECTOR_STORE_PATH,
+    incremental: bool = False,
+) -> None:
+    """Builds the vector store (or shard) at `vector_store_path` from `sources`, or updates it if `incremental`"""
+    manifest = IndexManifest.from_settings(settings)
+    previous = previous_manifest(vector_store_path, incremental, manifest, settings)
+    if previous:
+        config = IndexConfig.load(vector_store_path)
+        config.nprobe = settings.ivf_nprobe or config.nprobe
+        config.ef_search = settings.hnsw_ef_search or config.ef_search
+    else:
+        config = IndexConfig.from_settings(settings)
+    pending_entries: Dict[str, SourceEntry] = {}
+    pending_files: List[str] = []
+    pending_urls: List[str] = []
+    changed_sources: List[str] = []
+    ingested_at = int(time.time())
+
+    def tag(documents: List[Document]) -> List[Document]:
+        """Adds the ingest time, which the docstore indexes for search filters"""
+        for doc in documents:
+            doc.metadata["ingested_at"] = ingested_at
+        return documents
+
+    def index_file(path: str) -> None:
+        if not is_supported_file(path):
+            return
+        stat = os.stat(path)
+        old = previous.sources.get(path) if previous else None
+        if old and old.size == stat.st_size and old.mtime == stat.st_mtime:
+            manifest.sources[path] = old
+            return
+        content_hash = file_hash(path)
+        if old and old.content_hash == content_hash:
+            manifest.sources[path] = replace(old, size=stat.st_size, mtime=stat.st_mtime)
+            return
+        pending_entries[path] = SourceEntry(size=stat.st_size, mtime=stat.st_mtime, content_hash=content_hash)
+        pending_files.append(path)
+
+    def load_changed_sources() -> Iterator[Tuple[str, List[Document]]]:
+        """The load stage of the pipeline: yields the documents of each new or changed source"""
+        if pending_files:
+            print(f"Loading {len(pending_files)} new or changed files")
+            for index, documents in iter_load_files(pending_files, workers=settings.load_workers):
+                if documents:
+                    yield pending_files[index], tag(documents)
+        if not pending_urls:
+            return
+        fetcher = UrlFetcher(settings.url_workers, settings.url_per_host,
+                             cache=PageCache(settings.url_cache_path) if settings.url_cache else None)
+        try:
+            for page in fetcher.fetch_many(pending_urls):
+                url = page.url
+                old = previous.sources.get(url) if previous else None
+                if page.error:
+                    # Keeps the chunks of a page which is only temporarily unreachable
+                    print(f"  failed {url} after {page.seconds:.2f}s: {page.error}")
+                    if old:
+                        manifest.sources[url] = old
+                    continue
+                if page.not_modified:
+                    print(f"  not modified {url} ({page.seconds:.2f}s)")
+                    if old:
+                        manifest.sources[url] = old
+                        continue
+                else:
+                    print(f"  fetched {url}: {len(page.body) / 1024:.1f} KB in {page.seconds:.2f}s")
+                documents = parse_page(page)
+                content = "".join(doc.page_content for doc in documents)
+                content_hash = text_hash(content)
+                if old and old.content_hash == content_hash:
+                    manifest.sources[url] = old
+                    continue
+                pending_entries[url] = SourceEntry(size=len(content.encode("utf-8")), mtime=0.0, content_hash=content_hash)
+                if documents:
+                    yield url, tag(documents)
+        finally:
+            fetcher.close()
+        print(fetcher.stats())
+
+    def on_chunked(key: str, chunk_ids: List[str]) -> None:
+        entry = pending_entries[key]
+        entry.chunk_ids = chunk_ids
+        manifest.sources[key] = entry
+        changed_sources.append(key)
+
+    for src in sources:
         if os.path.isdir(src):
             print(f"Importing from directory: {src}")
-            all_documents.extend(load_folder(src))
+            for path in list_files(src):
+                index_file(path)
         elif os.path.isfile(src):
-            doc = load_file(src)
-            if doc:
-                all_documents.append(doc)
+            index_file(src)
         elif src.startswith("http://") or src.startswith("https://"):
             print(f"Importing from URL: {src}")
-            all_documents.extend(load_url(src))
+            pending_urls.append(src)
         else:
             print(f"Skipping unknown source: {src}")
 
-    if not all_documents:
-        print("No documents found. Exiting.")
+    db = open_vector_store(embedding, vector_store_path) if previous else None
+    if previous is None:
+        print(f"Building {config.index_type} vector store with chunk_size={settings.chunk_size}, overlap={settings.overlap}...")
+    dedup = ChunkDeduplicator(settings.dedup_threshold) if settings.dedup else None
+    if dedup and db is not None and (pending_files or pending_urls):
+        # Chunks of the unchanged sources, which new ones may repeat
+        seed_deduplicator(dedup, db, sorted(manifest.chunk_ids()))
+    chunker = Chunker(settings.chunk_size, settings.overlap, workers=settings.chunk_workers,
+                      cache=ChunkCache(settings.chunk_cache_path) if settings.chunk_cache else None)
+    try:
+        db, added = run_ingest_pipeline(
+            load_changed_sources(), chunker, embedding, IndexBuilder(embedding, config, db),
+            batch_size=settings.embed_batch_size,
+            concurrency=settings.embed_concurrency,
+            max_retries=settings.embed_max_retries,
+            max_in_flight_chunks=settings.max_in_flight_chunks,
+            on_chunked=on_chunked,
+            chunk_workers=settings.chunk_workers,
+            deduplicate=dedup.check if dedup else None,
+        )
+    finally:
+        chunker.close()
+    if chunker.cache:
+        print(chunker.stats())
+    merged = dedup.sources if dedup else {}
+    if dedup and (pending_files or pending_urls):
+        print(dedup.stats())
+    if db is not None and merged:
+        merge_duplicate_sources(db, merged, ingested_at)
+
+    if previous is None:
+        if db is None:
+            print("No documents found. Exiting.")
+            return
+    else:
+        kept_ids = manifest.chunk_ids()
+        removed_ids = sorted(previous.chunk_ids() - kept_ids)
+        removed = [key for key in previous.sources if key not in manifest.sources]
+        # Old chunks of removed or changed sources which duplicates in other sources keep alive
+        shared: Dict[str, List[str]] = {}
+        for key, entry in previous.sources.items():
+            current = set(manifest.sources[key].chunk_ids) if key in manifest.sources else set()
+            for chunk_id in (set(entry.chunk_ids) - current) & kept_ids:
+                shared.setdefault(chunk_id, []).append(key)
+        if not added and not removed_ids and not merged and not shared:
+            print("Index is up to date.")
+            manifest.save(vector_store_path)
+            return
+
+        remove_duplicate_sources(db, shared)
+        print(f"Updated vector store: {len(changed_sources)} new or changed sources ({added} chunks), "
+              f"{len(removed)} removed sources, {len(removed_ids)} stale chunks")
+        if removed_ids:
+            db = delete_from_vector_store(db, removed_ids, config)
+
+    save_vector_store(db, config, vector_store_path)
+    manifest.save(vector_store_path)
+    print(f"Indexing of {vector_store_path} complete.")
+
+def expand_sources(sources: List[str]) -> List[str]:
+    """The supported files of the directories in `sources`, and the other sources as they are"""
+    expanded = []
+    for src in sources:
+        if os.path.isdir(src):
+            expanded.extend(path for path in list_files(src) if is_supported_file(path))
+        else:
+            expanded.append(src)
+    return expanded
+
+def source_exists(key: str) -> bool:
+    """Whether the manifest source `key` can still be indexed: an existing file or a URL"""
+    return os.path.isfile(key) or key.startswith("http://") or key.startswith("https://")
+
+def remove_overlapping_sources(path: str, shard: str, settings: Settings, embedding: Embeddings) -> None:
+    """Removes the sources of `shard` from the shard at `path`, so no chunk is found in both"""
+    if not os.path.isdir(path):
+        return
+    manifest, other = IndexManifest.load(path), IndexManifest.load(shard)
+    if manifest is None or other is None:
+        return
+    overlap = [key for key in manifest.sources if key in other.sources]
+    if not overlap:
         return
+    print(f"Removing {len(overlap)} sources of shard {os.path.basename(shard)} from shard {os.path.basename(path)}")
+    remaining = [key for key in manifest.sources if key not in other.sources]
+    if remaining:
+        index_sources(remaining, settings, embedding, path, incremental=True)
+    else:
+        drop_shard(VECTOR_STORE_PATH, os.path.basename(path))
 
-    print(f"Chunking {len(all_documents)} documents with chunk_size={settings.chunk_size}, overlap={settings.overlap}")
-    chunks = chunk_documents(all_documents, chunk_size=settings.chunk_size, overlap=settings.overlap)
+def index_command(args: argparse.Namespace, settings: Settings) -> None:
+    incremental = getattr(args, "incremental", False)
+    if getattr(args, "drop_shard", None):
+        if drop_shard(VECTOR_STORE_PATH, args.drop_shard):
+            print(f"Dropped shard {args.drop_shard}.")
+        else:
+            print(f"No shard named {args.drop_shard} found.")
+        return
+    if not args.sources:
+        print("No sources given. Exiting.")
+        return
 
-    print("Building vector store...")
-    build_vector_store(chunks, embedding)
-    print("Indexing complete.")
\ No newline at end of file
+    embedding = get_embedding(settings)
+    if getattr(args, "num_shards", None):
+        # Each source always lands in the same shard, so shards can be updated independently later
+        sources = expand_sources(args.sources)
+        if incremental:
+            # Adds to the sources of the existing hash shards instead of replacing them
+            known = set(sources)
+            for name in list_shards(VECTOR_STORE_PATH):
+                manifest = IndexManifest.load(shard_path(VECTOR_STORE_PATH, name)) if name.startswith(HASH_SHARD_PREFIX) else None
+                for key in (manifest.sources if manifest else ()):
+                    if key not in known and source_exists(key):
+                        known.add(key)
+                        sources.append(key)
+        root = IndexManifest.load(VECTOR_STORE_PATH) if has_root_index(VECTOR_STORE_PATH) else None
+        if root is not None:
+            # The sources of the unsharded index move to the hash shards with the new ones
+            unsharded = [key for key in root.sources if key not in sources and source_exists(key)]
+            if unsharded:
+                print(f"Adding the {len(unsharded)} other sources of the unsharded index to the shards")
+                sources += unsharded
+        shards: Dict[str, List[str]] = {}
+        for src in sources:
+            shards.setdefault(hash_shard(src, args.num_shards), []).append(src)
+        for name in sorted(shards):
+            print(f"Indexing shard {name} ({len(shards[name])} sources)")
+            index_sources(shards[name], settings, embedding, shard_path(VECTOR_STORE_PATH, name), incremental)
+        for name in list_shards(VECTOR_STORE_PATH):
+            if name.startswith(HASH_SHARD_PREFIX) and name not in shards:
+                drop_shard(VECTOR_STORE_PATH, name)
+                print(f"Dropped shard {name}, none of the sources belong to it anymore.")
+        if has_root_index(VECTOR_STORE_PATH):
+            hashed_sources = set()
+            for name in shards:
+                manifest = IndexManifest.load(shard_path(VECTOR_STORE_PATH, name))
+                hashed_sources.update(manifest.sources if manifest else ())
+            missing = [key for key in root.sources if key not in hashed_sources and source_exists(key)] if root else []
+            if root is None or missing:
+                # Keeps the sources which couldn't be indexed now (or are unknown without a manifest),
+                # the overlap with the hash shards is removed below
+                move_root_to_shard(VECTOR_STORE_PATH)
+                print(f"Moved the unsharded index to shard {ROOT_SHARD}, not all of its sources are in the hash shards.")
+            else:
+                # The unsharded index would only return the chunks of the hash shards a second time
+                remove_root_index(VECTOR_STORE_PATH)
+                print("Removed the unsharded index, its sources are in the shards now.")
+        for name in list_shards(VECTOR_STORE_PATH):
+            if not name.startswith(HASH_SHARD_PREFIX):
+                for hashed in sorted(shards):
+                    remove_overlapping_sources(shard_path(VECTOR_STORE_PATH, name), shard_path(VECTOR_STORE_PATH, hashed),
+                                               settings, embedding)
+    elif getattr(args, "shard", None):
+        path = shard_path(VECTOR_STORE_PATH, args.shard)
+        moved = None
+        if has_root_index(VECTOR_STORE_PATH):
+            moved = move_root_to_shard(VECTOR_STORE_PATH)
+            print(f"Moved the unsharded index to shard {ROOT_SHARD}.")
+        index_sources(args.sources, settings, embedding, path, incremental)
+        if moved and moved != path:
+            remove_overlapping_sources(moved, path, settings, embedding)
+    elif list_shards(VECTOR_STORE_PATH):
+        print("The vector store is sharded, index the sources into a shard with --shard NAME or --num-shards N.")
+        return
+    else:
+        index_sources(args.sources, settings, embedding, VECTOR_STORE_PATH, incremental)
+    print_embedding_stats(embedding)
+    print("Indexing complete.")
@@ -1,13 +1,91 @@
-from app.embeddings import get_embedding
-from app.query import load_vector_store, retrieve_documents, generate_rag_response
+from app.query_cache import answer_params, open_query_cache
+from app.client import query_server
+from app.search_filter import SearchFilter
 from app.settings import Settings
 import argparse
-from langchain_ollama import ChatOllama
+
+def print_sources(sources) -> None:
+    for source in dict.fromkeys(sources):
+        print(f"  - {source}")
+
+def make_token_printer(prompt: str):
+    """Prints the question before the first token, then every token as it arrives"""
+    started = False
+
+    def print_token(token: str) -> None:
+        nonlocal started
+        if not started:
+            print(f"\nQ: {prompt}\nA: ", end="")
+            started = True
+        print(token, end="", flush=True)
+    return print_token
 
 def query_command(args: argparse.Namespace, settings: Settings) -> None:
+    retrieval_only = getattr(args, "retrieval_only", False)
+    filter_args = {key: getattr(args, key, None) for key in ("source", "type", "since", "until")}
+    try:
+        search_filter = SearchFilter.parse(*filter_args.values())
+    except ValueError as e:
+        print(e)
+        return
+    if getattr(args, "batch", None):
+        import asyncio
+        from app.batch_query import default_output_path, run_batch_query
+        output = args.output or default_output_path(args.batch)
+        try:
+            asyncio.run(run_batch_query(args.batch, output, settings, retrieval_only, search_filter))
+        except KeyboardInterrupt:
+            print(f"\nInterrupted, run the same command again to continue with the questions not in {output}")
+        return
+    if not args.prompt:
+        print("Give a question to answer, or a JSONL file of questions with --batch")
+        return
+    stream = not retrieval_only and not getattr(args, "no_stream", False)
+    if not getattr(args, "local", False):
+        try:
+            response = query_server(settings.server_url, args.prompt, retrieval_only, settings.retrieval_mode,
+                                    filter_args if search_filter else None, context_budget=settings.context_token_budget,
+                                    query_cache=settings.query_cache, llm_model=settings.llm_model,
+                                    on_token=make_token_printer(args.prompt) if stream else None)
+        except RuntimeError as e:
+            print(e)
+            return
+        if response is not None:
+            if retrieval_only:
+                print(f"\nQ: {args.prompt}\nSources ({response['elapsed_ms']}ms via {settings.server_url}):")
+                print_sources(response["sources"])
+            elif stream:
+                print(f"\n({response['elapsed_ms']}ms via {settings.server_url})")
+            else:
+                print(f"\nQ: {args.prompt}\nA: {response['answer']}\n({response['elapsed_ms']}ms via {settings.server_url})")
+            return
+
+    cache = open_query_cache(settings)
+    params = answer_params(settings.retrieval_mode, settings.context_token_budget, search_filter)
+    hit = cache.get_exact(args.prompt, params) if cache and not retrieval_only else None
+    if hit:
+        # Answered without loading the index or the models at all
+        print(f"\nQ: {args.prompt}\nA: {hit.answer}\n(served from the query cache)")
+        return
+
+    # Only imported when the question can't be answered by a server or the cache
+    from app.embeddings import get_embedding, print_embedding_stats
+    from app.query import load_vector_store, retrieve_documents, answer_query
+    from langchain_ollama import ChatOllama
+
     embedding = get_embedding(settings)
-    db = load_vector_store(embedding)
-    llm = ChatOllama(model=settings.llm_model, temperature=0)
-    docs = retrieve_documents(db, args.prompt)
-    answer = generate_rag_response(llm, docs, args.prompt)
-    print(f"\nQ: {args.prompt}\nA: {answer}")
\ No newline at end of file
+    db = load_vector_store(embedding, nprobe=settings.ivf_nprobe, ef_search=settings.hnsw_ef_search, mmap=settings.mmap_index)
+    if retrieval_only:
+        docs = retrieve_documents(db, args.prompt, mode=settings.retrieval_mode, search_filter=search_filter)
+        print(f"\nQ: {args.prompt}\nSources:")
+        print_sources(doc.metadata.get("source", "unknown") for doc in docs)
+    else:
+        llm = ChatOllama(model=settings.llm_model, base_url=settings.ollama_url, temperature=0)
+        if not stream:
+            answer, _ = answer_query(db, llm, args.prompt, cache, mode=settings.retrieval_mode,
+                                     token_budget=settings.context_token_budget, search_filter=search_filter)
+            print(f"\nQ: {args.prompt}\nA: {answer}")
+        else:
+            answer_query(db, llm, args.prompt, cache, mode=settings.retrieval_mode, on_token=make_token_printer(args.prompt),
+                         token_budget=settings.context_token_budget, search_filter=search_filter)
+    print_embedding_stats(embedding)
@@ -0,0 +1,6 @@
+from app.server import serve
+from app.settings import Settings
+import argparse
+
+def serve_command(args: argparse.Namespace, settings: Settings) -> None:
+    serve(settings, host=args.host, port=args.port)
@@ -0,0 +1,133 @@
+import re
+import time
+from dataclasses import dataclass
+from typing import Any, List, Optional, Set, Tuple
+from langchain_core.documents import Document
+from app.metrics import record_stage
+
+# Same encoding `chunk_documents` measures chunk sizes with
+TOKEN_ENCODING = "gpt2"
+SEPARATOR = "\n---\n"
+# Passages sharing this fraction of their word 5-grams with a better ranked one are dropped
+NEAR_DUPLICATE_SIMILARITY = 0.8
+
+_encoding: Any = None
+
+def get_encoding() -> Any:
+    global _encoding
+    if _encoding is None:
+        import tiktoken
+        _encoding = tiktoken.get_encoding(TOKEN_ENCODING)
+    return _encoding
+
+def count_tokens(text: str) -> int:
+    return len(get_encoding().encode(text, disallowed_special=()))
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    tokens = get_encoding().encode(text, disallowed_special=())
+    return text if len(tokens) <= max_tokens else get_encoding().decode(tokens[:max_tokens])
+
+@dataclass
+class Passage:
+    """One or more merged chunks of the same source, ranked by the best of them"""
+    key: Tuple[Any, Any]
+    text: str
+    start: Optional[int]
+    rank: int
+    chunks: int = 1
+
+@dataclass
+class PackedContext:
+    text: str
+    chunks: int
+    passages: int
+    tokens: int
+    raw_tokens: int
+
+def passage_from(doc: Document, rank: int) -> Passage:
+    start = doc.metadata.get("start_index")
+    return Passage(
+        key=(doc.metadata.get("source"), doc.metadata.get("page")),
+        text=doc.page_content,
+        start=start if isinstance(start, int) and start >= 0 else None,
+        rank=rank,
+    )
+
+def join_overlapping(first: Passage, second: Passage) -> Optional[str]:
+    """The text of `first` continued by `second`, if `second` overlaps or directly follows it, otherwise None"""
+    if second.text in first.text:
+        return first.text
+    if first.start is not None and second.start is not None:
+        end = first.start + len(first.text)
+        if first.start > second.start or second.start > end + 2:
+            return None
+        # Offsets of adjacent chunks differ by the whitespace the splitter stripped
+        return first.text + second.text[end - second.start:] if second.start <= end else first.text + "\n" + second.text
+    # Chunks indexed before offsets were recorded: look for the beginning of `second` in the end of `first`
+    probe = second.text[:64]
+    position = first.text.rfind(probe)
+    if probe and position > 0 and second.text.startswith(first.text[position:]):
+        return first.text[:position] + second.text
+    return None
+
+def merge_passages(passages: List[Passage]) -> List[Passage]:
+    merged = True
+    while merged:
+        merged = False
+        for first in passages:
+            for second in passages:
+                if first is second or first.key != second.key:
+                    continue
+                text = join_overlapping(first, second)
+                if text is not None:
+                    first.text = text
+                    first.rank = min(first.rank, second.rank)
+                    first.chunks += second.chunks
+                    passages.remove(second)
+                    merged = True
+                    break
+            if merged:
+                break
+    return passages
+
+def shingles(text: str, size: int = 5) -> Set[Tuple[str, ...]]:
+    words = re.findall(r"\w+", text.lower())
+    return {tuple(words[i:i + size]) for i in range(max(1, len(words) - size + 1))}
+
+def drop_near_duplicates(passages: List[Passage]) -> List[Passage]:
+    kept: List[Tuple[Passage, Set[Tuple[str, ...]]]] = []
+    for passage in sorted(passages, key=lambda p: p.rank):
+        words = shingles(passage.text)
+        if any(passage.text in other.text or len(words & other_words) / max(1, len(words | other_words)) >= NEAR_DUPLICATE_SIMILARITY
+               for other, other_words in kept):
+            continue
+        kept.append((passage, words))
+    return [passage for passage, _ in kept]
+
+def pack_context(docs: List[Document], token_budget: Optional[int] = None) -> PackedContext:
+    """
+    Assembles the context for a prompt from retrieved chunks, given best first: overlapping or adjacent chunks
+    of the same source are merged, near-duplicates dropped, and passages added by rank until `token_budget`.
+    """
+    started = time.perf_counter()
+    raw_tokens = count_tokens(SEPARATOR.join(doc.page_content for doc in docs)) if docs else 0
+    passages = drop_near_duplicates(merge_passages([passage_from(doc, rank) for rank, doc in enumerate(docs)]))
+
+    selected: List[str] = []
+    tokens = 0
+    for passage in passages:
+        cost = count_tokens(passage.text) + (count_tokens(SEPARATOR) if selected else 0)
+        if token_budget and tokens + cost > token_budget:
+            if not selected:
+                # Better a truncated best passage than no context at all
+                selected.append(truncate_tokens(passage.text, token_budget))
+                tokens = token_budget
+            break
+        selected.append(passage.text)
+        tokens += cost
+
+    text = SEPARATOR.join(selected)
+    record_stage("pack", time.perf_counter() - started, len(docs), passages=len(selected), tokens=tokens)
+    print(f"Context: {len(docs)} chunks packed into {len(selected)} passages, {tokens} tokens "
+          f"(saved {raw_tokens - tokens} of {raw_tokens} tokens{f', budget {token_budget}' if token_budget else ''})")
+    return PackedContext(text=text, chunks=len(docs), passages=len(selected), tokens=tokens, raw_tokens=raw_tokens)
@@ -0,0 +1,179 @@
+import re
+import zlib
+from typing import Callable, Dict, List, Optional, Tuple
+import numpy as np
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from app.docstore import SQLiteDocstore
+from app.manifest import text_hash
+
+# Words per shingle, and hash functions per MinHash signature
+SHINGLE_SIZE = 5
+NUM_PERM = 128
+_WORD_PATTERN = re.compile(r"\w+")
+_SHINGLE_MULTIPLIERS = np.array([0x9E3779B97F4A7C15 ** i % 2 ** 64 for i in range(SHINGLE_SIZE)], dtype=np.uint64)
+
+def normalized_text(text: str) -> str:
+    """Chunks which only differ in case or whitespace count as exact duplicates"""
+    return " ".join(text.lower().split())
+
+def shingle_hashes(text: str) -> np.ndarray:
+    """32 bit hashes of the distinct runs of SHINGLE_SIZE words, combined from one hash per word"""
+    words = np.fromiter((zlib.crc32(word.encode("utf-8")) for word in _WORD_PATTERN.findall(text.lower())), dtype=np.uint64)
+    count = max(1, len(words) - SHINGLE_SIZE + 1)
+    hashes = np.zeros(count, dtype=np.uint64)
+    with np.errstate(over="ignore"):
+        for offset in range(min(SHINGLE_SIZE, len(words))):
+            hashes += words[offset:offset + count] * _SHINGLE_MULTIPLIERS[offset]
+    return np.unique(hashes >> np.uint64(32))
+
+def lsh_bands(threshold: float, num_perm: int = NUM_PERM) -> Tuple[int, int]:
+    """
+    The (bands, rows) split of the signature with the fewest candidates that still finds 99% of the pairs
+    at `threshold` similarity. Candidates are confirmed on the full signature, so extra ones only cost time.
+    """
+    for rows in sorted((r for r in range(1, num_perm + 1) if num_perm % r == 0), reverse=True):
+        bands = num_perm // rows
+        if 1 - (1 - threshold ** rows) ** bands >= 0.99:
+            return bands, rows
+    return num_perm, 1
+
+class ChunkDeduplicator:
+    """
+    Finds chunks which repeat an earlier one: exactly (same normalized text) or nearly (estimated Jaccard
+    similarity of their word shingles of at least `threshold`, found by MinHash and LSH banding).
+    The first chunk seen survives; `sources` collects the sources of its duplicates to merge into its metadata.
+    Not thread safe, the ingest pipeline calls it from its chunking thread only.
+    """
+
+    def __init__(self, threshold: float = 0.9, seed: int = 0):
+        self.threshold = threshold
+        self.bands, self.rows = lsh_bands(threshold)
+        rng = np.random.default_rng(seed)
+        # Multiply-shift hashing: the upper 32 bits of a * x + b (mod 2^64), with a odd
+        self._a = rng.integers(1, 2 ** 63, NUM_PERM, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+        self._b = rng.integers(0, 2 ** 63, NUM_PERM, dtype=np.uint64)
+        self._exact: Dict[str, str] = {}
+        self._buckets: List[Dict[int, List[int]]] = [{} for _ in range(self.bands)]
+        self._ids: List[str] = []
+        self._signatures: List[np.ndarray] = []
+        self._chunk_sources: Dict[str, str] = {}
+        self.sources: Dict[str, List[str]] = {}
+        self.exact = 0
+        self.near = 0
+        self.bytes_saved = 0
+
+    def signature(self, text: str) -> np.ndarray:
+        values = np.multiply.outer(shingle_hashes(text), self._a)
+        values += self._b
+        values >>= np.uint64(32)
+        return values.min(axis=0).astype(np.uint32)
+
+    def band_keys(self, signature: np.ndarray) -> List[int]:
+        return [hash(signature[band * self.rows:(band + 1) * self.rows].tobytes()) for band in range(self.bands)]
+
+    def add(self, chunk_id: str, doc: Document, signature: Optional[np.ndarray] = None) -> None:
+        """Registers a chunk which later chunks are compared with, e.g. one already in the index"""
+        self._exact.setdefault(text_hash(normalized_text(doc.page_content)), chunk_id)
+        self._chunk_sources[chunk_id] = doc.metadata.get("source", "unknown")
+        signature = self.signature(doc.page_content) if signature is None else signature
+        position = len(self._ids)
+        self._ids.append(chunk_id)
+        self._signatures.append(signature)
+        for band, key in enumerate(self.band_keys(signature)):
+            self._buckets[band].setdefault(key, []).append(position)
+
+    def find_near(self, signature: np.ndarray) -> Optional[str]:
+        candidates = {position for band, key in enumerate(self.band_keys(signature))
+                      for position in self._buckets[band].get(key, ())}
+        best, best_similarity = None, self.threshold
+        for position in candidates:
+            similarity = float(np.mean(self._signatures[position] == signature))
+            if similarity >= best_similarity:
+                best, best_similarity = position, similarity
+        return None if best is None else self._ids[best]
+
+    def check(self, chunk_id: str, doc: Document) -> Optional[str]:
+        """The id of the earlier chunk `doc` duplicates, or None after registering `doc` as a new chunk"""
+        survivor = self._exact.get(text_hash(normalized_text(doc.page_content)))
+        signature = None
+        if survivor is not None:
+            self.exact += 1
+        else:
+            signature = self.signature(doc.page_content)
+            survivor = self.find_near(signature)
+            if survivor is not None:
+                self.near += 1
+        if survivor is None:
+            self.add(chunk_id, doc, signature)
+            return None
+        self.bytes_saved += len(doc.page_content.encode("utf-8"))
+        source = doc.metadata.get("source", "unknown")
+        if source != self._chunk_sources[survivor]:
+            sources = self.sources.setdefault(survivor, [])
+            if source not in sources:
+                sources.append(source)
+        return survivor
+
+    @property
+    def dropped(self) -> int:
+        return self.exact + self.near
+
+    def stats(self) -> str:
+        return (f"Deduplication: dropped {self.dropped} chunks ({self.exact} exact, {self.near} near duplicates), "
+                f"saving {self.dropped} embeddings and {self.bytes_saved / 1024:.1f} KB of chunk text")
+
+def seed_deduplicator(dedup: ChunkDeduplicator, db: FAISS, chunk_ids: List[str]) -> None:
+    """Registers chunks already in the index, so new sources repeating them aren't embedded again"""
+    if isinstance(db.docstore, SQLiteDocstore):
+        for start in range(0, len(chunk_ids), 1000):
+            for chunk_id, doc in db.docstore.search_many(chunk_ids[start:start + 1000]).items():
+                dedup.add(chunk_id, doc)
+    else:
+        for chunk_id in chunk_ids:
+            doc = db.docstore.search(chunk_id)
+            if isinstance(doc, Document):
+                dedup.add(chunk_id, doc)
+
+def merge_sources(metadata: dict, sources: List[str], ingested_at: Optional[float] = None) -> dict:
+    """
+    `metadata` with `sources` listing the chunk's own source and those of its duplicates. The duplicates' ingest
+    time goes into `sources_ingested_at`, so searches filtered by ingest time find the chunk through each source.
+    """
+    merged = list(dict.fromkeys([*metadata.get("sources", [metadata.get("source", "unknown")]), *sources]))
+    metadata = {**metadata, "sources": merged}
+    if ingested_at is not None:
+        metadata["sources_ingested_at"] = {**metadata.get("sources_ingested_at", {}), **dict.fromkeys(sources, ingested_at)}
+    return metadata
+
+def drop_sources(metadata: dict, sources: List[str]) -> dict:
+    """`metadata` without the removed `sources`, naming a remaining one as the chunk's source if needed"""
+    remaining = [source for source in metadata.get("sources", []) if source not in sources]
+    if not remaining:
+        return metadata
+    source = metadata.get("source") if metadata.get("source") in remaining else remaining[0]
+    metadata = {**metadata, "source": source, "sources": remaining}
+    if "sources_ingested_at" in metadata:
+        metadata["sources_ingested_at"] = {key: value for key, value in metadata["sources_ingested_at"].items()
+                                           if key not in sources}
+    return metadata
+
+def update_sources(db: FAISS, sources: Dict[str, List[str]], update: Callable[[dict, List[str]], dict]) -> None:
+    if not sources:
+        return
+    if isinstance(db.docstore, SQLiteDocstore):
+        found = db.docstore.search_many(list(sources))
+        db.docstore.update_metadata({chunk_id: update(doc.metadata, sources[chunk_id]) for chunk_id, doc in found.items()})
+        return
+    for chunk_id, changed in sources.items():
+        doc = db.docstore.search(chunk_id)
+        if isinstance(doc, Document):
+            doc.metadata = update(doc.metadata, changed)
+
+def merge_duplicate_sources(db: FAISS, sources: Dict[str, List[str]], ingested_at: Optional[float] = None) -> None:
+    """Adds the sources of dropped duplicates, ingested at `ingested_at`, to the metadata of the chunks kept in their place"""
+    update_sources(db, sources, lambda metadata, merged: merge_sources(metadata, merged, ingested_at))
+
+def remove_duplicate_sources(db: FAISS, sources: Dict[str, List[str]]) -> None:
+    """Removes deleted sources from the metadata of chunks which other sources still share"""
+    update_sources(db, sources, drop_sources)
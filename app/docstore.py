@@ -0,0 +1,256 @@
+import os
+import re
+import json
+import sqlite3
+import threading
+from typing import Any, Dict, Iterator, List, MutableMapping, Optional, Tuple, Union
+import numpy as np
+from langchain_community.docstore.base import AddableMixin, Docstore
+from langchain_core.documents import Document
+from app.search_filter import SearchFilter
+
+DOCSTORE_FILE = "docstore.sqlite"
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS documents ("
+    " id TEXT PRIMARY KEY, position INTEGER UNIQUE, page_content TEXT NOT NULL, metadata TEXT NOT NULL)"
+)
+# Full text index of the chunks for BM25 ranking. It reads the text from `documents` (external content)
+# and is kept in sync by triggers, so every write to the docstore updates it too.
+_LEXICAL_SCHEMA = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS documents_fts USING fts5("
+    " page_content, content='documents', tokenize=\"unicode61 tokenchars '_'\")",
+    "CREATE TRIGGER IF NOT EXISTS documents_fts_insert AFTER INSERT ON documents BEGIN"
+    " INSERT INTO documents_fts (rowid, page_content) VALUES (new.rowid, new.page_content); END",
+    "CREATE TRIGGER IF NOT EXISTS documents_fts_delete AFTER DELETE ON documents BEGIN"
+    " INSERT INTO documents_fts (documents_fts, rowid, page_content) VALUES ('delete', old.rowid, old.page_content); END",
+    "CREATE TRIGGER IF NOT EXISTS documents_fts_update AFTER UPDATE OF page_content ON documents BEGIN"
+    " INSERT INTO documents_fts (documents_fts, rowid, page_content) VALUES ('delete', old.rowid, old.page_content);"
+    " INSERT INTO documents_fts (rowid, page_content) VALUES (new.rowid, new.page_content); END",
+)
+_TOKEN_PATTERN = re.compile(r"\w+")
+# Indexed metadata which searches can be filtered by. Every source of a chunk, including those of the duplicates
+# merged into it, is listed in `document_sources` by triggers, with its type ("url", otherwise the extension) and
+# ingest time, so a filter matches a chunk if any of its sources matches.
+_SOURCE_TYPE = ("CASE WHEN {source} GLOB 'http*://*' THEN 'url'"
+                " ELSE lower(replace({source}, rtrim({source}, replace({source}, '.', '')), '')) END")
+_SOURCES_OF = (
+    "SELECT {row}.id AS id, s.value AS source, " + _SOURCE_TYPE.format(source="s.value") + " AS type,"
+    " COALESCE((SELECT t.value FROM json_each({row}.metadata, '$.sources_ingested_at') AS t WHERE t.key = s.value),"
+    " CASE WHEN s.value = json_extract({row}.metadata, '$.source') THEN json_extract({row}.metadata, '$.ingested_at') END)"
+    " AS ingested_at FROM {documents}json_each(json_insert(COALESCE(json_extract({row}.metadata, '$.sources'), '[]'),"
+    " '$[#]', json_extract({row}.metadata, '$.source'))) AS s WHERE s.value IS NOT NULL"
+)
+_INSERT_SOURCES = "INSERT OR IGNORE INTO document_sources (id, source, type, ingested_at) " + _SOURCES_OF
+_FILTER_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS document_sources ("
+    " source TEXT NOT NULL, id TEXT NOT NULL, type TEXT, ingested_at REAL, PRIMARY KEY (source, id)) WITHOUT ROWID",
+    "CREATE INDEX IF NOT EXISTS document_sources_id ON document_sources (id)",
+    "CREATE INDEX IF NOT EXISTS document_sources_type ON document_sources (type)",
+    "CREATE INDEX IF NOT EXISTS document_sources_ingested_at ON document_sources (ingested_at)",
+    "CREATE TRIGGER IF NOT EXISTS document_sources_insert AFTER INSERT ON documents BEGIN "
+    + _INSERT_SOURCES.format(row="new", documents="") + "; END",
+    "CREATE TRIGGER IF NOT EXISTS document_sources_delete AFTER DELETE ON documents BEGIN"
+    " DELETE FROM document_sources WHERE id = old.id; END",
+    "CREATE TRIGGER IF NOT EXISTS document_sources_update AFTER UPDATE OF metadata ON documents BEGIN"
+    " DELETE FROM document_sources WHERE id = old.id; " + _INSERT_SOURCES.format(row="new", documents="") + "; END",
+)
+
+def create_schema(conn: sqlite3.Connection) -> None:
+    """Creates the tables, and builds the full text and metadata indexes of docstores written before they existed"""
+    has_lexical_index = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'documents_fts'").fetchone() is not None
+    source_columns = {row[1] for row in conn.execute("PRAGMA table_info(document_sources)")}
+    if source_columns and "type" not in source_columns:
+        # Written when only the sources were listed, rebuilt with their types and ingest times
+        for name in ("document_sources_insert", "document_sources_delete", "document_sources_update"):
+            conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+        conn.execute("DROP TABLE document_sources")
+    conn.execute(_SCHEMA)
+    for statement in _LEXICAL_SCHEMA + _FILTER_SCHEMA:
+        conn.execute(statement)
+    if not has_lexical_index:
+        conn.execute("INSERT INTO documents_fts (documents_fts) VALUES ('rebuild')")
+    if "type" not in source_columns:
+        conn.execute(_INSERT_SOURCES.format(row="d", documents="documents AS d, "))
+    conn.commit()
+
+def filter_clause(search_filter: Optional[SearchFilter]) -> Tuple[str, List[Any]]:
+    """SQL condition on the documents aliased `d` selecting the indexed chunks with a source matching `search_filter`"""
+    if search_filter is None:
+        return "d.position IS NOT NULL", []
+    clauses: List[str] = []
+    params: List[Any] = []
+    if search_filter.source:
+        clauses.append("source GLOB ?")
+        params.append(search_filter.source_pattern())
+    if search_filter.types:
+        clauses.append(f"type IN ({','.join('?' * len(search_filter.types))})")
+        params.extend(search_filter.types)
+    if search_filter.since is not None:
+        clauses.append("ingested_at >= ?")
+        params.append(search_filter.since)
+    if search_filter.until is not None:
+        clauses.append("ingested_at < ?")
+        params.append(search_filter.until)
+    if not clauses:
+        return "d.position IS NOT NULL", []
+    return f"d.position IS NOT NULL AND d.id IN (SELECT id FROM document_sources WHERE {' AND '.join(clauses)})", params
+
+def lexical_query(query: str) -> str:
+    """An FTS5 query matching any of the words of `query`, with each word quoted so operators are taken literally"""
+    return " OR ".join(f'"{token}"' for token in dict.fromkeys(_TOKEN_PATTERN.findall(query.lower())))
+
+class SQLiteDocstore(Docstore, AddableMixin):
+    """
+    Keeps chunk text and metadata in a SQLite file, so opening an index doesn't load them into memory.
+    Each row also stores the chunk's position in the FAISS index (see `SQLiteIndexMapping`).
+    Changes are only committed by `commit()`, which is called when the vector store is saved.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        create_schema(self.conn)
+
+    def search(self, search: str) -> Union[str, Document]:
+        with self.lock:
+            row = self.conn.execute("SELECT page_content, metadata FROM documents WHERE id = ?", (search,)).fetchone()
+        if row is None:
+            return f"ID {search} not found."
+        return Document(id=search, page_content=row[0], metadata=json.loads(row[1]))
+
+    def search_many(self, ids: List[str]) -> Dict[str, Document]:
+        found: Dict[str, Document] = {}
+        with self.lock:
+            for start in range(0, len(ids), 500):
+                batch = ids[start:start + 500]
+                rows = self.conn.execute(
+                    f"SELECT id, page_content, metadata FROM documents WHERE id IN ({','.join('?' * len(batch))})", batch
+                ).fetchall()
+                for id_, page_content, metadata in rows:
+                    found[id_] = Document(id=id_, page_content=page_content, metadata=json.loads(metadata))
+        return found
+
+    def filter_positions(self, search_filter: SearchFilter) -> np.ndarray:
+        """The FAISS positions of the chunks matching `search_filter`, looked up through the metadata indexes"""
+        where, params = filter_clause(search_filter)
+        with self.lock:
+            rows = self.conn.execute(f"SELECT d.position FROM documents AS d WHERE {where}", params).fetchall()
+        return np.fromiter((position for position, in rows), dtype=np.int64, count=len(rows))
+
+    def search_lexical(self, query: str, k: int = 10, search_filter: Optional[SearchFilter] = None) -> List[Tuple[Document, float]]:
+        """The `k` chunks ranking highest for `query` by BM25, with their scores (higher is better)"""
+        match = lexical_query(query)
+        if not match:
+            return []
+        with self.lock:
+            if search_filter is None:
+                rows = self.conn.execute(
+                    "SELECT d.id, d.page_content, d.metadata, -ranked.rank FROM"
+                    " (SELECT rowid, rank FROM documents_fts WHERE documents_fts MATCH ? ORDER BY rank LIMIT ?) AS ranked"
+                    " JOIN documents AS d ON d.rowid = ranked.rowid WHERE d.position IS NOT NULL ORDER BY ranked.rank",
+                    (match, k),
+                ).fetchall()
+            else:
+                # The filter applies before the limit, so the k best matching chunks are returned
+                where, params = filter_clause(search_filter)
+                rows = self.conn.execute(
+                    "SELECT d.id, d.page_content, d.metadata, -documents_fts.rank FROM documents_fts"
+                    " JOIN documents AS d ON d.rowid = documents_fts.rowid"
+                    f" WHERE documents_fts MATCH ? AND {where} ORDER BY documents_fts.rank LIMIT ?",
+                    (match, *params, k),
+                ).fetchall()
+        return [(Document(id=id_, page_content=page_content, metadata=json.loads(metadata)), score)
+                for id_, page_content, metadata, score in rows]
+
+    def add(self, texts: Dict[str, Document]) -> None:
+        rows = [(id_, doc.page_content, json.dumps(doc.metadata, default=str)) for id_, doc in texts.items()]
+        with self.lock:
+            self.conn.executemany("INSERT INTO documents (id, page_content, metadata) VALUES (?, ?, ?)", rows)
+
+    def update_metadata(self, metadatas: Dict[str, dict]) -> None:
+        rows = [(json.dumps(metadata, default=str), id_) for id_, metadata in metadatas.items()]
+        with self.lock:
+            self.conn.executemany("UPDATE documents SET metadata = ? WHERE id = ?", rows)
+
+    def delete(self, ids: List) -> None:
+        with self.lock:
+            self.conn.executemany("DELETE FROM documents WHERE id = ?", [(id_,) for id_ in ids])
+
+    def set_positions(self, mapping: Dict[int, str]) -> None:
+        """Replaces all FAISS positions, e.g. after vectors were removed and the index renumbered its entries"""
+        with self.lock:
+            self.conn.execute("UPDATE documents SET position = NULL")
+            self.conn.executemany("UPDATE documents SET position = ? WHERE id = ?", [(int(i), id_) for i, id_ in mapping.items()])
+
+    def commit(self) -> None:
+        with self.lock:
+            self.conn.commit()
+
+    def close(self) -> None:
+        with self.lock:
+            self.conn.close()
+
+class SQLiteIndexMapping(MutableMapping[int, str]):
+    """The `index_to_docstore_id` mapping of `FAISS`, backed by the position column of a `SQLiteDocstore`"""
+
+    def __init__(self, docstore: SQLiteDocstore):
+        self.docstore = docstore
+
+    def __getitem__(self, position: int) -> str:
+        with self.docstore.lock:
+            row = self.docstore.conn.execute("SELECT id FROM documents WHERE position = ?", (int(position),)).fetchone()
+        if row is None:
+            raise KeyError(position)
+        return row[0]
+
+    def __setitem__(self, position: int, id_: str) -> None:
+        self.update({position: id_})
+
+    def __delitem__(self, position: int) -> None:
+        with self.docstore.lock:
+            self.docstore.conn.execute("UPDATE documents SET position = NULL WHERE position = ?", (int(position),))
+
+    def __iter__(self) -> Iterator[int]:
+        return (position for position, _ in self.items())
+
+    def __len__(self) -> int:
+        # Positions are always 0..n-1, so this is an index lookup instead of a table scan
+        with self.docstore.lock:
+            (last,) = self.docstore.conn.execute("SELECT MAX(position) FROM documents").fetchone()
+        return 0 if last is None else last + 1
+
+    def update(self, other: Any = (), **kwargs: Any) -> None:
+        items = other.items() if hasattr(other, "items") else other
+        with self.docstore.lock:
+            self.docstore.conn.executemany(
+                "UPDATE documents SET position = ? WHERE id = ?", [(int(position), id_) for position, id_ in items]
+            )
+
+    def items(self) -> List[Tuple[int, str]]:  # type: ignore[override]
+        with self.docstore.lock:
+            return self.docstore.conn.execute(
+                "SELECT position, id FROM documents WHERE position IS NOT NULL ORDER BY position"
+            ).fetchall()
+
+    def values(self) -> List[str]:  # type: ignore[override]
+        return [id_ for _, id_ in self.items()]
+
+def write_docstore(path: str, docstore: Docstore, index_to_docstore_id: Dict[int, str]) -> None:
+    """Writes all chunks of an in-memory docstore into a new SQLite docstore, replacing `path` atomically"""
+    tmp_path = path + ".tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    conn = sqlite3.connect(tmp_path)
+    create_schema(conn)
+    rows = []
+    for position, id_ in sorted(index_to_docstore_id.items()):
+        doc = docstore.search(id_)
+        if not isinstance(doc, Document):
+            raise ValueError(f"Could not find document for id {id_}, got {doc}")
+        rows.append((id_, int(position), doc.page_content, json.dumps(doc.metadata, default=str)))
+    conn.executemany("INSERT INTO documents VALUES (?, ?, ?, ?)", rows)
+    conn.commit()
+    conn.close()
+    os.replace(tmp_path, path)
@@ -0,0 +1,223 @@
+import os
+import time
+import asyncio
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+from array import array
+from typing import Dict, List
+from langchain_core.embeddings import Embeddings
+from app.metrics import record_cache
+
+def normalize_text(text: str) -> str:
+    """Texts which only differ in unicode representation or surrounding whitespace share one cache entry"""
+    return unicodedata.normalize("NFC", text).strip()
+
+class EmbeddingCache:
+    """A SQLite backed store of embedding vectors keyed by (model, text hash), evicting least recently used entries"""
+
+    def __init__(self, path: str, max_bytes: int):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " model TEXT NOT NULL, text_hash TEXT NOT NULL, vector BLOB NOT NULL,"
+            " size INTEGER NOT NULL, last_access REAL NOT NULL,"
+            " PRIMARY KEY (model, text_hash))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_access ON embeddings (last_access)")
+        self._conn.commit()
+        # Kept up to date by `put_many` and `_evict`, so inserts don't sum up the whole table
+        self._total = self._stored_size()
+
+    @staticmethod
+    def key(text: str, query: bool = False) -> str:
+        """
+        Queries are keyed apart from documents, as models with different query and document prefixes embed the same
+        text differently. Document keys are the plain text hash, so caches of earlier versions stay valid for them.
+        """
+        text = normalize_text(text)
+        return hashlib.sha256(f"query\n{text}".encode("utf-8") if query else text.encode("utf-8")).hexdigest()
+
+    def _stored_size(self) -> int:
+        (total,) = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM embeddings").fetchone()
+        return total
+
+    def get_many(self, model: str, keys: List[str]) -> Dict[str, List[float]]:
+        found: Dict[str, List[float]] = {}
+        unique_keys = list(dict.fromkeys(keys))
+        with self._lock:
+            for start in range(0, len(unique_keys), 500):
+                batch = unique_keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})",
+                    [model, *batch],
+                ).fetchall()
+                for text_hash, blob in rows:
+                    vector = array("f")
+                    vector.frombytes(blob)
+                    found[text_hash] = vector.tolist()
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_access = ? WHERE model = ? AND text_hash = ?",
+                    [(now, model, text_hash) for text_hash in found],
+                )
+                self._conn.commit()
+        return found
+
+    def put_many(self, model: str, vectors: Dict[str, List[float]]) -> None:
+        now = time.time()
+        rows = []
+        for text_hash, vector in vectors.items():
+            blob = array("f", vector).tobytes()
+            rows.append((model, text_hash, blob, len(blob), now))
+        with self._lock:
+            replaced = 0
+            keys = list(vectors)
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                (size,) = self._conn.execute(
+                    f"SELECT COALESCE(SUM(size), 0) FROM embeddings WHERE model = ? AND text_hash IN ({','.join('?' * len(batch))})",
+                    [model, *batch],
+                ).fetchone()
+                replaced += size
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?, ?)", rows)
+            self._total += sum(row[3] for row in rows) - replaced
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self) -> None:
+        if self._total <= self.max_bytes:
+            return
+        # Other processes may have written to the cache too, the exact size is only needed when evicting
+        self._total = self._stored_size()
+        if self._total <= self.max_bytes:
+            return
+        # Drop least recently used entries until we are 10% below the limit, so we don't evict on every insert
+        excess = self._total - int(self.max_bytes * 0.9)
+        while excess > 0:
+            rows = self._conn.execute("SELECT rowid, size FROM embeddings ORDER BY last_access LIMIT 1000").fetchall()
+            if not rows:
+                break
+            evicted = []
+            for rowid, size in rows:
+                if excess <= 0:
+                    break
+                evicted.append((rowid,))
+                excess -= size
+                self._total -= size
+            self._conn.executemany("DELETE FROM embeddings WHERE rowid = ?", evicted)
+
+    def clear(self) -> int:
+        with self._lock:
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+            self._conn.execute("DELETE FROM embeddings")
+            self._conn.commit()
+            self._total = 0
+            self._conn.execute("VACUUM")
+        return count
+
+    def size(self) -> int:
+        with self._lock:
+            return self._stored_size()
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps an `Embeddings` implementation and only forwards texts which are not yet in the cache. With `batch_queries`
+    the wrapped model embeds a query like a document (as Ollama does), so missing queries share one request.
+    """
+
+    def __init__(self, embedding: Embeddings, model: str, cache: EmbeddingCache, batch_queries: bool = False):
+        self.embedding = embedding
+        self.model = model
+        self.cache = cache
+        self.batch_queries = batch_queries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _missing(self, keys: List[str], texts: List[str], vectors: Dict[str, List[float]]) -> Dict[str, str]:
+        """The texts of the keys which aren't cached, once per key, counted as misses"""
+        missing: Dict[str, str] = {}
+        for key, text in zip(keys, texts):
+            if key not in vectors and key not in missing:
+                missing[key] = text
+        with self._lock:
+            self.hits += len(texts) - len(missing)
+            self.misses += len(missing)
+        record_cache("embedding", len(texts) - len(missing), len(missing))
+        return missing
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [EmbeddingCache.key(text) for text in texts]
+        vectors = self.cache.get_many(self.model, keys)
+        missing = self._missing(keys, texts, vectors)
+        if missing:
+            computed = self.embedding.embed_documents(list(missing.values()))
+            new_vectors = dict(zip(missing.keys(), computed))
+            self.cache.put_many(self.model, new_vectors)
+            vectors.update(new_vectors)
+        return [vectors[key] for key in keys]
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """What `embed_query` returns for each of `texts`, with one cache lookup"""
+        keys = [EmbeddingCache.key(text, query=True) for text in texts]
+        vectors = self.cache.get_many(self.model, keys)
+        missing = self._missing(keys, texts, vectors)
+        if missing:
+            queries = list(missing.values())
+            if self.batch_queries:
+                computed = self.embedding.embed_documents(queries)
+            else:
+                computed = [self.embedding.embed_query(query) for query in queries]
+            new_vectors = dict(zip(missing.keys(), computed))
+            self.cache.put_many(self.model, new_vectors)
+            vectors.update(new_vectors)
+        return [vectors[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_queries([text])[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [EmbeddingCache.key(text) for text in texts]
+        vectors = await asyncio.to_thread(self.cache.get_many, self.model, keys)
+        missing = self._missing(keys, texts, vectors)
+        if missing:
+            computed = await self.embedding.aembed_documents(list(missing.values()))
+            new_vectors = dict(zip(missing.keys(), computed))
+            await asyncio.to_thread(self.cache.put_many, self.model, new_vectors)
+            vectors.update(new_vectors)
+        return [vectors[key] for key in keys]
+
+    async def aembed_queries(self, texts: List[str]) -> List[List[float]]:
+        keys = [EmbeddingCache.key(text, query=True) for text in texts]
+        vectors = await asyncio.to_thread(self.cache.get_many, self.model, keys)
+        missing = self._missing(keys, texts, vectors)
+        if missing:
+            queries = list(missing.values())
+            if self.batch_queries:
+                computed = await self.embedding.aembed_documents(queries)
+            else:
+                computed = list(await asyncio.gather(*(self.embedding.aembed_query(query) for query in queries)))
+            new_vectors = dict(zip(missing.keys(), computed))
+            await asyncio.to_thread(self.cache.put_many, self.model, new_vectors)
+            vectors.update(new_vectors)
+        return [vectors[key] for key in keys]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.aembed_queries([text]))[0]
+
+    def stats(self) -> str:
+        total = self.hits + self.misses
+        hit_rate = (self.hits / total * 100) if total else 0.0
+        return (f"Embedding cache: {self.hits} hits, {self.misses} misses ({hit_rate:.1f}% hit rate), "
+                f"{self.cache.size() / (1 << 20):.1f} MB on disk")
+
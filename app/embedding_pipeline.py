@@ -0,0 +1,59 @@
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Deque, Iterator, List, Tuple
+from langchain_core.embeddings import Embeddings
+from app.metrics import measure
+
+def embed_with_retry(embedding: Embeddings, texts: List[str], max_retries: int = 3, backoff: float = 1.0) -> List[List[float]]:
+    """Embeds one batch, retrying with exponential backoff on (usually transient) server errors"""
+    attempt = 0
+    while True:
+        try:
+            with measure("embed", len(texts), attempt=attempt):
+                return embedding.embed_documents(texts)
+        except Exception as e:
+            if attempt >= max_retries:
+                raise
+            delay = backoff * (2 ** attempt)
+            print(f"Embedding batch of {len(texts)} failed ({e}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+            attempt += 1
+
+def embed_in_batches(
+    embedding: Embeddings,
+    texts: List[str],
+    batch_size: int = 64,
+    concurrency: int = 4,
+    max_retries: int = 3,
+) -> Iterator[Tuple[int, List[List[float]]]]:
+    """
+    Embeds `texts` in batches with at most `concurrency` requests in flight.
+    Yields `(offset, vectors)` in input order as soon as each batch (and all batches before it) completed.
+    """
+    total = len(texts)
+    done = 0
+    started = time.perf_counter()
+    last_report = started
+    pending: Deque[Tuple[int, Future]] = deque()
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="embed") as executor:
+        def collect() -> Tuple[int, List[List[float]]]:
+            nonlocal done, last_report
+            offset, future = pending.popleft()
+            vectors = future.result()
+            done += len(vectors)
+            now = time.perf_counter()
+            if now - last_report >= 2.0 or done == total:
+                rate = done / max(now - started, 1e-9)
+                print(f"Embedded {done}/{total} chunks ({rate:.1f} chunks/s)")
+                last_report = now
+            return offset, vectors
+
+        for offset in range(0, total, batch_size):
+            batch = texts[offset:offset + batch_size]
+            pending.append((offset, executor.submit(embed_with_retry, embedding, batch, max_retries)))
+            if len(pending) >= concurrency:
+                yield collect()
+        while pending:
+            yield collect()
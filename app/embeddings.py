@@ -1,5 +1,39 @@
+import asyncio
 from langchain_ollama.embeddings import OllamaEmbeddings
+from typing import List, Optional
+from langchain_core.embeddings import Embeddings
+from app.embedding_cache import EmbeddingCache, CachedEmbeddings
 from app.settings import Settings
 
-def get_embedding(settings: Settings) -> OllamaEmbeddings:
-    return OllamaEmbeddings(model=settings.embedding_model, base_url=settings.ollama_url)
\ No newline at end of file
+def get_embedding(settings: Settings, async_client_kwargs: Optional[dict] = None) -> Embeddings:
+    embedding = OllamaEmbeddings(model=settings.embedding_model, base_url=settings.ollama_url,
+                                 async_client_kwargs=async_client_kwargs or {})
+    if not settings.embedding_cache:
+        return embedding
+    cache = EmbeddingCache(settings.embedding_cache_path, max_bytes=settings.embedding_cache_max_mb * (1 << 20))
+    # Ollama embeds a query exactly like a document
+    return CachedEmbeddings(embedding, settings.embedding_model, cache, batch_queries=True)
+
+def embed_queries(embedding: Embeddings, texts: List[str]) -> List[List[float]]:
+    """What `embed_query` returns for each of `texts`, in one request where the model allows it"""
+    if isinstance(embedding, CachedEmbeddings):
+        return embedding.embed_queries(texts)
+    if isinstance(embedding, OllamaEmbeddings):
+        return embedding.embed_documents(texts)
+    return [embedding.embed_query(text) for text in texts]
+
+async def aembed_queries(embedding: Embeddings, texts: List[str]) -> List[List[float]]:
+    if isinstance(embedding, CachedEmbeddings):
+        return await embedding.aembed_queries(texts)
+    if isinstance(embedding, OllamaEmbeddings):
+        return await embedding.aembed_documents(texts)
+    return list(await asyncio.gather(*(embedding.aembed_query(text) for text in texts)))
+
+def clear_embedding_cache(settings: Settings) -> None:
+    cache = EmbeddingCache(settings.embedding_cache_path, max_bytes=settings.embedding_cache_max_mb * (1 << 20))
+    removed = cache.clear()
+    print(f"Cleared {removed} entries from embedding cache {settings.embedding_cache_path}")
+
+def print_embedding_stats(embedding: Embeddings) -> None:
+    if isinstance(embedding, CachedEmbeddings):
+        print(embedding.stats())
@@ -0,0 +1,77 @@
+import os
+import json
+import hashlib
+from dataclasses import dataclass, asdict, fields
+from typing import Optional
+from app.settings import Settings
+from app.shards import store_paths
+
+INDEX_CONFIG_FILE = "index_config.json"
+INDEX_TYPES = ("flat", "hnsw", "ivf", "ivfpq")
+
+@dataclass
+class IndexConfig:
+    """The FAISS index type and its parameters, persisted next to the index so queries use the same settings"""
+    index_type: str = "flat"
+    nlist: int = 1024
+    nprobe: int = 16
+    hnsw_m: int = 32
+    ef_search: int = 64
+    pq_m: int = 16
+    pq_bits: int = 8
+    train_size: int = 50000
+    version: str = ""
+
+    @classmethod
+    def from_settings(cls, settings: Settings) -> "IndexConfig":
+        config = cls(
+            index_type=settings.index_type or "flat",
+            nlist=settings.ivf_nlist,
+            hnsw_m=settings.hnsw_m,
+            pq_m=settings.pq_m,
+            pq_bits=settings.pq_bits,
+            train_size=settings.index_train_size,
+        )
+        if settings.ivf_nprobe:
+            config.nprobe = settings.ivf_nprobe
+        if settings.hnsw_ef_search:
+            config.ef_search = settings.hnsw_ef_search
+        return config
+
+    @classmethod
+    def load(cls, vector_store_path: str) -> "IndexConfig":
+        """Returns the stored configuration, or the default (flat) one for indexes built before it existed"""
+        path = os.path.join(vector_store_path, INDEX_CONFIG_FILE)
+        if not os.path.isfile(path):
+            return cls()
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        known = {f.name for f in fields(cls)}
+        return cls(**{key: value for key, value in data.items() if key in known})
+
+    def save(self, vector_store_path: str) -> None:
+        os.makedirs(vector_store_path, exist_ok=True)
+        with open(os.path.join(vector_store_path, INDEX_CONFIG_FILE), "w", encoding="utf-8") as f:
+            json.dump(asdict(self), f, indent=2)
+
+    def needs_training(self) -> bool:
+        return self.index_type in ("ivf", "ivfpq")
+
+    def factory_string(self, nlist: Optional[int] = None, pq_bits: Optional[int] = None) -> str:
+        nlist = nlist or self.nlist
+        if self.index_type == "flat":
+            return "Flat"
+        elif self.index_type == "hnsw":
+            return f"HNSW{self.hnsw_m},Flat"
+        elif self.index_type == "ivf":
+            return f"IVF{nlist},Flat"
+        elif self.index_type == "ivfpq":
+            return f"IVF{nlist},PQ{self.pq_m}x{pq_bits or self.pq_bits}"
+        raise ValueError(f"Unknown index type '{self.index_type}', expected one of {', '.join(INDEX_TYPES)}")
+
+def store_version(vector_store_path: str) -> str:
+    """Changes whenever the vector store or any of its shards is rebuilt or updated"""
+    versions = [f"{path}:{IndexConfig.load(path).version}" for path in store_paths(vector_store_path)]
+    if len(versions) <= 1:
+        return IndexConfig.load(vector_store_path).version
+    return hashlib.sha256("\n".join(versions).encode("utf-8")).hexdigest()
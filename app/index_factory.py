@@ -0,0 +1,133 @@
+import math
+from typing import Any, List, Optional
+import numpy as np
+import faiss
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from langchain_core.embeddings import Embeddings
+from app.index_config import IndexConfig, INDEX_CONFIG_FILE, INDEX_TYPES
+
+def create_index(config: IndexConfig, sample: np.ndarray) -> Any:
+    """
+    Creates the configured index for vectors like `sample` and trains it on `sample` if needed.
+    Cluster and code book sizes are reduced when the sample is too small to train them.
+    """
+    dimension = sample.shape[1]
+    nlist, pq_bits = config.nlist, config.pq_bits
+    if config.needs_training():
+        # k-means wants ~39 training points per centroid
+        max_nlist = max(1, len(sample) // 39)
+        if nlist > max_nlist:
+            print(f"Reducing nlist from {nlist} to {max_nlist} for {len(sample)} training vectors")
+            nlist = max_nlist
+            config.nlist = nlist
+        if config.index_type == "ivfpq":
+            max_bits = max(1, min(config.pq_bits, int(math.log2(max(2, len(sample))))))
+            if pq_bits > max_bits:
+                print(f"Reducing PQ code size from {pq_bits} to {max_bits} bits for {len(sample)} training vectors")
+                pq_bits = max_bits
+                config.pq_bits = pq_bits
+
+    index = faiss.index_factory(dimension, config.factory_string(nlist, pq_bits))
+    if not index.is_trained:
+        print(f"Training {config.index_type} index on {len(sample)} vectors...")
+        index.train(sample)
+    apply_search_params(index, config)
+    return index
+
+def apply_search_params(index: Any, config: IndexConfig) -> None:
+    if isinstance(index, faiss.IndexIVF):
+        index.nprobe = config.nprobe
+    elif isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = config.ef_search
+
+def read_index(path: str, mmap: bool = False) -> Any:
+    """
+    Reads a saved index. With `mmap` the vectors stay in the (shared) page cache instead of private memory,
+    which makes opening near-instant, but the index is read-only.
+    Falls back to a regular read for index types FAISS can't memory-map.
+    """
+    if mmap:
+        # IO_FLAG_MMAP_IFC maps flat codes (flat, HNSW, IVF); older FAISS versions only map IVF lists
+        mmap_flag = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP)
+        try:
+            return faiss.read_index(path, mmap_flag | faiss.IO_FLAG_READ_ONLY)
+        except RuntimeError as e:
+            print(f"Memory-mapping {path} failed, reading it into memory instead: {e}")
+    return faiss.read_index(path)
+
+def supports_removal(index: Any) -> bool:
+    """Only flat indexes renumber their vectors on removal, as `FAISS.delete` expects"""
+    return isinstance(index, faiss.IndexFlat)
+
+def remove_vectors(index: Any, positions: np.ndarray, config: IndexConfig) -> Any:
+    """
+    The index without the vectors at `positions`, the others renumbered in order like `FAISS.delete` does for
+    flat indexes. Nothing is embedded again: IVF indexes drop the entries from their inverted lists and renumber
+    the ids stored there, keeping the (PQ) codes as they are. IVF-PQ vectors can't be reconstructed exactly, so
+    re-adding them would lose precision. HNSW can't remove graph nodes, so its graph is rebuilt from the exact
+    vectors of its flat storage.
+    """
+    keep = np.ones(index.ntotal, dtype=bool)
+    keep[positions] = False
+    if isinstance(index, faiss.IndexIVF):
+        if not isinstance(index.invlists, faiss.ArrayInvertedLists):
+            # Memory-mapped lists are read-only, they are copied into memory first
+            lists = faiss.ArrayInvertedLists(index.nlist, index.code_size)
+            for list_no in range(index.nlist):
+                size = index.invlists.list_size(list_no)
+                if size:
+                    lists.add_entries(list_no, size, index.invlists.get_ids(list_no), index.invlists.get_codes(list_no))
+            index.replace_invlists(lists, True)
+            lists.this.disown()
+        index.set_direct_map_type(faiss.DirectMap.NoMap)
+        index.remove_ids(faiss.IDSelectorBatch(positions.astype(np.int64)))
+        new_positions = np.cumsum(keep) - 1
+        for list_no in range(index.nlist):
+            size = index.invlists.list_size(list_no)
+            if size:
+                # A view of the ids in the list, rewritten in place
+                ids = faiss.rev_swig_ptr(index.invlists.get_ids(list_no), size)
+                ids[:] = new_positions[ids]
+        return index
+    vectors = index.reconstruct_n(0, index.ntotal)[keep]
+    rebuilt = faiss.index_factory(index.d, config.factory_string(), index.metric_type)
+    rebuilt.hnsw.efConstruction = index.hnsw.efConstruction
+    apply_search_params(rebuilt, config)
+    rebuilt.add(vectors)
+    return rebuilt
+
+class IndexBuilder:
+    """
+    Adds embedded chunks to a (new or existing) vector store.
+    For index types which need training, the first `train_size` vectors are buffered and used as training sample.
+    """
+
+    def __init__(self, embedding: Embeddings, config: IndexConfig, db: Optional[FAISS] = None):
+        self.embedding = embedding
+        self.config = config
+        self.db = db
+        self._buffer: List[tuple] = []
+        self._buffered = 0
+
+    def add(self, texts: List[str], vectors: List[List[float]], metadatas: List[dict], ids: List[str]) -> None:
+        if self.db is not None:
+            self.db.add_embeddings(list(zip(texts, vectors)), metadatas=metadatas, ids=ids)
+            return
+        self._buffer.append((texts, vectors, metadatas, ids))
+        self._buffered += len(ids)
+        if not self.config.needs_training() or self._buffered >= self.config.train_size:
+            self._create()
+
+    def _create(self) -> None:
+        sample = np.array([vector for _, vectors, _, _ in self._buffer for vector in vectors], dtype=np.float32)
+        index = create_index(self.config, sample)
+        self.db = FAISS(self.embedding, index, InMemoryDocstore(), {})
+        buffer, self._buffer = self._buffer, []
+        for texts, vectors, metadatas, ids in buffer:
+            self.db.add_embeddings(list(zip(texts, vectors)), metadatas=metadatas, ids=ids)
+
+    def finish(self) -> Optional[FAISS]:
+        if self.db is None and self._buffer:
+            self._create()
+        return self.db
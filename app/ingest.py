@@ -1,20 +1,38 @@
 import os
-from typing import List, Optional
+import time
+import uuid
+import itertools
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from typing import Iterator, List, Optional, Tuple
+import faiss
+import numpy as np
 from langchain_community.vectorstores import FAISS
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.docstore.document import Document
 from langchain_community.document_loaders import PyPDFLoader
 from langchain_community.document_loaders import WebBaseLoader
 from langchain_core.embeddings import Embeddings
+from app.embedding_pipeline import embed_in_batches
+from app.chunking import split_text, make_chunks
+from app.index_factory import IndexBuilder, IndexConfig, remove_vectors, supports_removal
+from app.docstore import DOCSTORE_FILE, SQLiteDocstore, SQLiteIndexMapping, write_docstore
+from app.metrics import measure, record_stage
 
 def load_pdf_text(path: str) -> List[Document]:
     loader = PyPDFLoader(path, mode = "page", extraction_mode="layout")
     return loader.load()
 
+SUPPORTED_EXTENSIONS = ("pdf", "md", "txt")
+
+def file_extension(path: str) -> str:
+    filename = os.path.basename(path)
+    return filename.lower().split('.')[-1]
+
+def is_supported_file(path: str) -> bool:
+    return file_extension(path) in SUPPORTED_EXTENSIONS
+
 def load_file(path: str) -> List[Document]:
     """A helper to extract for each known file type the text into a `Document`"""
-    filename = os.path.basename(path)
-    ext = filename.lower().split('.')[-1]
+    ext = file_extension(path)
     if ext == "pdf":
         return load_pdf_text(path)
     elif ext in ("md", "txt"):
@@ -23,38 +41,192 @@ def load_file(path: str) -> List[Document]:
         return [Document(page_content=content, metadata={"source": path})]
     return []
 
-def load_folder(path: str) -> List[Document]:
-    """A helper to extract for each known file type the text into a `Document`"""
-    all_docs: List[Document] = []
+def list_files(path: str) -> List[str]:
+    """Recursively lists all files below `path` in the order `load_folder` reads them"""
+    all_files: List[str] = []
     for filename in os.listdir(path):
         file_path = os.path.join(path, filename)
         if os.path.isfile(file_path):
-            contents = load_file(file_path)
-            if contents:
-                all_docs.extend(contents)
+            all_files.append(file_path)
         elif os.path.isdir(file_path):
-            docs = load_folder(file_path)
-            if len(docs) > 0:
-                all_docs.extend(docs)
+            all_files.extend(list_files(file_path))
+
+    return all_files
+
+def load_folder(path: str) -> List[Document]:
+    """A helper to extract for each known file type the text into a `Document`"""
+    all_docs: List[Document] = []
+    for file_path in list_files(path):
+        contents = load_file(file_path)
+        if contents:
+            all_docs.extend(contents)
 
     return all_docs
 
+def load_file_timed(path: str) -> Tuple[List[Document], float, Optional[str]]:
+    """Loads a single file, returning its documents, the time it took and an error message instead of raising"""
+    started = time.perf_counter()
+    try:
+        docs = load_file(path)
+        return docs, time.perf_counter() - started, None
+    except Exception as e:
+        return [], time.perf_counter() - started, f"{type(e).__name__}: {e}"
+
+def iter_load_files(paths: List[str], workers: int = 1) -> Iterator[Tuple[int, List[Document]]]:
+    """
+    Loads `paths` across `workers` processes, yielding `(index, documents)` for each file as soon as it is parsed.
+    At most two files per worker are submitted at a time, so parsed but unconsumed documents stay bounded.
+    A file which fails to load is reported and yields no documents, without affecting the others.
+    """
+    started = time.perf_counter()
+
+    def report(index: int, docs: List[Document], seconds: float, error: Optional[str]) -> Tuple[int, List[Document]]:
+        record_stage("load", seconds, len(docs), status="error" if error else "ok")
+        if error:
+            print(f"  failed {paths[index]} after {seconds:.2f}s: {error}")
+        else:
+            print(f"  loaded {paths[index]}: {len(docs)} documents in {seconds:.2f}s")
+        return index, docs
+
+    workers = max(1, min(workers, len(paths)))
+    if workers == 1:
+        for index, path in enumerate(paths):
+            yield report(index, *load_file_timed(path))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            submitted = iter(enumerate(paths))
+            futures = {}
+            for index, path in itertools.islice(submitted, workers * 2):
+                futures[executor.submit(load_file_timed, path)] = index
+            while futures:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index = futures.pop(future)
+                    for next_index, next_path in itertools.islice(submitted, 1):
+                        futures[executor.submit(load_file_timed, next_path)] = next_index
+                    yield report(index, *future.result())
+
+    print(f"Loaded {len(paths)} files in {time.perf_counter() - started:.2f}s using {workers} worker(s)")
+
+def load_files(paths: List[str], workers: int = 1) -> List[List[Document]]:
+    """Loads `paths` across `workers` processes, returning the documents of each file in input order"""
+    results: List[List[Document]] = [[] for _ in paths]
+    for index, docs in iter_load_files(paths, workers):
+        results[index] = docs
+    return results
+
 def load_url(url: str) -> List[Document]:
     docs: List[List[Document]] = [WebBaseLoader(url).load()]
     docs_list: List[Document] = [item for sublist in docs for item in sublist]
     return docs_list
 
 def chunk_documents(docs_list: List[Document], chunk_size: int = 600, overlap: int = 100) -> List[Document]:
-    text_splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(
-        chunk_size=chunk_size, chunk_overlap=overlap
-    )
-    return text_splitter.split_documents(docs_list)
+    chunks = []
+    with measure("chunk") as result:
+        for doc in docs_list:
+            texts, boundaries = split_text(doc.page_content, chunk_size, overlap)
+            chunks.extend(make_chunks(doc, texts, boundaries))
+        result["items"] = len(chunks)
+    return chunks
+
+def embed_into_vector_store(
+    db: Optional[FAISS],
+    documents: List[Document],
+    embedding: Embeddings,
+    ids: Optional[List[str]] = None,
+    batch_size: int = 64,
+    concurrency: int = 4,
+    max_retries: int = 3,
+    config: Optional[IndexConfig] = None,
+) -> FAISS:
+    """Embeds `documents` concurrently in batches and adds each batch to the index as soon as it is ready"""
+    ids = ids or [str(uuid.uuid4()) for _ in documents]
+    texts = [doc.page_content for doc in documents]
+    builder = IndexBuilder(embedding, config or IndexConfig(), db)
+    for offset, vectors in embed_in_batches(embedding, texts, batch_size, concurrency, max_retries):
+        end = offset + len(vectors)
+        metadatas = [doc.metadata for doc in documents[offset:end]]
+        builder.add(texts[offset:end], vectors, metadatas, ids[offset:end])
+    return builder.finish()
+
+def delete_from_vector_store(db: FAISS, ids: List[str], config: IndexConfig) -> FAISS:
+    """Removes the chunks `ids` from the index, without embedding the remaining ones again"""
+    if supports_removal(db.index):
+        db.delete(ids)
+        return db
+
+    removed = set(ids)
+    items = sorted(db.index_to_docstore_id.items())
+    positions = np.array([position for position, id_ in items if id_ in removed], dtype=np.int64)
+    with measure("index.remove", len(positions)):
+        db.index = remove_vectors(db.index, positions, config)
+    db.docstore.delete([id_ for _, id_ in items if id_ in removed])
+    # Renumbered like the vectors, as `FAISS.delete` does
+    db.index_to_docstore_id = {i: id_ for i, id_ in enumerate(id_ for _, id_ in items if id_ not in removed)}
+    return db
+
+def save_vector_store(db: FAISS, config: IndexConfig, vector_store_path: str = "vector_store/") -> None:
+    """
+    Saves the FAISS index and its configuration, and the chunks into a SQLite docstore instead of a pickle.
+    A store opened from `vector_store_path` only commits its pending changes, anything else is written anew.
+    """
+    with measure("index.save", db.index.ntotal):
+        write_vector_store(db, config, vector_store_path)
+
+def write_vector_store(db: FAISS, config: IndexConfig, vector_store_path: str) -> None:
+    os.makedirs(vector_store_path, exist_ok=True)
+    docstore_path = os.path.join(vector_store_path, DOCSTORE_FILE)
+    if isinstance(db.docstore, SQLiteDocstore) and os.path.abspath(db.docstore.path) == os.path.abspath(docstore_path):
+        if not isinstance(db.index_to_docstore_id, SQLiteIndexMapping):
+            # `FAISS.delete` replaces the mapping with a renumbered dict
+            db.docstore.set_positions(db.index_to_docstore_id)
+            db.index_to_docstore_id = SQLiteIndexMapping(db.docstore)
+        db.docstore.commit()
+    else:
+        write_docstore(docstore_path, db.docstore, db.index_to_docstore_id)
+
+    index_path = os.path.join(vector_store_path, "index.faiss")
+    faiss.write_index(db.index, index_path + ".tmp")
+    os.replace(index_path + ".tmp", index_path)
+    # A new version on every save invalidates answers cached for the previous index
+    config.version = uuid.uuid4().hex
+    config.save(vector_store_path)
+
+    legacy_path = os.path.join(vector_store_path, "index.pkl")
+    if os.path.exists(legacy_path):
+        os.remove(legacy_path)
 
 def build_vector_store(
     documents: List[Document],
     embedding: Embeddings,
-    vector_store_path: str = "vector_store/"
+    vector_store_path: str = "vector_store/",
+    ids: Optional[List[str]] = None,
+    batch_size: int = 64,
+    concurrency: int = 4,
+    max_retries: int = 3,
+    config: Optional[IndexConfig] = None,
+) -> FAISS:
+    config = config or IndexConfig()
+    db = embed_into_vector_store(None, documents, embedding, ids, batch_size, concurrency, max_retries, config)
+    save_vector_store(db, config, vector_store_path)
+    return db
+
+def update_vector_store(
+    db: FAISS,
+    documents: List[Document],
+    ids: List[str],
+    removed_ids: List[str],
+    vector_store_path: str = "vector_store/",
+    batch_size: int = 64,
+    concurrency: int = 4,
+    max_retries: int = 3,
 ) -> FAISS:
-    db = FAISS.from_documents(documents, embedding)
-    db.save_local(vector_store_path)
-    return db
\ No newline at end of file
+    """Applies an incremental change: drops the vectors of `removed_ids` and embeds only `documents`"""
+    config = IndexConfig.load(vector_store_path)
+    if documents:
+        db = embed_into_vector_store(db, documents, embedding=db.embeddings, ids=ids,
+                                     batch_size=batch_size, concurrency=concurrency, max_retries=max_retries)
+    if removed_ids:
+        db = delete_from_vector_store(db, removed_ids, config)
+    save_vector_store(db, config, vector_store_path)
+    return db
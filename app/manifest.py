@@ -0,0 +1,71 @@
+import os
+import json
+import hashlib
+from dataclasses import dataclass, field, asdict
+from typing import Dict, List, Optional, Set
+from app.settings import Settings
+
+MANIFEST_FILE = "manifest.json"
+
+@dataclass
+class SourceEntry:
+    """What we know about one indexed source (file path or URL) and the chunks it produced"""
+    size: int
+    mtime: float
+    content_hash: str
+    chunk_ids: List[str] = field(default_factory=list)
+
+@dataclass
+class IndexManifest:
+    """Bookkeeping stored next to the vector store, used to re-index only what has changed"""
+    chunk_size: int
+    overlap: int
+    embedding_model: str
+    sources: Dict[str, SourceEntry] = field(default_factory=dict)
+
+    @classmethod
+    def from_settings(cls, settings: Settings) -> "IndexManifest":
+        return cls(
+            chunk_size=settings.chunk_size,
+            overlap=settings.overlap,
+            embedding_model=settings.embedding_model,
+        )
+
+    @classmethod
+    def load(cls, vector_store_path: str) -> Optional["IndexManifest"]:
+        path = os.path.join(vector_store_path, MANIFEST_FILE)
+        if not os.path.isfile(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        sources = {key: SourceEntry(**entry) for key, entry in data.pop("sources", {}).items()}
+        return cls(sources=sources, **data)
+
+    def save(self, vector_store_path: str) -> None:
+        os.makedirs(vector_store_path, exist_ok=True)
+        path = os.path.join(vector_store_path, MANIFEST_FILE)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(asdict(self), f, indent=2)
+        os.replace(tmp_path, path)
+
+    def is_compatible(self, other: "IndexManifest") -> bool:
+        """Chunks can only be reused if they were produced with the same chunking and embedding settings"""
+        return (
+            self.chunk_size == other.chunk_size
+            and self.overlap == other.overlap
+            and self.embedding_model == other.embedding_model
+        )
+
+    def chunk_ids(self) -> Set[str]:
+        return {chunk_id for entry in self.sources.values() for chunk_id in entry.chunk_ids}
+
+def file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
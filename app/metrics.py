@@ -0,0 +1,68 @@
+import os
+import time
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+from app.tracing import start_span, tracing_enabled
+
+# "otlp" sends to the collector, "file" appends to METRICS_FILE, "auto" uses the collector when one is listening
+METRICS_EXPORTERS = ("none", "auto", "otlp", "file")
+
+_instruments: Optional[Any] = None
+_lock = threading.Lock()
+
+def metrics_exporter() -> str:
+    exporter = os.getenv("METRICS_EXPORTER", "none").lower()
+    return exporter if exporter in METRICS_EXPORTERS else "none"
+
+_enabled = metrics_exporter() != "none"
+
+def metrics_enabled() -> bool:
+    return _enabled
+
+def get_instruments() -> Any:
+    """Creates the meter and its histograms on first use, so OpenTelemetry is only imported when metrics are enabled"""
+    global _instruments
+    with _lock:
+        if _instruments is None:
+            from app.metrics_export import StageInstruments
+            _instruments = StageInstruments(metrics_exporter())
+    return _instruments
+
+def record_stage(stage: str, seconds: float, items: Optional[int] = None, **attributes: Any) -> None:
+    """Records one run of a pipeline stage: its latency and the number of items (files, chunks, documents) it handled"""
+    if _enabled:
+        get_instruments().record_stage(stage, seconds, items, attributes)
+
+def record_tokens(stage: str, input_tokens: Optional[int] = None, output_tokens: Optional[int] = None) -> None:
+    if _enabled:
+        get_instruments().record_tokens(stage, input_tokens, output_tokens)
+
+def record_usage(stage: str, message: Any) -> None:
+    """Records the prompt and answer tokens Ollama reported for `message`, if it has usage metadata"""
+    usage = getattr(message, "usage_metadata", None)
+    if _enabled and usage:
+        get_instruments().record_tokens(stage, usage.get("input_tokens"), usage.get("output_tokens"))
+
+def record_cache(cache: str, hits: int = 0, misses: int = 0) -> None:
+    if _enabled and (hits or misses):
+        get_instruments().record_cache(cache, hits, misses)
+
+@contextmanager
+def measure(stage: str, items: Optional[int] = None, **attributes: Any) -> Iterator[Dict[str, Any]]:
+    """
+    Times the block as a span (when tracing) and as a stage latency (when metrics are enabled).
+    The yielded dict takes an "items" count, and further attributes, known only at the end of the block.
+    """
+    result: Dict[str, Any] = {} if items is None else {"items": items}
+    if not _enabled and not tracing_enabled():
+        yield result
+        return
+    started = time.perf_counter()
+    with start_span(stage) as span:
+        yield result
+        if span is not None:
+            span.set_attributes({f"promptmind.{key}": value for key, value in {**attributes, **result}.items()
+                                 if isinstance(value, (str, bool, int, float))})
+    items = result.pop("items", None)
+    record_stage(stage, time.perf_counter() - started, items, **{**attributes, **result})
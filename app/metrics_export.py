@@ -0,0 +1,137 @@
+import os
+import json
+import time
+import socket
+import threading
+from typing import Any, Dict, Optional
+from urllib.parse import urlparse
+from opentelemetry.sdk.metrics import Counter, Histogram, MeterProvider
+from opentelemetry.sdk.metrics.export import (
+    AggregationTemporality,
+    MetricExporter,
+    MetricExportResult,
+    MetricsData,
+    PeriodicExportingMetricReader,
+)
+from opentelemetry.sdk.resources import Resource
+
+# Imported by `app.metrics` only when metrics are enabled
+
+DEFAULT_OTLP_URL = "http://localhost:4318"
+DEFAULT_METRICS_FILE = ".cache/metrics.jsonl"
+# From sub-millisecond searches to minute-long generations
+DURATION_BUCKETS = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120]
+COUNT_BUCKETS = [1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+def otlp_metrics_url() -> str:
+    endpoint = os.getenv("OTEL_EXPORTER_OTLP_METRICS_ENDPOINT")
+    if endpoint:
+        return endpoint
+    base = os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT") or os.getenv("TRACELOOP_BASE_URL") or DEFAULT_OTLP_URL
+    return base.rstrip("/") + "/v1/metrics"
+
+def collector_listening(url: str, timeout: float = 0.2) -> bool:
+    parsed = urlparse(url)
+    try:
+        with socket.create_connection((parsed.hostname or "localhost", parsed.port or 4318), timeout=timeout):
+            return True
+    except OSError:
+        return False
+
+class JsonlMetricExporter(MetricExporter):
+    """Appends one JSON line per data point, with the counts and sums of the last export interval"""
+
+    def __init__(self, path: str):
+        super().__init__(preferred_temporality={Counter: AggregationTemporality.DELTA,
+                                                Histogram: AggregationTemporality.DELTA})
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, metrics_data: MetricsData, timeout_millis: float = 10_000, **kwargs: Any) -> MetricExportResult:
+        lines = []
+        for resource_metrics in metrics_data.resource_metrics:
+            for scope_metrics in resource_metrics.scope_metrics:
+                for metric in scope_metrics.metrics:
+                    for point in metric.data.data_points:
+                        line: Dict[str, Any] = {
+                            "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(point.time_unix_nano / 1e9)),
+                            "name": metric.name,
+                            "unit": metric.unit,
+                            "attributes": dict(point.attributes or {}),
+                        }
+                        if hasattr(point, "bucket_counts"):
+                            if not point.count:
+                                continue
+                            line.update(count=point.count, sum=point.sum, min=point.min, max=point.max,
+                                        bounds=list(point.explicit_bounds), buckets=list(point.bucket_counts))
+                        else:
+                            if not point.value:
+                                continue
+                            line["value"] = point.value
+                        lines.append(json.dumps(line))
+        if lines:
+            with self._lock, open(self.path, "a", encoding="utf-8") as f:
+                f.write("\n".join(lines) + "\n")
+        return MetricExportResult.SUCCESS
+
+    def force_flush(self, timeout_millis: float = 10_000) -> bool:
+        return True
+
+    def shutdown(self, timeout_millis: float = 30_000, **kwargs: Any) -> None:
+        pass
+
+def make_exporter(kind: str) -> MetricExporter:
+    url = otlp_metrics_url()
+    if kind == "otlp" or (kind == "auto" and collector_listening(url)):
+        from opentelemetry.exporter.otlp.proto.http.metric_exporter import OTLPMetricExporter
+        print(f"Exporting metrics to {url}")
+        return OTLPMetricExporter(endpoint=url)
+    path = os.getenv("METRICS_FILE", DEFAULT_METRICS_FILE)
+    print(f"Writing metrics to {path}")
+    return JsonlMetricExporter(path)
+
+class StageInstruments:
+    """The histograms and counters of the pipeline stages, exported in the background every METRICS_INTERVAL seconds"""
+
+    def __init__(self, kind: str):
+        interval = float(os.getenv("METRICS_INTERVAL", "15"))
+        reader = PeriodicExportingMetricReader(make_exporter(kind), export_interval_millis=interval * 1000)
+        # Exports a last time when the process exits
+        self.provider = MeterProvider(metric_readers=[reader], resource=Resource.create({"service.name": "promptmind"}))
+        meter = self.provider.get_meter("promptmind")
+        self.duration = meter.create_histogram(
+            "promptmind.stage.duration", unit="s", description="Latency of one run of a pipeline stage",
+            explicit_bucket_boundaries_advisory=DURATION_BUCKETS,
+        )
+        self.items = meter.create_histogram(
+            "promptmind.stage.items", unit="{item}", description="Files, chunks or documents handled by one run of a stage",
+            explicit_bucket_boundaries_advisory=COUNT_BUCKETS,
+        )
+        self.tokens = meter.create_histogram(
+            "promptmind.llm.tokens", unit="{token}", description="Prompt (input) and answer (output) tokens of one LLM call",
+            explicit_bucket_boundaries_advisory=COUNT_BUCKETS,
+        )
+        self.cache = meter.create_counter(
+            "promptmind.cache.lookups", unit="{lookup}", description="Cache lookups by cache and result (hit or miss)",
+        )
+
+    def record_stage(self, stage: str, seconds: float, items: Optional[int], attributes: Dict[str, Any]) -> None:
+        attributes = {"stage": stage, **{key: value for key, value in attributes.items() if isinstance(value, (str, bool, int, float))}}
+        self.duration.record(seconds, attributes)
+        if items is not None:
+            self.items.record(items, attributes)
+
+    def record_tokens(self, stage: str, input_tokens: Optional[int], output_tokens: Optional[int]) -> None:
+        if input_tokens is not None:
+            self.tokens.record(input_tokens, {"stage": stage, "direction": "input"})
+        if output_tokens is not None:
+            self.tokens.record(output_tokens, {"stage": stage, "direction": "output"})
+
+    def record_cache(self, cache: str, hits: int, misses: int) -> None:
+        if hits:
+            self.cache.add(hits, {"cache": cache, "result": "hit"})
+        if misses:
+            self.cache.add(misses, {"cache": cache, "result": "miss"})
@@ -0,0 +1,206 @@
+import time
+import uuid
+import queue
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Deque, Iterable, List, Optional, Tuple
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from app.embedding_pipeline import embed_with_retry
+from app.index_factory import IndexBuilder
+from app.metrics import measure
+
+_DONE = object()
+
+class PipelineAborted(Exception):
+    pass
+
+class ChunkBudget:
+    """Counts chunks between chunking and index insertion and blocks the producer while the budget is used up"""
+
+    def __init__(self, limit: int):
+        self.limit = max(1, limit)
+        self.used = 0
+        self.aborted = False
+        self._cond = threading.Condition()
+
+    def acquire(self, count: int) -> int:
+        count = min(count, self.limit)
+        with self._cond:
+            while self.used + count > self.limit and not self.aborted:
+                self._cond.wait()
+            if self.aborted:
+                raise PipelineAborted()
+            self.used += count
+        return count
+
+    def release(self, count: int) -> None:
+        with self._cond:
+            self.used -= count
+            self._cond.notify_all()
+
+    def abort(self) -> None:
+        with self._cond:
+            self.aborted = True
+            self._cond.notify_all()
+
+def _put(q: "queue.Queue[Any]", item: Any, budget: ChunkBudget) -> None:
+    """A blocking put, which gives up once the pipeline got aborted"""
+    while True:
+        if budget.aborted:
+            raise PipelineAborted()
+        try:
+            q.put(item, timeout=0.1)
+            return
+        except queue.Full:
+            pass
+
+def run_ingest_pipeline(
+    sources: Iterable[Tuple[str, List[Document]]],
+    chunker: Callable[[List[Document]], List[Document]],
+    embedding: Embeddings,
+    builder: IndexBuilder,
+    batch_size: int = 64,
+    concurrency: int = 4,
+    max_retries: int = 3,
+    max_in_flight_chunks: int = 2048,
+    on_chunked: Optional[Callable[[str, List[str]], None]] = None,
+    chunk_workers: int = 1,
+    deduplicate: Optional[Callable[[str, Document], Optional[str]]] = None,
+) -> Tuple[Optional[FAISS], int]:
+    """
+    Streams `(source key, documents)` through load → chunk → embed → add stages running concurrently.
+
+    Loading and chunking run on background threads, embedding requests on a pool of `concurrency` threads,
+    and index insertion on the calling thread. Up to `chunk_workers` sources are chunked at the same time
+    (their chunks are still passed on in source order). At most `max_in_flight_chunks` chunks exist between
+    chunking and insertion; a full budget blocks chunking, which in turn blocks loading.
+    `deduplicate` gets each new chunk with its id and returns the id of an earlier chunk it duplicates, if any;
+    duplicates are not embedded, and stand for that chunk in the ids passed to `on_chunked`.
+    `on_chunked` receives the chunk ids of each source.
+    Chunks are added to the index through `builder`, which creates (and trains) a new index if needed.
+    Returns the (possibly newly created) index and the number of chunks added.
+    """
+    budget = ChunkBudget(max_in_flight_chunks)
+    batch_size = min(batch_size, budget.limit)
+    documents_queue: "queue.Queue[Any]" = queue.Queue(maxsize=2)
+    batches_queue: "queue.Queue[Any]" = queue.Queue()
+    errors: List[BaseException] = []
+
+    def put_done(q: "queue.Queue[Any]") -> None:
+        try:
+            _put(q, _DONE, budget)
+        except PipelineAborted:
+            pass
+
+    def load_stage() -> None:
+        try:
+            for item in sources:
+                _put(documents_queue, item, budget)
+        except PipelineAborted:
+            return
+        except BaseException as e:
+            errors.append(e)
+            budget.abort()
+        put_done(documents_queue)
+
+    def chunk_stage(executor: ThreadPoolExecutor, chunk_executor: ThreadPoolExecutor) -> None:
+        pending: List[Tuple[str, Document]] = []
+        chunking: Deque[Tuple[str, "Future[List[Document]]"]] = deque()
+
+        def submit() -> None:
+            acquired = budget.acquire(len(pending))
+            texts = [doc.page_content for _, doc in pending]
+            future = executor.submit(embed_with_retry, embedding, texts, max_retries)
+            batches_queue.put((list(pending), future, acquired))
+            pending.clear()
+
+        def collect(limit: int) -> None:
+            """Passes on the chunks of the oldest sources until at most `limit` are being chunked"""
+            while len(chunking) > limit:
+                key, future = chunking.popleft()
+                chunks = future.result()
+                ids = [str(uuid.uuid4()) for _ in chunks]
+                new = [True] * len(chunks)
+                if deduplicate:
+                    with measure("dedup", len(chunks)):
+                        for i, chunk in enumerate(chunks):
+                            survivor = deduplicate(ids[i], chunk)
+                            if survivor is not None:
+                                ids[i], new[i] = survivor, False
+                if on_chunked:
+                    on_chunked(key, list(dict.fromkeys(ids)))
+                for chunk_id, chunk, is_new in zip(ids, chunks, new):
+                    if not is_new:
+                        continue
+                    pending.append((chunk_id, chunk))
+                    if len(pending) >= batch_size:
+                        submit()
+
+        try:
+            while True:
+                try:
+                    item = documents_queue.get(timeout=0.1)
+                except queue.Empty:
+                    if budget.aborted:
+                        raise PipelineAborted()
+                    continue
+                if item is _DONE:
+                    break
+                key, documents = item
+                chunking.append((key, chunk_executor.submit(chunker, documents)))
+                collect(max(0, chunk_workers - 1))
+            collect(0)
+            if pending:
+                submit()
+        except PipelineAborted:
+            pass
+        except BaseException as e:
+            errors.append(e)
+            budget.abort()
+        batches_queue.put(_DONE)
+
+    added = 0
+    started = time.perf_counter()
+    last_report = started
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="embed") as executor, \
+            ThreadPoolExecutor(max_workers=max(1, chunk_workers), thread_name_prefix="chunk") as chunk_executor:
+        loader = threading.Thread(target=load_stage, name="ingest-load", daemon=True)
+        chunker_thread = threading.Thread(target=chunk_stage, args=(executor, chunk_executor), name="ingest-chunk", daemon=True)
+        loader.start()
+        chunker_thread.start()
+        try:
+            for item in iter(batches_queue.get, _DONE):
+                batch, future, acquired = item
+                vectors = future.result()
+                texts = [doc.page_content for _, doc in batch]
+                metadatas = [doc.metadata for _, doc in batch]
+                ids = [chunk_id for chunk_id, _ in batch]
+                had_index = builder.db is not None
+                with measure("index.add", len(ids)):
+                    builder.add(texts, vectors, metadatas, ids)
+                if not had_index and builder.db is not None:
+                    print(f"First vectors added after {time.perf_counter() - started:.2f}s")
+                added += len(ids)
+                budget.release(acquired)
+
+                now = time.perf_counter()
+                if now - last_report >= 2.0:
+                    print(f"Added {added} chunks ({added / (now - started):.1f} chunks/s, {budget.used} in flight)")
+                    last_report = now
+        except BaseException:
+            budget.abort()
+            for item in iter(batches_queue.get, _DONE):
+                item[1].cancel()
+            raise
+        finally:
+            loader.join()
+            chunker_thread.join()
+
+    if errors:
+        raise errors[0]
+    elapsed = time.perf_counter() - started
+    print(f"Added {added} chunks in {elapsed:.2f}s ({added / max(elapsed, 1e-9):.1f} chunks/s)")
+    return builder.finish(), added
@@ -1,28 +1,311 @@
-from typing import List
+import os
+import time
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
 from langchain_core.embeddings import Embeddings
 from langchain_core.documents import Document
 from langchain_ollama import ChatOllama
 from langchain_core.messages import HumanMessage
 from langchain_community.vectorstores import FAISS
+from app.embeddings import embed_queries
+from app.index_factory import IndexConfig, apply_search_params, read_index
+from app.docstore import DOCSTORE_FILE, SQLiteDocstore, SQLiteIndexMapping
+from app.query_cache import QueryCache, answer_params
+from app.shards import has_root_index, store_paths
+from app.sharded_store import SearchableStore, ShardedVectorStore, search_by_vectors
+from app.search_filter import SearchFilter
+from app.context import pack_context
+from app.metrics import measure, record_stage, record_usage
 
-def load_vector_store(embedding: Embeddings, path: str = "vector_store/") -> FAISS:
-    return FAISS.load_local(path, embedding, allow_dangerous_deserialization=True)
+def resident_memory_mb() -> Tuple[float, float]:
+    """Private and file-backed (shareable) resident memory of this process, if the OS reports it"""
+    memory = {}
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith(("RssAnon:", "RssFile:", "RssShmem:")):
+                    key, value = line.split(":", 1)
+                    memory[key] = int(value.split()[0]) / 1024
+    except OSError:
+        pass
+    return memory.get("RssAnon", 0.0), memory.get("RssFile", 0.0) + memory.get("RssShmem", 0.0)
 
-def retrieve_documents(db: FAISS, query: str, top_k: int = 10, min_relevance: float = 0.5) -> List[Document]:
-    results = db.similarity_search_with_relevance_scores(query, k=top_k)
-    filtered = [(doc, score) for doc, score in results if score >= min_relevance]
-    docs = [doc for doc, score in filtered]
+def open_vector_store(
+    embedding: Embeddings,
+    path: str = "vector_store/",
+    nprobe: Optional[int] = None,
+    ef_search: Optional[int] = None,
+    mmap: bool = False,
+) -> FAISS:
+    """Opens the single index at `path`. With `mmap` the index is memory-mapped read-only and can't be updated."""
+    with measure("index.load", mmap=mmap) as result:
+        db = read_vector_store(embedding, path, nprobe, ef_search, mmap)
+        result["items"] = db.index.ntotal
+    return db
+
+def read_vector_store(embedding: Embeddings, path: str, nprobe: Optional[int], ef_search: Optional[int], mmap: bool) -> FAISS:
+    started = time.perf_counter()
+    docstore_path = os.path.join(path, DOCSTORE_FILE)
+    if os.path.isfile(docstore_path):
+        docstore = SQLiteDocstore(docstore_path)
+        index = read_index(os.path.join(path, "index.faiss"), mmap=mmap)
+        db = FAISS(embedding, index, docstore, SQLiteIndexMapping(docstore))
+    else:
+        print("Loading a pickled vector store, re-run the index command to convert it to the SQLite docstore")
+        db = FAISS.load_local(path, embedding, allow_dangerous_deserialization=True)
+    config = IndexConfig.load(path)
+    if nprobe:
+        config.nprobe = nprobe
+    if ef_search:
+        config.ef_search = ef_search
+    apply_search_params(db.index, config)
+    anon_mb, file_mb = resident_memory_mb()
+    print(f"Loaded {type(db.index).__name__} with {db.index.ntotal} vectors in {(time.perf_counter() - started) * 1000:.1f}ms "
+          f"({'memory-mapped' if mmap else 'in memory'}), resident memory: {anon_mb:.0f} MB private, {file_mb:.0f} MB file-backed")
+    return db
+
+def load_vector_store(
+    embedding: Embeddings,
+    path: str = "vector_store/",
+    nprobe: Optional[int] = None,
+    ef_search: Optional[int] = None,
+    mmap: bool = False,
+) -> SearchableStore:
+    """
+    Opens the vector store at `path` for searching. If it has shards, they are opened together as one
+    `ShardedVectorStore`. An unsharded index next to shards is refused, its chunks would be found twice.
+    """
+    paths = store_paths(path)
+    if len(paths) > 1 and has_root_index(path):
+        raise ValueError(f"{path} has both an unsharded index and shards, run `index --shard NAME` or "
+                         "`index --num-shards N` again to move the unsharded sources into the shards")
+    if len(paths) <= 1:
+        return open_vector_store(embedding, paths[0] if paths else path, nprobe, ef_search, mmap)
+    shards = {os.path.relpath(shard, path): open_vector_store(embedding, shard, nprobe, ef_search, mmap) for shard in paths}
+    db = ShardedVectorStore(shards, embedding)
+    print(f"Searching {len(shards)} shards with {db.ntotal} vectors in total")
+    return db
+
+def vector_count(db: SearchableStore) -> int:
+    return db.ntotal if isinstance(db, ShardedVectorStore) else db.index.ntotal
+
+def lexical_searcher(db: SearchableStore) -> Optional[Callable[..., List[Tuple[Document, float]]]]:
+    """The BM25 search of the vector store, if all of its docstores have a full text index"""
+    if isinstance(db, ShardedVectorStore):
+        return db.search_lexical if db.has_lexical_index else None
+    return db.docstore.search_lexical if isinstance(db.docstore, SQLiteDocstore) else None
+
+RETRIEVAL_MODES = ("vector", "lexical", "hybrid")
+# Damping constant of reciprocal rank fusion, 60 as in the original paper
+RRF_K = 60
+
+def similarity_search_by_vectors(
+    db: SearchableStore, embeddings: List[List[float]], k: int, search_filter: Optional[SearchFilter] = None
+) -> List[List[Tuple[Document, float]]]:
+    """The `k` nearest chunks of each embedding with their raw scores, in one batched index search"""
+    if isinstance(db, ShardedVectorStore):
+        return db.similarity_search_with_score_by_vectors(embeddings, k=k, search_filter=search_filter)
+    return search_by_vectors(db, embeddings, k=k, search_filter=search_filter)
+
+def search_vector(
+    db: SearchableStore,
+    query: str,
+    top_k: int,
+    min_relevance: float,
+    query_embedding: Optional[List[float]] = None,
+    search_filter: Optional[SearchFilter] = None,
+) -> List[Document]:
+    if query_embedding is None:
+        query_embedding = db.embeddings.embed_query(query)
+    with measure("search", top_k, filtered=search_filter is not None):
+        relevance_score_fn = db._select_relevance_score_fn()
+        if search_filter is None:
+            scored = db.similarity_search_with_score_by_vector(query_embedding, k=top_k)
+        else:
+            scored = similarity_search_by_vectors(db, [query_embedding], top_k, search_filter)[0]
+        results = [(doc, relevance_score_fn(score)) for doc, score in scored]
+    docs = [doc for doc, score in results if score >= min_relevance]
+    print(f"Filtered {len(results) - len(docs)} results below relevance threshold {min_relevance}")
+    return docs
+
+def search_embeddings(
+    db: SearchableStore,
+    embeddings: List[List[float]],
+    top_k: int,
+    min_relevance: float,
+    search_filter: Optional[SearchFilter] = None,
+) -> List[List[Tuple[Document, float]]]:
+    """The chunks of each query embedding at or above `min_relevance`, with their relevance, in one batched index search"""
+    if not embeddings:
+        return []
+    with measure("search", len(embeddings), batched=True, filtered=search_filter is not None):
+        results = similarity_search_by_vectors(db, embeddings, top_k, search_filter)
+    relevance_score_fn = db._select_relevance_score_fn()
+    return [[(doc, relevance) for doc, relevance in ((doc, relevance_score_fn(score)) for doc, score in query_results)
+             if relevance >= min_relevance] for query_results in results]
+
+def search_vectors(
+    db: SearchableStore, queries: List[str], top_k: int, min_relevance: float, search_filter: Optional[SearchFilter] = None
+) -> List[List[Document]]:
+    """`search_vector` for several queries with one embedding request and one batched index search"""
+    if not queries:
+        return []
+    results = search_embeddings(db, embed_queries(db.embeddings, queries), top_k, min_relevance, search_filter)
+    return [[doc for doc, _ in query_results] for query_results in results]
+
+def fuse_rankings(rankings: List[List[Document]], top_k: int) -> List[Document]:
+    """Reciprocal rank fusion: each document scores the sum of 1 / (RRF_K + rank) over the rankings it appears in"""
+    scores: Dict[str, float] = {}
+    docs: Dict[str, Document] = {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking, start=1):
+            key = doc.id or doc.page_content
+            scores[key] = scores.get(key, 0.0) + 1.0 / (RRF_K + rank)
+            docs.setdefault(key, doc)
+    return [docs[key] for key in sorted(scores, key=scores.get, reverse=True)[:top_k]]
+
+def retrieve_documents(
+    db: SearchableStore,
+    query: str,
+    top_k: int = 10,
+    min_relevance: float = 0.5,
+    query_embedding: Optional[List[float]] = None,
+    mode: str = "vector",
+    search_filter: Optional[SearchFilter] = None,
+) -> List[Document]:
+    """
+    Retrieves the `top_k` chunks for `query`: by embedding similarity ("vector"), by BM25 keyword match without
+    calling the embedding model ("lexical"), or both fused by reciprocal rank ("hybrid").
+    With `search_filter` only the chunks of the matching sources are searched.
+    """
+    if mode not in RETRIEVAL_MODES:
+        raise ValueError(f"Unknown retrieval mode '{mode}', expected one of {', '.join(RETRIEVAL_MODES)}")
+    search_lexical = lexical_searcher(db)
+    if mode != "vector" and search_lexical is None:
+        print("This vector store has no lexical index, re-run the index command to create it. Using vector search.")
+        mode = "vector"
+
+    if search_filter is not None:
+        print(f"Searching only chunks with {search_filter.describe()}")
+    with measure("retrieve", mode=mode, filtered=search_filter is not None) as result:
+        if mode == "lexical":
+            docs = [doc for doc, _ in search_lexical(query, top_k, search_filter)]
+        elif mode == "hybrid":
+            lexical = [doc for doc, _ in search_lexical(query, top_k, search_filter)]
+            docs = fuse_rankings([search_vector(db, query, top_k, min_relevance, query_embedding, search_filter), lexical], top_k)
+        else:
+            docs = search_vector(db, query, top_k, min_relevance, query_embedding, search_filter)
+        result["items"] = len(docs)
     sources = {doc.metadata.get("source") for doc in docs if "source" in doc.metadata}
     print(f"Distinct source files: {sources}")
-    print(f"Filtered {len(results) - len(docs)} results below relevance threshold {min_relevance}")
     return docs
 
-def generate_rag_response(llm: ChatOllama, docs: List[Document], query: str) -> str:
-    context = "\n---\n".join(doc.page_content for doc in docs)
-    prompt = (
+def build_rag_prompt(docs: List[Document], query: str, token_budget: Optional[int] = None) -> str:
+    context = pack_context(docs, token_budget).text
+    return (
         f"You are a helpful assistant. Use only the following context to answer the question. "
         f"If the answer isn't in the context, say 'I don't know'.\n"
         f"Context: {context}\nQuestion: {query}\nAnswer:"
     )
-    response = llm.invoke([HumanMessage(content=prompt)])
-    return response.content
\ No newline at end of file
+
+def generate_rag_response(llm: ChatOllama, docs: List[Document], query: str, token_budget: Optional[int] = None) -> str:
+    prompt = build_rag_prompt(docs, query, token_budget)
+    with measure("generate"):
+        response = llm.invoke([HumanMessage(content=prompt)])
+    record_usage("generate", response)
+    return response.content
+
+class StreamingResponse:
+    """
+    Iterates over the tokens of a RAG answer as the LLM generates them.
+    Afterwards `text` holds the whole answer, and the time to first token and the throughput are recorded.
+    """
+
+    def __init__(self, llm: ChatOllama, docs: List[Document], query: str, token_budget: Optional[int] = None):
+        self.llm = llm
+        self.prompt = build_rag_prompt(docs, query, token_budget)
+        self.text = ""
+        self.tokens = 0
+        self.first_token_s: Optional[float] = None
+        self.total_s: Optional[float] = None
+
+    def __iter__(self) -> Iterator[str]:
+        started = time.perf_counter()
+        parts = []
+        for chunk in self.llm.stream([HumanMessage(content=self.prompt)]):
+            if chunk.usage_metadata:
+                # Ollama reports the exact number of generated tokens with the last chunk
+                self.tokens = chunk.usage_metadata.get("output_tokens", self.tokens)
+                record_usage("generate", chunk)
+            if not chunk.content:
+                continue
+            if self.first_token_s is None:
+                self.first_token_s = time.perf_counter() - started
+            if not chunk.usage_metadata:
+                self.tokens += 1
+            parts.append(chunk.content)
+            yield chunk.content
+        self.total_s = time.perf_counter() - started
+        self.text = "".join(parts)
+        record_stage("generate", self.total_s, streamed=True)
+        if self.first_token_s is not None:
+            record_stage("first_token", self.first_token_s)
+
+    @property
+    def tokens_per_second(self) -> float:
+        if self.first_token_s is None or self.total_s is None or self.total_s <= self.first_token_s:
+            return 0.0
+        return self.tokens / (self.total_s - self.first_token_s)
+
+    def stats(self) -> str:
+        if self.first_token_s is None:
+            return "No tokens generated"
+        return (f"First token after {self.first_token_s:.2f}s, {self.tokens} tokens in {self.total_s:.2f}s "
+                f"({self.tokens_per_second:.1f} tokens/s)")
+
+def stream_rag_response(llm: ChatOllama, docs: List[Document], query: str, token_budget: Optional[int] = None) -> StreamingResponse:
+    """Like `generate_rag_response`, but yields the answer token by token as it is generated"""
+    return StreamingResponse(llm, docs, query, token_budget)
+
+def answer_query(
+    db: SearchableStore,
+    llm: ChatOllama,
+    query: str,
+    cache: Optional[QueryCache] = None,
+    mode: str = "vector",
+    on_token: Optional[Callable[[str], None]] = None,
+    token_budget: Optional[int] = None,
+    search_filter: Optional[SearchFilter] = None,
+) -> Tuple[str, List[Document]]:
+    """
+    Retrieves and generates an answer for `query`, reusing a cached answer for the same or a similar query
+    asked with the same retrieval mode, context budget and filter.
+    With `on_token` the answer is streamed and each token is passed to it as soon as it is generated.
+    The retrieved chunks are packed into at most `token_budget` tokens of context.
+    """
+    params = answer_params(mode, token_budget, search_filter)
+    query_embedding = None
+    if cache:
+        hit = cache.get_exact(query, params)
+        # The semantic tier needs the query embedding, which lexical retrieval avoids computing
+        if hit is None and cache.semantic_threshold is not None and mode != "lexical":
+            query_embedding = db.embeddings.embed_query(query)
+            hit = cache.get_semantic(query_embedding, params)
+        if hit:
+            print(f"Answer served from the {hit.tier} query cache")
+            if on_token:
+                on_token(hit.answer)
+                print()
+            return hit.answer, hit.documents
+
+    docs = retrieve_documents(db, query, query_embedding=query_embedding, mode=mode, search_filter=search_filter)
+    if on_token:
+        response = stream_rag_response(llm, docs, query, token_budget)
+        for token in response:
+            on_token(token)
+        print(f"\n{response.stats()}")
+        answer = response.text
+    else:
+        answer = generate_rag_response(llm, docs, query, token_budget)
+    if cache:
+        cache.put(query, params, answer, docs, query_embedding)
+    return answer, docs
\ No newline at end of file
@@ -0,0 +1,155 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from array import array
+from dataclasses import asdict, dataclass
+from typing import TYPE_CHECKING, List, Optional
+from app.index_config import store_version
+from app.metrics import record_cache
+from app.settings import Settings
+
+if TYPE_CHECKING:
+    from langchain_core.documents import Document
+    from app.search_filter import SearchFilter
+
+def normalize_query(query: str) -> str:
+    return re.sub(r"\s+", " ", query).strip().lower()
+
+def answer_params(mode: str, token_budget: Optional[int] = None, search_filter: Optional["SearchFilter"] = None) -> str:
+    """Everything besides the question which changes the retrieved chunks or the prompt, so answers are only reused for the same"""
+    return json.dumps({"mode": mode, "token_budget": token_budget, "filter": asdict(search_filter) if search_filter else None},
+                      sort_keys=True)
+
+@dataclass
+class CachedAnswer:
+    answer: str
+    documents: List["Document"]
+    tier: str
+
+class QueryCache:
+    """
+    A two-tier cache of RAG answers, stored in SQLite:
+    - exact: keyed by (normalized query, index version, model, `answer_params`)
+    - semantic (optional): reuses the answer of a cached query with the same parameters whose embedding is
+      within `semantic_threshold` cosine distance of the new query's embedding
+    Entries expire after `ttl` seconds, the least recently used ones are evicted beyond `max_entries`,
+    and entries of other index versions are dropped, so a rebuilt index invalidates the cache.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        index_version: str,
+        model: str,
+        ttl: float = 86400,
+        max_entries: int = 1000,
+        semantic_threshold: Optional[float] = None,
+    ):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.index_version = index_version
+        self.model = model
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.semantic_threshold = semantic_threshold
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS answers ("
+            " key TEXT PRIMARY KEY, index_version TEXT NOT NULL, model TEXT NOT NULL, query TEXT NOT NULL,"
+            " embedding BLOB, answer TEXT NOT NULL, documents TEXT NOT NULL,"
+            " created REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS answers_last_access ON answers (last_access)")
+        if "params" not in {row[1] for row in self._conn.execute("PRAGMA table_info(answers)")}:
+            # Entries of older versions have no parameters, so they match no query anymore and expire
+            self._conn.execute("ALTER TABLE answers ADD COLUMN params TEXT NOT NULL DEFAULT ''")
+        self._conn.execute("DELETE FROM answers WHERE index_version != ? OR created < ?", (index_version, time.time() - ttl))
+        self._conn.commit()
+
+    def _key(self, query: str, params: str) -> str:
+        text = f"{self.index_version}\n{self.model}\n{params}\n{normalize_query(query)}"
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def _hit(self, key: str, answer: str, documents: str, tier: str) -> CachedAnswer:
+        from langchain_core.documents import Document
+        self._conn.execute("UPDATE answers SET last_access = ? WHERE key = ?", (time.time(), key))
+        self._conn.commit()
+        docs = [Document(page_content=doc["page_content"], metadata=doc["metadata"]) for doc in json.loads(documents)]
+        return CachedAnswer(answer=answer, documents=docs, tier=tier)
+
+    def get_exact(self, query: str, params: str) -> Optional[CachedAnswer]:
+        key = self._key(query, params)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT answer, documents FROM answers WHERE key = ? AND created >= ?", (key, time.time() - self.ttl)
+            ).fetchone()
+            record_cache("query_exact", int(row is not None), int(row is None))
+            if row is None:
+                return None
+            return self._hit(key, row[0], row[1], "exact")
+
+    def get_semantic(self, query_embedding: List[float], params: str) -> Optional[CachedAnswer]:
+        if self.semantic_threshold is None:
+            return None
+        import numpy as np
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, embedding FROM answers"
+                " WHERE index_version = ? AND model = ? AND params = ? AND embedding IS NOT NULL AND created >= ?",
+                (self.index_version, self.model, params, time.time() - self.ttl),
+            ).fetchall()
+            if not rows:
+                record_cache("query_semantic", misses=1)
+                return None
+            cached = np.array([np.frombuffer(blob, dtype=np.float32) for _, blob in rows])
+            query = np.asarray(query_embedding, dtype=np.float32)
+            similarities = cached @ query / (np.linalg.norm(cached, axis=1) * np.linalg.norm(query) + 1e-12)
+            best = int(np.argmax(similarities))
+            if 1.0 - similarities[best] > self.semantic_threshold:
+                record_cache("query_semantic", misses=1)
+                return None
+            record_cache("query_semantic", hits=1)
+            key = rows[best][0]
+            answer, documents = self._conn.execute("SELECT answer, documents FROM answers WHERE key = ?", (key,)).fetchone()
+            return self._hit(key, answer, documents, "semantic")
+
+    def put(
+        self,
+        query: str,
+        params: str,
+        answer: str,
+        documents: List["Document"],
+        query_embedding: Optional[List[float]] = None,
+    ) -> None:
+        now = time.time()
+        blob = array("f", query_embedding).tobytes() if query_embedding is not None else None
+        docs = json.dumps([{"page_content": doc.page_content, "metadata": doc.metadata} for doc in documents], default=str)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO answers (key, index_version, model, query, embedding, answer, documents,"
+                " created, last_access, params) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (self._key(query, params), self.index_version, self.model, query, blob, answer, docs, now, now, params),
+            )
+            self._conn.execute(
+                "DELETE FROM answers WHERE key IN (SELECT key FROM answers ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            self._conn.commit()
+
+def open_query_cache(settings: Settings, vector_store_path: str = "vector_store/") -> Optional[QueryCache]:
+    if not settings.query_cache:
+        return None
+    return QueryCache(
+        settings.query_cache_path,
+        index_version=store_version(vector_store_path),
+        model=settings.llm_model,
+        ttl=settings.query_cache_ttl,
+        max_entries=settings.query_cache_max_entries,
+        semantic_threshold=settings.semantic_cache_threshold,
+    )
@@ -0,0 +1,71 @@
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+_GLOB_CHARACTERS = "*?["
+
+@dataclass(frozen=True)
+class SearchFilter:
+    """
+    Restricts a search to the chunks of matching sources: a source path prefix or glob pattern, file types
+    (extensions, or "url"), and a range of ingest times (seconds since the epoch, `until` exclusive).
+    """
+    source: Optional[str] = None
+    types: Tuple[str, ...] = field(default_factory=tuple)
+    since: Optional[float] = None
+    until: Optional[float] = None
+
+    @classmethod
+    def parse(
+        cls,
+        source: Optional[str] = None,
+        types: Optional[str] = None,
+        since: Optional[str] = None,
+        until: Optional[str] = None,
+    ) -> Optional["SearchFilter"]:
+        """A filter from command line or tool arguments, or None if none is given. Raises ValueError for bad dates."""
+        search_filter = cls(
+            source=source or None,
+            types=tuple(sorted({kind.strip().lstrip(".").lower() for kind in (types or "").split(",") if kind.strip()})),
+            since=parse_time(since) if since else None,
+            until=parse_time(until, end_of_day=True) if until else None,
+        )
+        return None if search_filter.is_empty() else search_filter
+
+    @classmethod
+    def from_dict(cls, data: Optional[Dict[str, Any]]) -> Optional["SearchFilter"]:
+        data = data or {}
+        return cls.parse(data.get("source"), data.get("type"), data.get("since"), data.get("until"))
+
+    def is_empty(self) -> bool:
+        return not self.source and not self.types and self.since is None and self.until is None
+
+    def source_pattern(self) -> Optional[str]:
+        """A GLOB pattern for `source`: used as given if it has wildcards, otherwise matching it as a prefix"""
+        if not self.source:
+            return None
+        if any(character in self.source for character in _GLOB_CHARACTERS):
+            return self.source
+        return self.source + "*"
+
+    def describe(self) -> str:
+        parts: List[str] = []
+        if self.source:
+            parts.append(f"source {self.source_pattern()}")
+        if self.types:
+            parts.append(f"type {', '.join(self.types)}")
+        if self.since is not None:
+            parts.append(f"ingested since {datetime.fromtimestamp(self.since):%Y-%m-%d %H:%M}")
+        if self.until is not None:
+            parts.append(f"ingested before {datetime.fromtimestamp(self.until):%Y-%m-%d %H:%M}")
+        return ", ".join(parts)
+
+def parse_time(value: str, end_of_day: bool = False) -> float:
+    """Seconds since the epoch of an ISO date or date and time in local time. A date alone ends at midnight if `end_of_day`."""
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"Invalid date '{value}', expected YYYY-MM-DD or YYYY-MM-DDTHH:MM")
+    if end_of_day and len(value) <= 10:
+        parsed += timedelta(days=1)
+    return parsed.timestamp()
@@ -0,0 +1,152 @@
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Optional
+from langchain_ollama import ChatOllama
+from app.embeddings import get_embedding
+from app.query import load_vector_store, retrieve_documents, answer_query, vector_count
+from app.query_cache import open_query_cache
+from app.search_filter import SearchFilter
+from app.settings import Settings
+
+class PromptMindService:
+    """Holds the index, the models and the query cache, loaded once and shared by all requests"""
+
+    def __init__(self, settings: Settings, vector_store_path: str = "vector_store/"):
+        started = time.perf_counter()
+        self.settings = settings
+        self.embedding = get_embedding(settings)
+        self.db = load_vector_store(self.embedding, vector_store_path, nprobe=settings.ivf_nprobe,
+                                    ef_search=settings.hnsw_ef_search, mmap=settings.mmap_index)
+        self.llm = ChatOllama(model=settings.llm_model, base_url=settings.ollama_url, temperature=0)
+        self.llms: Dict[str, ChatOllama] = {settings.llm_model: self.llm}
+        self._lock = threading.Lock()
+        self.cache = open_query_cache(settings, vector_store_path)
+        print(f"Service ready in {time.perf_counter() - started:.2f}s")
+
+    def get_llm(self, model: Optional[str] = None) -> ChatOllama:
+        """The chat model a client asked for, created on first use, or the server's own"""
+        model = model or self.settings.llm_model
+        with self._lock:
+            if model not in self.llms:
+                self.llms[model] = ChatOllama(model=model, base_url=self.settings.ollama_url, temperature=0)
+            return self.llms[model]
+
+    def query(
+        self,
+        prompt: str,
+        retrieval_only: bool = False,
+        mode: Optional[str] = None,
+        search_filter: Optional[SearchFilter] = None,
+        token_budget: Optional[int] = None,
+        use_cache: bool = True,
+        llm_model: Optional[str] = None,
+        on_token: Optional[Callable[[str], None]] = None,
+    ) -> Dict[str, Any]:
+        """Answers like the `query` command, with the client's retrieval mode, context budget, cache use and model"""
+        started = time.perf_counter()
+        mode = mode or self.settings.retrieval_mode
+        if retrieval_only:
+            docs = retrieve_documents(self.db, prompt, mode=mode, search_filter=search_filter)
+            answer = None
+        else:
+            answer, docs = answer_query(self.db, self.get_llm(llm_model), prompt, self.cache if use_cache else None,
+                                        mode=mode, on_token=on_token,
+                                        token_budget=token_budget or self.settings.context_token_budget,
+                                        search_filter=search_filter)
+        return {
+            "prompt": prompt,
+            "answer": answer,
+            "sources": [doc.metadata.get("source", "unknown") for doc in docs],
+            "context": [doc.page_content for doc in docs],
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+        }
+
+def make_handler(service: PromptMindService):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def send_json(self, status: int, body: Dict[str, Any]) -> None:
+            payload = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def send_chunk(self, body: Dict[str, Any]) -> None:
+            """Writes one line of a streamed response as an HTTP chunk"""
+            payload = json.dumps(body).encode("utf-8") + b"\n"
+            self.wfile.write(f"{len(payload):x}\r\n".encode("ascii") + payload + b"\r\n")
+            self.wfile.flush()
+
+        def stream_query(self, prompt: str, options: Dict[str, Any]) -> None:
+            """Sends each token as a {"token": ...} line as soon as it is generated, then the result (or an error)"""
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            try:
+                result = service.query(prompt, on_token=lambda token: self.send_chunk({"token": token}), **options)
+            except Exception as e:
+                result = {"error": f"{type(e).__name__}: {e}"}
+            self.send_chunk(result)
+            self.wfile.write(b"0\r\n\r\n")
+
+        def do_GET(self) -> None:
+            if self.path == "/health":
+                self.send_json(200, {"status": "ok", "vectors": vector_count(service.db)})
+            else:
+                self.send_json(404, {"error": "not found"})
+
+        def do_POST(self) -> None:
+            if self.path != "/query":
+                self.send_json(404, {"error": "not found"})
+                return
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                request = json.loads(self.rfile.read(length) or b"{}")
+                prompt = request["prompt"]
+            except (ValueError, KeyError):
+                self.send_json(400, {"error": "expected a JSON body with a 'prompt'"})
+                return
+            try:
+                search_filter = SearchFilter.from_dict(request.get("filter"))
+                token_budget = int(request["context_budget"]) if request.get("context_budget") else None
+            except (ValueError, TypeError) as e:
+                # Only bad request arguments are the client's fault, errors while answering are the server's
+                self.send_json(400, {"error": str(e)})
+                return
+            options = {
+                "retrieval_only": bool(request.get("retrieval_only", False)),
+                "mode": request.get("mode"),
+                "search_filter": search_filter,
+                "token_budget": token_budget,
+                "use_cache": bool(request.get("query_cache", True)),
+                "llm_model": request.get("llm_model"),
+            }
+            if request.get("stream") and not options["retrieval_only"]:
+                self.stream_query(prompt, options)
+                return
+            try:
+                self.send_json(200, service.query(prompt, **options))
+            except Exception as e:
+                self.send_json(500, {"error": f"{type(e).__name__}: {e}"})
+
+        def log_message(self, format: str, *args: Any) -> None:
+            print(f"[{threading.current_thread().name}] {self.address_string()} {format % args}")
+
+    return Handler
+
+def serve(settings: Settings, host: str = "127.0.0.1", port: int = 8765) -> None:
+    service = PromptMindService(settings)
+    server = ThreadingHTTPServer((host, port), make_handler(service))
+    server.daemon_threads = True
+    print(f"PromptMind serving on http://{host}:{port} (POST /query, GET /health), press Ctrl+C to stop")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nStopping server.")
+    finally:
+        server.server_close()
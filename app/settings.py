@@ -11,6 +11,47 @@ class Settings:
     ollama_url: str = "http://localhost:11434"
     chunk_size: int = 600
     overlap: int = 100
+    load_workers: int = os.cpu_count() or 1
+    chunk_workers: int = os.cpu_count() or 1
+    chunk_cache: bool = True
+    chunk_cache_path: str = ".cache/chunks.sqlite"
+    embed_batch_size: int = 64
+    embed_concurrency: int = 4
+    embed_max_retries: int = 3
+    max_in_flight_chunks: int = 2048
+    url_workers: int = 8
+    url_per_host: int = 2
+    url_cache: bool = True
+    url_cache_path: str = ".cache/urls.sqlite"
+    dedup: bool = True
+    dedup_threshold: float = 0.9
+    index_type: Optional[str] = None
+    ivf_nlist: int = 1024
+    ivf_nprobe: Optional[int] = None
+    hnsw_m: int = 32
+    hnsw_ef_search: Optional[int] = None
+    pq_m: int = 16
+    pq_bits: int = 8
+    index_train_size: int = 50000
+    mmap_index: bool = True
+    retrieval_mode: str = "vector"
+    context_token_budget: int = 3000
+    server_url: str = "http://127.0.0.1:8765"
+    ollama_concurrency: int = 8
+    search_workers: int = os.cpu_count() or 1
+    embedding_cache: bool = True
+    embedding_cache_path: str = ".cache/embeddings.sqlite"
+    embedding_cache_max_mb: int = 1024
+    clear_embedding_cache: bool = False
+    query_cache: bool = True
+    query_cache_path: str = ".cache/queries.sqlite"
+    query_cache_ttl: int = 86400
+    query_cache_max_entries: int = 1000
+    semantic_cache_threshold: Optional[float] = None
+    chat_thread_id: str = "default"
+    chat_history_path: str = ".cache/chat.sqlite"
+    chat_history_tokens: int = 2000
+    chat_tool_output_tokens: int = 300
 
     @classmethod
     def from_env_and_args(cls):
@@ -24,6 +65,46 @@ class Settings:
             ollama_url=os.getenv("OLLAMA_URL", cls.ollama_url),
             chunk_size=int(os.getenv("CHUNK_SIZE", cls.chunk_size)),
             overlap=int(os.getenv("OVERLAP", cls.overlap)),
+            load_workers=int(os.getenv("LOAD_WORKERS", cls.load_workers)),
+            chunk_workers=int(os.getenv("CHUNK_WORKERS", cls.chunk_workers)),
+            chunk_cache=os.getenv("CHUNK_CACHE", str(cls.chunk_cache)).lower() in ("1", "true", "yes"),
+            chunk_cache_path=os.getenv("CHUNK_CACHE_PATH", cls.chunk_cache_path),
+            embed_batch_size=int(os.getenv("EMBED_BATCH_SIZE", cls.embed_batch_size)),
+            embed_concurrency=int(os.getenv("EMBED_CONCURRENCY", cls.embed_concurrency)),
+            embed_max_retries=int(os.getenv("EMBED_MAX_RETRIES", cls.embed_max_retries)),
+            max_in_flight_chunks=int(os.getenv("MAX_IN_FLIGHT_CHUNKS", cls.max_in_flight_chunks)),
+            url_workers=int(os.getenv("URL_WORKERS", cls.url_workers)),
+            url_per_host=int(os.getenv("URL_PER_HOST", cls.url_per_host)),
+            url_cache=os.getenv("URL_CACHE", str(cls.url_cache)).lower() in ("1", "true", "yes"),
+            url_cache_path=os.getenv("URL_CACHE_PATH", cls.url_cache_path),
+            dedup=os.getenv("DEDUP", str(cls.dedup)).lower() in ("1", "true", "yes"),
+            dedup_threshold=float(os.getenv("DEDUP_THRESHOLD", cls.dedup_threshold)),
+            index_type=os.getenv("INDEX_TYPE", cls.index_type),
+            ivf_nlist=int(os.getenv("IVF_NLIST", cls.ivf_nlist)),
+            ivf_nprobe=int(os.getenv("IVF_NPROBE")) if os.getenv("IVF_NPROBE") else None,
+            hnsw_m=int(os.getenv("HNSW_M", cls.hnsw_m)),
+            hnsw_ef_search=int(os.getenv("HNSW_EF_SEARCH")) if os.getenv("HNSW_EF_SEARCH") else None,
+            pq_m=int(os.getenv("PQ_M", cls.pq_m)),
+            pq_bits=int(os.getenv("PQ_BITS", cls.pq_bits)),
+            index_train_size=int(os.getenv("INDEX_TRAIN_SIZE", cls.index_train_size)),
+            mmap_index=os.getenv("MMAP_INDEX", str(cls.mmap_index)).lower() in ("1", "true", "yes"),
+            retrieval_mode=os.getenv("RETRIEVAL_MODE", cls.retrieval_mode),
+            context_token_budget=int(os.getenv("CONTEXT_TOKEN_BUDGET", cls.context_token_budget)),
+            server_url=os.getenv("PROMPTMIND_SERVER_URL", cls.server_url),
+            ollama_concurrency=int(os.getenv("OLLAMA_CONCURRENCY", cls.ollama_concurrency)),
+            search_workers=int(os.getenv("SEARCH_WORKERS", cls.search_workers)),
+            embedding_cache=os.getenv("EMBEDDING_CACHE", str(cls.embedding_cache)).lower() in ("1", "true", "yes"),
+            embedding_cache_path=os.getenv("EMBEDDING_CACHE_PATH", cls.embedding_cache_path),
+            embedding_cache_max_mb=int(os.getenv("EMBEDDING_CACHE_MAX_MB", cls.embedding_cache_max_mb)),
+            query_cache=os.getenv("QUERY_CACHE", str(cls.query_cache)).lower() in ("1", "true", "yes"),
+            query_cache_path=os.getenv("QUERY_CACHE_PATH", cls.query_cache_path),
+            query_cache_ttl=int(os.getenv("QUERY_CACHE_TTL", cls.query_cache_ttl)),
+            query_cache_max_entries=int(os.getenv("QUERY_CACHE_MAX_ENTRIES", cls.query_cache_max_entries)),
+            semantic_cache_threshold=float(os.getenv("SEMANTIC_CACHE_THRESHOLD")) if os.getenv("SEMANTIC_CACHE_THRESHOLD") else None,
+            chat_thread_id=os.getenv("CHAT_THREAD_ID", cls.chat_thread_id),
+            chat_history_path=os.getenv("CHAT_HISTORY_PATH", cls.chat_history_path),
+            chat_history_tokens=int(os.getenv("CHAT_HISTORY_TOKENS", cls.chat_history_tokens)),
+            chat_tool_output_tokens=int(os.getenv("CHAT_TOOL_OUTPUT_TOKENS", cls.chat_tool_output_tokens)),
         )
 
         # Parse command line arguments
@@ -33,6 +114,37 @@ class Settings:
         parser.add_argument("--ollama-url", type=str, help="Ollama URL")
         parser.add_argument("--chunk-size", type=int, help="Chunk size for indexing")
         parser.add_argument("--overlap", type=int, help="Chunk overlap for indexing")
+        parser.add_argument("--load-workers", type=int, help="Number of processes used to extract text from files")
+        parser.add_argument("--chunk-workers", type=int, help="Number of processes used to split texts into chunks")
+        parser.add_argument("--no-chunk-cache", action="store_true", help="Split every text again instead of reusing cached chunk boundaries")
+        parser.add_argument("--embed-batch-size", type=int, help="Number of chunks per embedding request")
+        parser.add_argument("--embed-concurrency", type=int, help="Maximum number of embedding requests in flight")
+        parser.add_argument("--max-in-flight-chunks", type=int, help="Maximum number of chunks held between chunking and index insertion")
+        parser.add_argument("--url-workers", type=int, help="Number of URLs downloaded at the same time")
+        parser.add_argument("--url-per-host", type=int, help="Maximum number of concurrent downloads from one host")
+        parser.add_argument("--no-url-cache", action="store_true", help="Download every URL again instead of asking the server whether the cached page changed")
+        parser.add_argument("--no-dedup", action="store_true", help="Embed duplicate chunks instead of dropping them")
+        parser.add_argument("--dedup-threshold", type=float, help="Similarity (0-1) above which chunks count as near duplicates")
+        parser.add_argument("--index-type", type=str, choices=["flat", "hnsw", "ivf", "ivfpq"], help="FAISS index type used when building the index")
+        parser.add_argument("--nlist", type=int, help="Number of IVF clusters")
+        parser.add_argument("--nprobe", type=int, help="Number of IVF clusters searched per query")
+        parser.add_argument("--hnsw-m", type=int, help="Number of HNSW neighbours per node")
+        parser.add_argument("--ef-search", type=int, help="HNSW search depth")
+        parser.add_argument("--pq-m", type=int, help="Number of PQ sub-quantizers (bytes per vector at 8 bits)")
+        parser.add_argument("--train-size", type=int, help="Number of vectors used to train IVF indexes")
+        parser.add_argument("--retrieval-mode", type=str, choices=["vector", "lexical", "hybrid"], help="Retrieve by embedding similarity, by BM25 keyword match (no model call), or both fused by rank")
+        parser.add_argument("--context-budget", type=int, help="Maximum tokens of retrieved context in the prompt, 0 for no limit")
+        parser.add_argument("--server-url", type=str, help="URL of a running 'serve' process used by the query command")
+        parser.add_argument("--ollama-concurrency", type=int, help="Maximum number of Ollama requests in flight from the async API")
+        parser.add_argument("--search-workers", type=int, help="Number of threads running index searches for the async API")
+        parser.add_argument("--no-mmap", action="store_true", help="Read the index into memory instead of memory-mapping it for queries")
+        parser.add_argument("--no-embedding-cache", action="store_true", help="Bypass the on-disk embedding cache")
+        parser.add_argument("--clear-embedding-cache", action="store_true", help="Remove all entries from the on-disk embedding cache")
+        parser.add_argument("--no-query-cache", action="store_true", help="Bypass the cache of query answers")
+        parser.add_argument("--semantic-cache-threshold", type=float, help="Reuse cached answers of queries within this cosine distance")
+        parser.add_argument("--thread-id", type=str, help="Chat conversation to continue or start")
+        parser.add_argument("--history-tokens", type=int, help="Tokens of chat history sent to the model before older turns are summarized")
+        parser.add_argument("--tool-output-tokens", type=int, help="Tokens kept of each tool result of earlier chat turns")
         args, unknown_args = parser.parse_known_args()
 
         # Override with CLI args if provided
@@ -46,5 +158,67 @@ class Settings:
             settings.chunk_size = args.chunk_size
         if args.overlap:
             settings.overlap = args.overlap
+        if args.load_workers:
+            settings.load_workers = args.load_workers
+        if args.chunk_workers:
+            settings.chunk_workers = args.chunk_workers
+        if args.no_chunk_cache:
+            settings.chunk_cache = False
+        if args.embed_batch_size:
+            settings.embed_batch_size = args.embed_batch_size
+        if args.embed_concurrency:
+            settings.embed_concurrency = args.embed_concurrency
+        if args.max_in_flight_chunks:
+            settings.max_in_flight_chunks = args.max_in_flight_chunks
+        if args.url_workers:
+            settings.url_workers = args.url_workers
+        if args.url_per_host:
+            settings.url_per_host = args.url_per_host
+        if args.no_url_cache:
+            settings.url_cache = False
+        if args.no_dedup:
+            settings.dedup = False
+        if args.dedup_threshold:
+            settings.dedup_threshold = args.dedup_threshold
+        if args.index_type:
+            settings.index_type = args.index_type
+        if args.nlist:
+            settings.ivf_nlist = args.nlist
+        if args.nprobe:
+            settings.ivf_nprobe = args.nprobe
+        if args.hnsw_m:
+            settings.hnsw_m = args.hnsw_m
+        if args.ef_search:
+            settings.hnsw_ef_search = args.ef_search
+        if args.pq_m:
+            settings.pq_m = args.pq_m
+        if args.train_size:
+            settings.index_train_size = args.train_size
+        if args.retrieval_mode:
+            settings.retrieval_mode = args.retrieval_mode
+        if args.context_budget is not None:
+            settings.context_token_budget = args.context_budget
+        if args.server_url:
+            settings.server_url = args.server_url
+        if args.ollama_concurrency:
+            settings.ollama_concurrency = args.ollama_concurrency
+        if args.search_workers:
+            settings.search_workers = args.search_workers
+        if args.no_mmap:
+            settings.mmap_index = False
+        if args.no_embedding_cache:
+            settings.embedding_cache = False
+        if args.clear_embedding_cache:
+            settings.clear_embedding_cache = True
+        if args.no_query_cache:
+            settings.query_cache = False
+        if args.semantic_cache_threshold is not None:
+            settings.semantic_cache_threshold = args.semantic_cache_threshold
+        if args.thread_id:
+            settings.chat_thread_id = args.thread_id
+        if args.history_tokens:
+            settings.chat_history_tokens = args.history_tokens
+        if args.tool_output_tokens:
+            settings.chat_tool_output_tokens = args.tool_output_tokens
 
         return settings, unknown_args
\ No newline at end of file
@@ -0,0 +1,159 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple, TypeVar, Union
+import numpy as np
+from langchain_community.vectorstores import FAISS
+from langchain_community.vectorstores.utils import DistanceStrategy
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from app.docstore import SQLiteDocstore
+from app.search_filter import SearchFilter
+
+T = TypeVar("T")
+
+# While the matching vectors take up to this many bytes, a filtered search copies them out of the index and computes
+# the distances to exactly those vectors. That takes time proportional to the subset and, unlike an HNSW or IVF search
+# restricted to it, never misses a match. Larger subsets would be copied per query and shard, reading a memory-mapped
+# index into memory, so they are searched through the index instead.
+EXACT_SUBSET_BYTES = 8 << 20
+_direct_map_lock = threading.Lock()
+
+def search_subset(index: Any, vectors: np.ndarray, k: int, positions: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """The exact `k` nearest of the vectors at `positions`, read back from the index"""
+    import faiss
+
+    if isinstance(index, faiss.IndexIVF):
+        with _direct_map_lock:
+            if index.direct_map.type == faiss.DirectMap.NoMap:
+                # Lets IVF indexes return vectors by position, built once per process
+                index.make_direct_map()
+    scores, subset_indices = faiss.knn(vectors, index.reconstruct_batch(positions), min(k, len(positions)), metric=index.metric_type)
+    indices = np.where(subset_indices >= 0, positions[np.maximum(subset_indices, 0)], -1)
+    if indices.shape[1] < k:
+        missing = k - indices.shape[1]
+        indices = np.pad(indices, ((0, 0), (0, missing)), constant_values=-1)
+        scores = np.pad(scores, ((0, 0), (0, missing)), constant_values=np.nan)
+    return scores, indices
+
+def search_index(index: Any, vectors: np.ndarray, k: int, positions: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """`index.search`, restricted to the vectors at `positions` if given, returning -1 for missing results"""
+    import faiss
+
+    if positions is None:
+        return index.search(vectors, k)
+    if len(positions) == 0:
+        return np.full((len(vectors), k), np.nan, dtype=np.float32), np.full((len(vectors), k), -1, dtype=np.int64)
+    if len(positions) * index.d * 4 <= EXACT_SUBSET_BYTES:
+        return search_subset(index, vectors, k, positions)
+    # Larger subsets are searched through the index, which skips the vectors the selector rejects
+    selector = faiss.IDSelectorBatch(positions)
+    if isinstance(index, faiss.IndexIVF):
+        params = faiss.SearchParametersIVF(sel=selector, nprobe=index.nprobe)
+    elif isinstance(index, faiss.IndexHNSW):
+        params = faiss.SearchParametersHNSW(sel=selector, efSearch=index.hnsw.efSearch)
+    else:
+        params = faiss.SearchParameters(sel=selector)
+    return index.search(vectors, k, params=params)
+
+def search_by_vectors(
+    db: FAISS, embeddings: List[List[float]], k: int = 4, search_filter: Optional[SearchFilter] = None
+) -> List[List[Tuple[Document, float]]]:
+    """
+    `similarity_search_with_score_by_vector` for several vectors: one index search and one docstore lookup for all
+    of them. With `search_filter`, only the chunks it matches are searched, found through the docstore's metadata indexes.
+    """
+    import faiss
+
+    vectors = np.array(embeddings, dtype=np.float32)
+    if db._normalize_L2:
+        faiss.normalize_L2(vectors)
+    positions = None
+    if search_filter is not None:
+        if not isinstance(db.docstore, SQLiteDocstore):
+            raise ValueError("Filtered search needs the SQLite docstore, re-run the index command to convert the vector store")
+        positions = db.docstore.filter_positions(search_filter)
+    scores, indices = search_index(db.index, vectors, k, positions)
+    ids = [[db.index_to_docstore_id[int(i)] for i in row if i != -1] for row in indices]
+    if isinstance(db.docstore, SQLiteDocstore):
+        docs = db.docstore.search_many(list({id_ for row in ids for id_ in row}))
+    else:
+        docs = {id_: db.docstore.search(id_) for row in ids for id_ in row}
+    results = []
+    for row_ids, row_scores in zip(ids, scores):
+        row = []
+        for id_, score in zip(row_ids, row_scores):
+            if not isinstance(docs.get(id_), Document):
+                raise ValueError(f"Could not find document for id {id_}, got {docs.get(id_)}")
+            row.append((docs[id_], float(score)))
+        results.append(row)
+    return results
+
+class ShardedVectorStore:
+    """
+    Several FAISS vector stores searched as one. A query is embedded once, searched on all shards
+    concurrently (FAISS and SQLite release the GIL), and the per-shard top k are merged by score.
+    It only offers the search methods of `FAISS`: shards are built and updated on their own by `index --shard NAME`.
+    """
+
+    def __init__(self, shards: Dict[str, FAISS], embedding: Embeddings):
+        if not shards:
+            raise ValueError("A sharded vector store needs at least one shard")
+        self.shards = shards
+        self._embedding = embedding
+        self._executor = ThreadPoolExecutor(max_workers=len(shards), thread_name_prefix="shard")
+        # Smaller distances are better, unless all shards rank by inner product
+        self._higher_is_better = all(db.distance_strategy == DistanceStrategy.MAX_INNER_PRODUCT for db in shards.values())
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self._embedding
+
+    @property
+    def ntotal(self) -> int:
+        return sum(db.index.ntotal for db in self.shards.values())
+
+    @property
+    def has_lexical_index(self) -> bool:
+        return all(isinstance(db.docstore, SQLiteDocstore) for db in self.shards.values())
+
+    def _fan_out(self, search: Callable[[FAISS], List[T]]) -> List[List[T]]:
+        futures = [self._executor.submit(search, db) for db in self.shards.values()]
+        return [future.result() for future in futures]
+
+    def _select_relevance_score_fn(self) -> Callable[[float], float]:
+        return next(iter(self.shards.values()))._select_relevance_score_fn()
+
+    def similarity_search_with_score_by_vector(
+        self, embedding: List[float], k: int = 4, **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        results = self._fan_out(lambda db: db.similarity_search_with_score_by_vector(embedding, k=k, **kwargs))
+        merged = [result for shard_results in results for result in shard_results]
+        return sorted(merged, key=lambda result: result[1], reverse=self._higher_is_better)[:k]
+
+    def similarity_search_with_score_by_vectors(
+        self, embeddings: List[List[float]], k: int = 4, search_filter: Optional[SearchFilter] = None
+    ) -> List[List[Tuple[Document, float]]]:
+        results = self._fan_out(lambda db: search_by_vectors(db, embeddings, k, search_filter))
+        merged = []
+        for i in range(len(embeddings)):
+            candidates = [result for shard_results in results for result in shard_results[i]]
+            merged.append(sorted(candidates, key=lambda result: result[1], reverse=self._higher_is_better)[:k])
+        return merged
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs: Any) -> List[Tuple[Document, float]]:
+        return self.similarity_search_with_score_by_vector(self._embedding.embed_query(query), k=k, **kwargs)
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k=k, **kwargs)]
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k=k, **kwargs)]
+
+    def search_lexical(self, query: str, k: int = 10, search_filter: Optional[SearchFilter] = None) -> List[Tuple[Document, float]]:
+        """BM25 top k of all shards. Each shard ranks by its own term statistics, which is close enough to merge."""
+        results = self._fan_out(lambda db: db.docstore.search_lexical(query, k, search_filter))
+        merged = [result for shard_results in results for result in shard_results]
+        return sorted(merged, key=lambda result: result[1], reverse=True)[:k]
+
+# What `load_vector_store` opens: a single index, or all shards together
+SearchableStore = Union[FAISS, ShardedVectorStore]
@@ -0,0 +1,64 @@
+import os
+import re
+import shutil
+import hashlib
+from typing import List
+
+# Shards are complete vector stores of their own in `<vector store>/shards/<name>/`
+SHARDS_DIR = "shards"
+HASH_SHARD_PREFIX = "hash-"
+# The shard an unsharded vector store is moved to when the first named shard is built next to it
+ROOT_SHARD = "main"
+
+def shard_path(vector_store_path: str, name: str) -> str:
+    if not re.fullmatch(r"[\w.-]+", name) or name in (".", ".."):
+        raise ValueError(f"Invalid shard name '{name}', use letters, digits, '_', '-' and '.'")
+    return os.path.join(vector_store_path, SHARDS_DIR, name)
+
+def list_shards(vector_store_path: str) -> List[str]:
+    """Names of the shards of the vector store which contain an index"""
+    directory = os.path.join(vector_store_path, SHARDS_DIR)
+    if not os.path.isdir(directory):
+        return []
+    return sorted(name for name in os.listdir(directory) if os.path.isfile(os.path.join(directory, name, "index.faiss")))
+
+def has_root_index(vector_store_path: str) -> bool:
+    return os.path.isfile(os.path.join(vector_store_path, "index.faiss"))
+
+def store_paths(vector_store_path: str) -> List[str]:
+    """The index at the root of the vector store (if there is one) followed by all shards"""
+    paths = [vector_store_path] if has_root_index(vector_store_path) else []
+    return paths + [shard_path(vector_store_path, name) for name in list_shards(vector_store_path)]
+
+def root_files(vector_store_path: str) -> List[str]:
+    """The index, docstore, manifest and config files of the unsharded vector store"""
+    return [os.path.join(vector_store_path, name) for name in os.listdir(vector_store_path) if name != SHARDS_DIR]
+
+def move_root_to_shard(vector_store_path: str, name: str = ROOT_SHARD) -> str:
+    """Turns the unsharded vector store into the shard `name`, so its chunks aren't searched twice next to other shards"""
+    path = shard_path(vector_store_path, name)
+    if os.path.exists(path):
+        raise ValueError(f"Can't move the unsharded index to shard '{name}', a shard of that name already exists")
+    os.makedirs(path)
+    for file in root_files(vector_store_path):
+        shutil.move(file, path)
+    return path
+
+def remove_root_index(vector_store_path: str) -> None:
+    for file in root_files(vector_store_path):
+        if os.path.isdir(file):
+            shutil.rmtree(file)
+        else:
+            os.remove(file)
+
+def drop_shard(vector_store_path: str, name: str) -> bool:
+    path = shard_path(vector_store_path, name)
+    if not os.path.isdir(path):
+        return False
+    shutil.rmtree(path)
+    return True
+
+def hash_shard(source: str, num_shards: int) -> str:
+    """The shard of `source` when the vector store is split into `num_shards` by a stable hash"""
+    digest = int(hashlib.sha1(source.encode("utf-8")).hexdigest()[:8], 16)
+    return f"{HASH_SHARD_PREFIX}{digest % num_shards:02d}"
@@ -1,13 +1,45 @@
-from dotenv import load_dotenv 
-from traceloop.sdk import Traceloop
-from opentelemetry import trace
+import os
+import threading
+from contextlib import nullcontext
+from typing import Any, Optional
+from dotenv import load_dotenv
 
 if not(load_dotenv(verbose=True)):
     print("WARNING: .env not found, tracing is disabled")
 
-Traceloop.init(
-    app_name="PromptMind CLI",
-    disable_batch=True,
-)
+_tracer: Optional[Any] = None
+_tracer_lock = threading.Lock()
 
-tracer = trace.get_tracer(__name__)
\ No newline at end of file
+def tracing_enabled() -> bool:
+    """Mirrors Traceloop's own switch, which defaults to enabled"""
+    return os.getenv("TRACELOOP_TRACING_ENABLED", "true").lower() in ("1", "true", "yes")
+
+def trace_sample_ratio() -> float:
+    return min(1.0, max(0.0, float(os.getenv("TRACE_SAMPLE_RATIO", "1.0"))))
+
+def get_tracer() -> Any:
+    """Initializes Traceloop and OpenTelemetry on first use, so they are only imported when tracing is enabled"""
+    global _tracer
+    if _tracer is not None:
+        return _tracer
+    # Server and batch threads may ask for the tracer at once, Traceloop must only be initialized once
+    with _tracer_lock:
+        if _tracer is None:
+            from traceloop.sdk import Traceloop
+            from opentelemetry import trace
+            from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+
+            # Spans are exported in batches by a background thread, and only for a sample of the traces
+            Traceloop.init(
+                app_name="PromptMind CLI",
+                disable_batch=False,
+                sampler=ParentBased(TraceIdRatioBased(trace_sample_ratio())),
+            )
+            _tracer = trace.get_tracer(__name__)
+    return _tracer
+
+def start_span(name: str) -> Any:
+    """`tracer.start_as_current_span(name)`, or a no-op context when tracing is disabled"""
+    if not tracing_enabled():
+        return nullcontext()
+    return get_tracer().start_as_current_span(name)
@@ -0,0 +1,178 @@
+import os
+import time
+import sqlite3
+import threading
+from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Iterator, List, Optional
+from urllib.parse import urlparse
+import httpx
+from bs4 import BeautifulSoup
+from langchain_core.documents import Document
+from app.metrics import measure, record_cache
+
+@dataclass
+class Page:
+    """A fetched URL. `not_modified` means the server confirmed the cached body with a 304 response."""
+    url: str
+    body: bytes = b""
+    encoding: Optional[str] = None
+    content_type: str = ""
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    not_modified: bool = False
+    error: Optional[str] = None
+    seconds: float = 0.0
+
+def parse_page(page: Page) -> List[Document]:
+    """The text and metadata of an HTML (or XML) page, like `WebBaseLoader` extracts them"""
+    # Without a charset in the response headers, BeautifulSoup detects the encoding from the markup
+    markup = page.body.decode(page.encoding, errors="replace") if page.encoding else page.body
+    soup = BeautifulSoup(markup, "xml" if page.url.endswith(".xml") else "html.parser")
+    metadata = {"source": page.url}
+    if soup.find("title"):
+        metadata["title"] = soup.find("title").get_text()
+    description = soup.find("meta", attrs={"name": "description"})
+    metadata["description"] = description.get("content", "No description found.") if description else "No description found."
+    html = soup.find("html")
+    metadata["language"] = html.get("lang", "No language found.") if html else "No language found."
+    return [Document(page_content=soup.get_text(), metadata=metadata)]
+
+class PageCache:
+    """Response bodies in SQLite with their ETag and Last-Modified, for conditional requests on the next fetch"""
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS pages ("
+            " url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, content_type TEXT NOT NULL,"
+            " encoding TEXT, body BLOB NOT NULL, fetched REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get(self, url: str) -> Optional[Page]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT etag, last_modified, content_type, encoding, body FROM pages WHERE url = ?", (url,)
+            ).fetchone()
+        if row is None:
+            return None
+        etag, last_modified, content_type, encoding, body = row
+        return Page(url=url, body=body, encoding=encoding, content_type=content_type, etag=etag, last_modified=last_modified)
+
+    def put(self, page: Page) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (page.url, page.etag, page.last_modified, page.content_type, page.encoding, page.body, time.time()),
+            )
+            self._conn.commit()
+
+    def remove(self, url: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM pages WHERE url = ?", (url,))
+            self._conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+class UrlFetcher:
+    """
+    Downloads URLs on `workers` threads over one pooled HTTP client, with at most `per_host` requests to
+    the same host at a time. With a `cache`, URLs fetched before are requested conditionally (If-None-Match,
+    If-Modified-Since), and a 304 response returns the cached body without downloading it again.
+    """
+
+    def __init__(self, workers: int = 8, per_host: int = 2, cache: Optional[PageCache] = None, timeout: float = 30.0):
+        self.workers = max(1, workers)
+        self.per_host = max(1, per_host)
+        self.cache = cache
+        self.client = httpx.Client(
+            limits=httpx.Limits(max_connections=self.workers, max_keepalive_connections=self.workers),
+            headers={"User-Agent": os.getenv("USER_AGENT", "PromptMind")},
+            follow_redirects=True,
+            timeout=timeout,
+        )
+        self._hosts: Dict[str, threading.Semaphore] = {}
+        self._lock = threading.Lock()
+        self.downloaded = 0
+        self.not_modified = 0
+        self.bytes_downloaded = 0
+        self.bytes_saved = 0
+
+    def host_limit(self, url: str) -> threading.Semaphore:
+        host = urlparse(url).netloc
+        with self._lock:
+            if host not in self._hosts:
+                self._hosts[host] = threading.Semaphore(self.per_host)
+            return self._hosts[host]
+
+    def fetch(self, url: str) -> Page:
+        """Fetches one URL, returning a page with `error` set instead of raising"""
+        started = time.perf_counter()
+        cached = self.cache.get(url) if self.cache else None
+        headers = {}
+        if cached and cached.etag:
+            headers["If-None-Match"] = cached.etag
+        if cached and cached.last_modified:
+            headers["If-Modified-Since"] = cached.last_modified
+        try:
+            with self.host_limit(url), measure("fetch") as result:
+                response = self.client.get(url, headers=headers)
+                result["status"] = response.status_code
+                if response.status_code == 304 and cached:
+                    page = cached
+                    page.not_modified = True
+                else:
+                    response.raise_for_status()
+                    page = Page(
+                        url=url,
+                        body=response.content,
+                        encoding=response.charset_encoding,
+                        content_type=response.headers.get("Content-Type", ""),
+                        etag=response.headers.get("ETag"),
+                        last_modified=response.headers.get("Last-Modified"),
+                    )
+        except httpx.HTTPError as e:
+            message = str(e).splitlines()[0] if str(e) else ""
+            return Page(url=url, error=f"{type(e).__name__}: {message}", seconds=time.perf_counter() - started)
+        page.seconds = time.perf_counter() - started
+
+        with self._lock:
+            if page.not_modified:
+                self.not_modified += 1
+                self.bytes_saved += len(page.body)
+            else:
+                self.downloaded += 1
+                self.bytes_downloaded += len(page.body)
+        if self.cache:
+            record_cache("url", hits=int(page.not_modified), misses=int(not page.not_modified))
+            if not page.not_modified:
+                # Bodies without a validator can't be requested conditionally, so there is no use keeping them
+                if page.etag or page.last_modified:
+                    self.cache.put(page)
+                elif cached:
+                    self.cache.remove(url)
+        return page
+
+    def fetch_many(self, urls: List[str]) -> Iterator[Page]:
+        """Fetches `urls` concurrently, yielding each page as soon as it is complete"""
+        with ThreadPoolExecutor(max_workers=min(self.workers, max(1, len(urls))), thread_name_prefix="fetch") as executor:
+            futures = [executor.submit(self.fetch, url) for url in urls]
+            for future in as_completed(futures):
+                yield future.result()
+
+    def stats(self) -> str:
+        return (f"URLs: {self.downloaded} downloaded ({self.bytes_downloaded / 1024:.1f} KB), "
+                f"{self.not_modified} not modified ({self.bytes_saved / 1024:.1f} KB not downloaded again)")
+
+    def close(self) -> None:
+        self.client.close()
+        if self.cache:
+            self.cache.close()
@@ -0,0 +1,255 @@
+# This script benchmarks the ingest and query hot paths without a live Ollama. It starts the stub server of
+# scripts/ollama_stub.py, generates a synthetic corpus, and runs indexing and querying in separate processes
+# so each phase reports its own peak memory. Results are written as JSON and can be compared to an earlier run.
+#
+#   python scripts/benchmark.py [--docs 500] [--doc-words 800] [--queries 50] [--json results.json]
+#   python scripts/benchmark.py --embed-latency 0.05 --token-latency 0.01 --baseline results.json
+
+import os
+import sys
+import json
+import time
+import shutil
+import random
+import argparse
+import resource
+import tempfile
+import subprocess
+from argparse import Namespace
+from typing import Any, Dict, List
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# Metrics compared against a baseline, and whether a higher value is better
+COMPARED_METRICS = {
+    "index.docs_per_s": True,
+    "index.chunks_per_s": True,
+    "index.peak_rss_mb": False,
+    "query.retrieval_p50_ms": False,
+    "query.retrieval_p95_ms": False,
+    "query.first_token_p50_ms": False,
+    "query.end_to_end_p50_ms": False,
+    "query.end_to_end_p95_ms": False,
+    "query.peak_rss_mb": False,
+}
+
+def topic_words(rng: random.Random, topics: int, words_per_topic: int = 40) -> List[List[str]]:
+    syllables = ["ka", "lo", "mi", "ne", "ru", "ta", "vo", "zi", "pe", "su", "do", "ga"]
+    return [["".join(rng.choice(syllables) for _ in range(3)) + str(topic) for _ in range(words_per_topic)]
+            for topic in range(topics)]
+
+def topic_text(rng: random.Random, words: List[str], count: int) -> List[str]:
+    common = ["the", "of", "and", "system", "data", "process", "result", "value", "method", "time", "model", "use"]
+    return [rng.choice(words) if rng.random() < 0.6 else rng.choice(common) for _ in range(count)]
+
+def generate_corpus(path: str, docs: int, doc_words: int, topics: int, seed: int = 42) -> List[str]:
+    """Writes `docs` text files mixing topic specific and common words, and returns one query per topic"""
+    rng = random.Random(seed)
+    vocabulary = topic_words(rng, topics)
+    os.makedirs(path, exist_ok=True)
+    for i in range(docs):
+        text = topic_text(rng, vocabulary[i % topics], doc_words)
+        for j in range(14, len(text), 15):
+            text[j] += "."
+        for j in range(119, len(text), 120):
+            text[j] += "\n\n"
+        with open(os.path.join(path, f"doc_{i:06d}.txt"), "w", encoding="utf-8") as f:
+            f.write(" ".join(text))
+    # Queries are drawn like the documents, so they are close enough to pass the relevance threshold
+    return [" ".join(topic_text(rng, words, 60)) for words in vocabulary]
+
+def percentiles(values: List[float], prefix: str) -> Dict[str, float]:
+    values = sorted(values)
+    result = {}
+    for p in (50, 95, 99):
+        result[f"{prefix}_p{p}_ms"] = round(values[min(len(values) - 1, int(len(values) * p / 100))], 2) if values else 0.0
+    return result
+
+def peak_rss_mb() -> float:
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+def make_settings(options: Dict[str, Any]) -> Any:
+    from app.settings import Settings
+
+    settings = Settings(embedding_cache=False, query_cache=False)
+    for key, value in options.items():
+        setattr(settings, key, value)
+    return settings
+
+def run_index_phase(options: Dict[str, Any]) -> Dict[str, Any]:
+    import faiss
+    from app.commands.index_command import index_command
+
+    corpus = options.pop("corpus")
+    settings = make_settings(options)
+    docs = len(os.listdir(corpus))
+    started = time.perf_counter()
+    index_command(Namespace(sources=[corpus], incremental=False), settings)
+    seconds = time.perf_counter() - started
+    chunks = faiss.read_index(os.path.join("vector_store", "index.faiss")).ntotal
+    return {
+        "docs": docs,
+        "chunks": chunks,
+        "seconds": round(seconds, 3),
+        "docs_per_s": round(docs / seconds, 1),
+        "chunks_per_s": round(chunks / seconds, 1),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+def run_query_phase(options: Dict[str, Any]) -> Dict[str, Any]:
+    from langchain_ollama import ChatOllama
+    from app.embeddings import get_embedding
+    from app.query import load_vector_store, retrieve_documents, answer_query
+
+    queries = options.pop("queries")
+    settings = make_settings(options)
+    started = time.perf_counter()
+    db = load_vector_store(get_embedding(settings), nprobe=settings.ivf_nprobe, ef_search=settings.hnsw_ef_search,
+                           mmap=settings.mmap_index)
+    load_ms = (time.perf_counter() - started) * 1000
+    llm = ChatOllama(model=settings.llm_model, base_url=settings.ollama_url, temperature=0)
+
+    retrieval, end_to_end, first_token, hits = [], [], [], 0
+    for query in queries:
+        started = time.perf_counter()
+        hits += len(retrieve_documents(db, query))
+        retrieval.append((time.perf_counter() - started) * 1000)
+    for query in queries:
+        started = time.perf_counter()
+        first = []
+
+        def record_first_token(token: str) -> None:
+            if not first:
+                first.append((time.perf_counter() - started) * 1000)
+
+        answer_query(db, llm, query, on_token=record_first_token, token_budget=settings.context_token_budget)
+        end_to_end.append((time.perf_counter() - started) * 1000)
+        first_token.extend(first)
+    return {
+        "queries": len(queries),
+        "load_ms": round(load_ms, 2),
+        "avg_retrieved_docs": round(hits / max(1, len(queries)), 2),
+        **percentiles(retrieval, "retrieval"),
+        **percentiles(first_token, "first_token"),
+        **percentiles(end_to_end, "end_to_end"),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+def run_phase(phase: str, workdir: str, options: Dict[str, Any], verbose: bool) -> Dict[str, Any]:
+    """Runs one phase in a fresh interpreter inside `workdir`, so its memory and imports are measured in isolation"""
+    result_file = os.path.join(workdir, f"{phase}_result.json")
+    command = [sys.executable, os.path.abspath(__file__), "--phase", phase, "--phase-options", json.dumps(options),
+               "--phase-result", result_file]
+    output = None if verbose else subprocess.DEVNULL
+    completed = subprocess.run(command, cwd=workdir, stdout=output, stderr=output,
+                               env={**os.environ, "TRACELOOP_TRACING_ENABLED": "false"})
+    if completed.returncode != 0:
+        sys.exit(f"The {phase} phase failed with exit code {completed.returncode}, re-run with --verbose for its output")
+    with open(result_file, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def compare(results: Dict[str, Any], baseline_path: str, tolerance: float) -> List[str]:
+    """Prints the change of every compared metric and returns those that regressed by more than `tolerance`"""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    regressions = []
+    print(f"\nCompared to {baseline_path} ({baseline.get('commit', 'unknown commit')}):")
+    for metric, higher_is_better in COMPARED_METRICS.items():
+        section, name = metric.split(".")
+        old, new = baseline.get(section, {}).get(name), results[section][name]
+        if not old:
+            continue
+        change = (new - old) / old
+        regressed = -change > tolerance if higher_is_better else change > tolerance
+        print(f"  {metric:<28} {old:>10} -> {new:>10}  {change:+.1%}{'  REGRESSION' if regressed else ''}")
+        if regressed:
+            regressions.append(metric)
+    return regressions
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return ""
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark indexing and querying against a local Ollama stub")
+    parser.add_argument("--docs", type=int, default=500, help="Number of synthetic documents")
+    parser.add_argument("--doc-words", type=int, default=800, help="Words per document")
+    parser.add_argument("--topics", type=int, default=20, help="Number of distinct topics in the corpus")
+    parser.add_argument("--queries", type=int, default=50, help="Number of queries")
+    parser.add_argument("--dim", type=int, default=768, help="Embedding dimension")
+    parser.add_argument("--embed-latency", type=float, default=0.0, help="Seconds added to every embed request")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="Seconds added per generated token")
+    parser.add_argument("--answer-tokens", type=int, default=64, help="Tokens per generated answer")
+    parser.add_argument("--index-type", help="FAISS index type to build (default: flat)")
+    parser.add_argument("--embed-batch-size", type=int, help="Chunks per embed request")
+    parser.add_argument("--embed-concurrency", type=int, help="Embed requests in flight")
+    parser.add_argument("--load-workers", type=int, help="Processes extracting text")
+    parser.add_argument("--workdir", help="Keep the corpus and vector store in this directory instead of a temporary one")
+    parser.add_argument("--json", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", help="Compare the results to this earlier JSON result file")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Relative change counted as a regression")
+    parser.add_argument("--verbose", action="store_true", help="Show the output of the benchmarked commands")
+    parser.add_argument("--phase", choices=["index", "query"], help=argparse.SUPPRESS)
+    parser.add_argument("--phase-options", help=argparse.SUPPRESS)
+    parser.add_argument("--phase-result", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.phase:
+        options = json.loads(args.phase_options)
+        result = run_index_phase(options) if args.phase == "index" else run_query_phase(options)
+        with open(args.phase_result, "w", encoding="utf-8") as f:
+            json.dump(result, f)
+        return
+
+    from ollama_stub import OllamaStub
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="promptmind-bench-")
+    for name in ("vector_store", ".cache"):
+        shutil.rmtree(os.path.join(workdir, name), ignore_errors=True)
+    corpus = os.path.join(workdir, "corpus")
+    shutil.rmtree(corpus, ignore_errors=True)
+    topics = generate_corpus(corpus, args.docs, args.doc_words, args.topics)
+    queries = [topics[i % len(topics)] for i in range(args.queries)]
+
+    settings = {"embedding_model": "stub-embed", "llm_model": "stub-llm"}
+    for key, value in (("index_type", args.index_type), ("embed_batch_size", args.embed_batch_size),
+                       ("embed_concurrency", args.embed_concurrency), ("load_workers", args.load_workers)):
+        if value:
+            settings[key] = value
+
+    try:
+        with OllamaStub(dim=args.dim, embed_latency=args.embed_latency, token_latency=args.token_latency,
+                        answer_tokens=args.answer_tokens) as stub:
+            settings["ollama_url"] = stub.url
+            print(f"Indexing {args.docs} documents of {args.doc_words} words...")
+            index = run_phase("index", workdir, {**settings, "corpus": corpus}, args.verbose)
+            print(f"Running {len(queries)} queries...")
+            query = run_phase("query", workdir, {**settings, "queries": queries}, args.verbose)
+            stub_counters = dict(stub.model.counters)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    results = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "parameters": {key: value for key, value in vars(args).items()
+                       if key not in ("json", "baseline", "verbose", "workdir") and not key.startswith("phase")},
+        "index": index,
+        "query": query,
+        "stub": stub_counters,
+    }
+    print(json.dumps({"index": index, "query": query}, indent=2))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline and compare(results, args.baseline, args.tolerance):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+# This script compares the FAISS index types supported by `app index --index-type` on the same vectors.
+# It reports recall@k against the exact (flat) index, build time, query latency and index size.
+#
+#   python scripts/benchmark_index.py [--vector-store vector_store/] [--types flat,hnsw,ivf,ivfpq] [--k 10]
+#   python scripts/benchmark_index.py --synthetic 100000 --dim 768
+
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+import faiss
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from app.index_factory import IndexConfig, INDEX_TYPES, create_index
+
+def load_vectors(args: argparse.Namespace) -> np.ndarray:
+    if args.synthetic:
+        # Clustered random vectors, which behave more like real embeddings than uniform noise
+        rng = np.random.default_rng(42)
+        centers = rng.normal(size=(max(1, args.synthetic // 100), args.dim)).astype(np.float32)
+        assignment = rng.integers(0, len(centers), size=args.synthetic)
+        return centers[assignment] + 0.3 * rng.normal(size=(args.synthetic, args.dim)).astype(np.float32)
+
+    index = faiss.read_index(os.path.join(args.vector_store, "index.faiss"))
+    if not isinstance(index, faiss.IndexFlat):
+        sys.exit("The benchmark needs the vectors of a flat index, rebuild it with --index-type flat or use --synthetic")
+    return index.reconstruct_n(0, index.ntotal)
+
+def percentile(values: list, p: float) -> float:
+    return float(np.percentile(np.array(values), p))
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark FAISS index types against the exact flat index")
+    parser.add_argument("--vector-store", default="vector_store/", help="Flat vector store to take the vectors from")
+    parser.add_argument("--synthetic", type=int, default=0, help="Use this many synthetic vectors instead")
+    parser.add_argument("--dim", type=int, default=768, help="Dimension of the synthetic vectors")
+    parser.add_argument("--types", default=",".join(INDEX_TYPES), help="Comma separated index types to compare")
+    parser.add_argument("--queries", type=int, default=200, help="Number of queries")
+    parser.add_argument("--k", type=int, default=10, help="Recall is measured for the top k results")
+    parser.add_argument("--nlist", type=int, default=IndexConfig.nlist)
+    parser.add_argument("--nprobe", type=int, default=IndexConfig.nprobe)
+    parser.add_argument("--hnsw-m", type=int, default=IndexConfig.hnsw_m)
+    parser.add_argument("--ef-search", type=int, default=IndexConfig.ef_search)
+    parser.add_argument("--pq-m", type=int, default=IndexConfig.pq_m)
+    parser.add_argument("--train-size", type=int, default=IndexConfig.train_size)
+    parser.add_argument("--json", help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    vectors = load_vectors(args)
+    rng = np.random.default_rng(0)
+    # Queries are perturbed copies of stored vectors, so each one has a meaningful neighbourhood
+    picks = rng.choice(len(vectors), size=min(args.queries, len(vectors)), replace=False)
+    queries = vectors[picks] + 0.05 * rng.normal(size=(len(picks), vectors.shape[1])).astype(np.float32)
+    print(f"{len(vectors)} vectors of dimension {vectors.shape[1]}, {len(queries)} queries, k={args.k}")
+
+    exact = faiss.IndexFlatL2(vectors.shape[1])
+    exact.add(vectors)
+    _, truth = exact.search(queries, args.k)
+
+    results = []
+    for index_type in args.types.split(","):
+        config = IndexConfig(index_type=index_type, nlist=args.nlist, nprobe=args.nprobe, hnsw_m=args.hnsw_m,
+                             ef_search=args.ef_search, pq_m=args.pq_m, train_size=args.train_size)
+        started = time.perf_counter()
+        sample = vectors[rng.permutation(len(vectors))[:config.train_size]] if config.needs_training() else vectors[:1]
+        index = create_index(config, sample)
+        index.add(vectors)
+        build_seconds = time.perf_counter() - started
+
+        latencies = []
+        found = np.empty_like(truth)
+        for i, query in enumerate(queries):
+            started = time.perf_counter()
+            _, labels = index.search(query.reshape(1, -1), args.k)
+            latencies.append((time.perf_counter() - started) * 1000)
+            found[i] = labels[0]
+
+        recall = np.mean([len(set(found[i]) & set(truth[i])) / args.k for i in range(len(queries))])
+        result = {
+            "index_type": index_type,
+            "factory": config.factory_string(),
+            f"recall@{args.k}": round(float(recall), 4),
+            "build_s": round(build_seconds, 3),
+            "latency_p50_ms": round(percentile(latencies, 50), 3),
+            "latency_p95_ms": round(percentile(latencies, 95), 3),
+            "size_mb": round(len(faiss.serialize_index(index)) / (1 << 20), 2),
+        }
+        results.append(result)
+        print(f"{index_type:>6}: recall@{args.k}={result[f'recall@{args.k}']:.3f}  build={result['build_s']:.2f}s  "
+              f"p50={result['latency_p50_ms']:.2f}ms  p95={result['latency_p95_ms']:.2f}ms  size={result['size_mb']:.1f}MB")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
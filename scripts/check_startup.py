@@ -0,0 +1,64 @@
+# This script guards the startup time of the CLI. It runs `app.py --help` in fresh interpreters and fails
+# if it takes longer than the budget or imports one of the heavy libraries that only the commands need.
+#
+#   python scripts/check_startup.py [--budget 1.0] [--runs 5]
+
+import os
+import sys
+import time
+import argparse
+import subprocess
+from typing import List, Set
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+# Libraries that must only be imported by the command that uses them (or when tracing is enabled)
+HEAVY_MODULES = ("traceloop", "opentelemetry", "langchain_ollama", "langchain_community", "langgraph", "faiss", "bs4", "tiktoken")
+
+def imported_modules(command: List[str]) -> Set[str]:
+    """Top level packages imported by `command`, taken from the `-X importtime` report"""
+    result = subprocess.run([sys.executable, "-X", "importtime", *command], cwd=ROOT, capture_output=True, text=True,
+                            env={**os.environ, "TRACELOOP_TRACING_ENABLED": "false"})
+    modules = set()
+    for line in result.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            modules.add(line.rsplit("|", 1)[1].strip().split(".")[0])
+    return modules
+
+def wall_time(command: List[str], runs: int) -> float:
+    """Best of `runs` wall clock times, which filters out noise from other processes"""
+    best = float("inf")
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, *command], cwd=ROOT, capture_output=True,
+                       env={**os.environ, "TRACELOOP_TRACING_ENABLED": "false"})
+        best = min(best, time.perf_counter() - started)
+    return best
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Check that the CLI starts quickly and imports only what it needs")
+    parser.add_argument("--budget", type=float, default=1.0, help="Maximum seconds for `app.py --help`")
+    parser.add_argument("--runs", type=int, default=5, help="Number of runs, the fastest one is compared to the budget")
+    args = parser.parse_args()
+
+    failures = []
+    checks = [
+        ["app.py", "--help"],
+        ["-c", "import app.commands.query_command"],
+    ]
+    for command in checks:
+        heavy = sorted(imported_modules(command) & set(HEAVY_MODULES))
+        print(f"{' '.join(command)}: imports {', '.join(heavy) if heavy else 'no heavy libraries'}")
+        if heavy:
+            failures.append(f"`{' '.join(command)}` imports {', '.join(heavy)}")
+
+    seconds = wall_time(["app.py", "--help"], args.runs)
+    print(f"app.py --help: {seconds:.3f}s (budget {args.budget:.3f}s)")
+    if seconds > args.budget:
+        failures.append(f"`app.py --help` took {seconds:.3f}s, more than the budget of {args.budget:.3f}s")
+
+    for failure in failures:
+        print(f"FAILED: {failure}")
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
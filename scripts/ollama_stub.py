@@ -0,0 +1,201 @@
+# A local stand-in for the parts of the Ollama HTTP API that PromptMind uses, for benchmarks and offline runs.
+# Embeddings are deterministic hashed bags of words (texts sharing words get similar vectors), answers are
+# built from the prompt, and every request can be slowed down to mimic a real model.
+#
+#   python scripts/ollama_stub.py [--port 11434] [--embed-latency 0.02] [--token-latency 0.005]
+#   python app.py --ollama-url http://127.0.0.1:11434 query "..."
+
+import re
+import json
+import time
+import zlib
+import argparse
+import threading
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterator, List
+import numpy as np
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+class StubModel:
+    """Deterministic embeddings and answers with configurable artificial latency"""
+
+    def __init__(self, dim: int = 768, embed_latency: float = 0.0, token_latency: float = 0.0, answer_tokens: int = 64):
+        self.dim = dim
+        self.embed_latency = embed_latency
+        self.token_latency = token_latency
+        self.answer_tokens = answer_tokens
+        self.counters = {"embed_requests": 0, "embedded_texts": 0, "chat_requests": 0, "generated_tokens": 0}
+        self._buckets: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def count(self, name: str, value: int = 1) -> None:
+        with self._lock:
+            self.counters[name] += value
+
+    def _bucket(self, token: str) -> int:
+        bucket = self._buckets.get(token)
+        if bucket is None:
+            # crc32 is stable across processes, unlike hash(); the sign bit halves collisions' bias
+            digest = zlib.crc32(token.encode("utf-8"))
+            bucket = (digest % self.dim) * (1 if digest & 0x80000000 else -1)
+            self._buckets[token] = bucket
+        return bucket
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        self.count("embed_requests")
+        self.count("embedded_texts", len(texts))
+        if self.embed_latency:
+            time.sleep(self.embed_latency)
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for token in TOKEN_PATTERN.findall(text.lower()):
+                bucket = self._bucket(token)
+                vectors[row, abs(bucket)] += 1.0 if bucket >= 0 else -1.0
+            if not vectors[row].any():
+                vectors[row, 0] = 1.0
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors.tolist()
+
+    def answer(self, prompt: str) -> Iterator[str]:
+        """Yields the answer token by token, echoing words of the question at the end of the prompt"""
+        self.count("chat_requests")
+        words = TOKEN_PATTERN.findall(prompt.rsplit("Question:", 1)[-1]) or ["answer"]
+        for i in range(self.answer_tokens):
+            if self.token_latency:
+                time.sleep(self.token_latency)
+            self.count("generated_tokens")
+            yield ("" if i == 0 else " ") + words[i % len(words)]
+
+def make_handler(model: StubModel):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # Headers and body are separate writes, which would otherwise wait for delayed ACKs
+        disable_nagle_algorithm = True
+
+        def send_json(self, status: int, body: Any) -> None:
+            payload = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def send_stream(self, lines: Iterator[Dict[str, Any]]) -> None:
+            """Newline delimited JSON in chunked transfer encoding, like Ollama's streaming responses"""
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for line in lines:
+                data = json.dumps(line).encode("utf-8") + b"\n"
+                self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+                self.wfile.flush()
+            self.wfile.write(b"0\r\n\r\n")
+
+        def do_GET(self) -> None:
+            if self.path == "/":
+                body = b"Ollama is running"
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            elif self.path == "/api/tags":
+                self.send_json(200, {"models": []})
+            else:
+                self.send_json(404, {"error": "not found"})
+
+        def do_POST(self) -> None:
+            length = int(self.headers.get("Content-Length", 0))
+            try:
+                request = json.loads(self.rfile.read(length) or b"{}")
+            except ValueError:
+                self.send_json(400, {"error": "invalid JSON"})
+                return
+            name = request.get("model", "stub")
+            if self.path == "/api/embed":
+                texts = request.get("input", [])
+                texts = [texts] if isinstance(texts, str) else texts
+                self.send_json(200, {"model": name, "embeddings": model.embed(texts)})
+            elif self.path == "/api/embeddings":
+                self.send_json(200, {"embedding": model.embed([request.get("prompt", "")])[0]})
+            elif self.path in ("/api/chat", "/api/generate"):
+                self.generate(name, request)
+            elif self.path == "/api/show":
+                self.send_json(200, {"modelfile": "", "parameters": "", "template": "", "details": {}, "capabilities": ["completion"]})
+            else:
+                self.send_json(404, {"error": "not found"})
+
+        def generate(self, name: str, request: Dict[str, Any]) -> None:
+            chat = self.path == "/api/chat"
+            if chat:
+                messages = request.get("messages") or [{}]
+                prompt = messages[-1].get("content", "")
+            else:
+                prompt = request.get("prompt", "")
+
+            def line(text: str, done: bool) -> Dict[str, Any]:
+                body: Dict[str, Any] = {"model": name, "created_at": datetime.now(timezone.utc).isoformat(), "done": done}
+                if chat:
+                    body["message"] = {"role": "assistant", "content": text}
+                else:
+                    body["response"] = text
+                if done:
+                    body.update(done_reason="stop", eval_count=model.answer_tokens, prompt_eval_count=len(prompt.split()))
+                return body
+
+            if request.get("stream", True):
+                def lines() -> Iterator[Dict[str, Any]]:
+                    for token in model.answer(prompt):
+                        yield line(token, False)
+                    yield line("", True)
+                self.send_stream(lines())
+            else:
+                self.send_json(200, line("".join(model.answer(prompt)), True))
+
+        def log_message(self, format: str, *args: Any) -> None:
+            pass
+
+    return Handler
+
+class OllamaStub:
+    """Runs the stub server on a background thread, e.g. `with OllamaStub(embed_latency=0.02) as stub: stub.url`"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, **model_options: Any):
+        self.model = StubModel(**model_options)
+        self.server = ThreadingHTTPServer((host, port), make_handler(self.model))
+        self.server.daemon_threads = True
+        self.url = f"http://{host}:{self.server.server_address[1]}"
+        self._thread = threading.Thread(target=self.server.serve_forever, name="ollama-stub", daemon=True)
+
+    def __enter__(self) -> "OllamaStub":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Serve a deterministic stand-in for the Ollama embed and chat API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--dim", type=int, default=768, help="Dimension of the embeddings")
+    parser.add_argument("--embed-latency", type=float, default=0.0, help="Seconds added to every embed request")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="Seconds added per generated token")
+    parser.add_argument("--answer-tokens", type=int, default=64, help="Number of tokens of every answer")
+    args = parser.parse_args()
+
+    stub = OllamaStub(args.host, args.port, dim=args.dim, embed_latency=args.embed_latency,
+                      token_latency=args.token_latency, answer_tokens=args.answer_tokens)
+    print(f"Ollama stub listening on {stub.url}, press Ctrl+C to stop")
+    try:
+        stub.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stub.server.server_close()
+
+if __name__ == "__main__":
+    main()